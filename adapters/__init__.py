@@ -1,7 +1,9 @@
 # adapters/__init__.py
-from .base_adapter import LLMAdapter
+from .base_adapter import LLMAdapter, LLMSession, LLMError, LLMTimeoutError
 from .litellm_adapter import LiteLLMAdapter
 from .ollama_adapter import OllamaAdapter
 from .factory import create_adapter
+from .registry import AdapterRegistry
+from .host_pool import OllamaHostPool
 
-__all__ = ['LLMAdapter', 'LiteLLMAdapter', 'OllamaAdapter', 'create_adapter']
\ No newline at end of file
+__all__ = ['LLMAdapter', 'LLMSession', 'LLMError', 'LLMTimeoutError', 'LiteLLMAdapter', 'OllamaAdapter', 'create_adapter', 'AdapterRegistry', 'OllamaHostPool']
\ No newline at end of file
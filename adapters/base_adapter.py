@@ -1,6 +1,26 @@
 # adapters/base_adapter.py
+import asyncio
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Optional, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Iterator
+
+class LLMError(Exception):
+    """Raised by adapters when a request to the LLM backend fails."""
+
+class LLMTimeoutError(LLMError):
+    """Raised when the LLM backend does not answer in time."""
+
+class LLMSession(ABC):
+    """Content already evaluated by a model, shared by several requests."""
+    
+    @abstractmethod
+    def generate(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        """Generate a response to a prompt that follows the session content."""
+        pass
+    
+    def stats(self) -> Dict[str, Any]:
+        """Token counts of the session, for reporting."""
+        return {}
 
 class LLMAdapter(ABC):
     """Base adapter interface for LLM communication."""
@@ -25,6 +45,111 @@ class LLMAdapter(ABC):
         """Generate a response from the LLM."""
         pass
     
+    async def agenerate(self, 
+                prompt: str, 
+                system_prompt: Optional[str] = None,
+                temperature: Optional[float] = None,
+                max_tokens: Optional[int] = None,
+                stop_sequences: Optional[List[str]] = None) -> str:
+        """
+        Generate a response from the LLM without blocking the event loop.
+        
+        Adapters with a native async client should override this. The default
+        runs the blocking `generate` in a worker thread.
+        """
+        kwargs = {"system_prompt": system_prompt, "stop_sequences": stop_sequences}
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        return await asyncio.to_thread(self.generate, prompt, **kwargs)
+    
+    def generate_stream(self, 
+                prompt: str, 
+                system_prompt: Optional[str] = None,
+                temperature: Optional[float] = None,
+                max_tokens: Optional[int] = None,
+                stop_sequences: Optional[List[str]] = None) -> Iterator[str]:
+        """
+        Generate a response from the LLM, yielding text chunks as they arrive.
+        
+        Adapters that support streaming should override this. The default
+        yields the whole response from `generate` as a single chunk.
+        """
+        kwargs = {"system_prompt": system_prompt, "stop_sequences": stop_sequences}
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        yield self.generate(prompt, **kwargs)
+    
+    def generate_batch(self, 
+                prompts: List[str], 
+                system_prompt: Optional[str] = None,
+                temperature: Optional[float] = None,
+                max_tokens: Optional[int] = None,
+                stop_sequences: Optional[List[str]] = None,
+                max_concurrency: int = 1) -> List[str]:
+        """
+        Generate responses for several prompts, returned in prompt order.
+        
+        A prompt whose request failed gets the LLMError raised for it in
+        place of a response, so one failure does not lose the whole batch.
+        
+        Adapters with a native batch API should override this. The default
+        calls `generate` for each prompt, running up to `max_concurrency`
+        requests at the same time.
+        """
+        kwargs = {"system_prompt": system_prompt, "stop_sequences": stop_sequences}
+        if temperature is not None:
+            kwargs["temperature"] = temperature
+        if max_tokens is not None:
+            kwargs["max_tokens"] = max_tokens
+        
+        def generate_one(prompt):
+            try:
+                return self.generate(prompt, **kwargs)
+            except LLMError as e:
+                return e
+        
+        if max_concurrency <= 1 or len(prompts) <= 1:
+            return [generate_one(prompt) for prompt in prompts]
+        
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(prompts))) as pool:
+            return list(pool.map(generate_one, prompts))
+    
+    def warmup(self) -> bool:
+        """
+        Load the model ahead of the first request, so it does not pay the
+        model load time.
+        
+        Returns:
+            bool: True if the adapter loaded anything, False if it has
+                nothing to warm up (the default)
+        """
+        return False
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Compute embedding vectors for texts with the configured model.
+        
+        Raises:
+            LLMError: If the adapter has no embedding support (the default)
+                or the request failed
+        """
+        raise LLMError(f"{type(self).__name__} does not support embeddings")
+    
+    def open_session(self, content: str) -> Optional["LLMSession"]:
+        """
+        Evaluate content once so later requests can build on it without
+        sending it again.
+        
+        Returns:
+            LLMSession: The session, or None if the adapter cannot reuse
+                evaluated input (the default)
+        """
+        return None
+    
     @abstractmethod
     def close(self) -> None:
         """Close any open resources or connections."""
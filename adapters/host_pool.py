@@ -0,0 +1,234 @@
+# adapters/host_pool.py
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+class HostUnavailableError(Exception):
+    """Raised when no host of a pool can take a request."""
+
+def is_host_failure(error: Exception) -> bool:
+    """
+    Check whether a failed request speaks against its host.
+
+    Connection errors, timeouts and 5xx responses do; errors the server
+    answered with, such as an unknown model, do not.
+    """
+    if isinstance(error, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status_code, int) and status_code >= 500
+
+class PooledHost:
+    """One backend server of a host pool and its routing state."""
+
+    def __init__(self, url: str, client: Any):
+        self.url = url
+        self.client = client
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.total_requests = 0
+        self.total_failures = 0
+
+    def is_available(self, now: float) -> bool:
+        """Check whether the host is currently taking requests."""
+        return now >= self.ejected_until
+
+class OllamaHostPool:
+    """
+    Routes requests across several Ollama servers.
+
+    Each request goes to the available host with the fewest outstanding
+    requests, and no host gets more than `max_requests_per_host` at once.
+    A host whose requests fail `eject_after_failures` times in a row, by
+    `is_failure`, is ejected for `eject_seconds`. A background health check polls ejected
+    hosts and takes them back as soon as they answer.
+    """
+
+    def __init__(self,
+                 urls: List[str],
+                 client_factory: Callable[[str], Any],
+                 max_requests_per_host: Optional[int] = None,
+                 eject_after_failures: int = 3,
+                 eject_seconds: float = 30.0,
+                 health_check_interval: float = 10.0,
+                 acquire_timeout: Optional[float] = None,
+                 is_failure: Callable[[Exception], bool] = is_host_failure):
+        """
+        Args:
+            urls: Base URLs of the Ollama servers
+            client_factory: Creates the client for a base URL
+            max_requests_per_host: Concurrent requests allowed per host, or None for no limit
+            eject_after_failures: Consecutive failures after which a host is ejected
+            eject_seconds: How long an ejected host is left out without a health check
+            health_check_interval: Seconds between health checks, or 0 to disable them
+            acquire_timeout: Maximum seconds a request waits for a free host
+            is_failure: Decides whether an error raised by a request counts
+                against its host
+        """
+        if not urls:
+            raise ValueError("A host pool needs at least one base URL")
+
+        self.hosts = [PooledHost(url, client_factory(url)) for url in urls]
+        self.max_requests_per_host = max_requests_per_host
+        self.eject_after_failures = max(1, int(eject_after_failures))
+        self.eject_seconds = eject_seconds
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self.is_failure = is_failure
+
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._health_thread = None
+        if health_check_interval:
+            self._health_thread = threading.Thread(
+                target=self._health_loop,
+                name="ollama-health-check",
+                daemon=True
+            )
+            self._health_thread.start()
+
+    @contextmanager
+    def acquire(self, prefer: Optional[PooledHost] = None) -> Iterator[PooledHost]:
+        """
+        Reserve the least loaded available host for one request.
+
+        Host failures raised inside the block (see is_host_failure) count
+        against the host; only a block that completes resets its failure
+        count and takes an ejected host back. Other errors, and streams
+        abandoned part way, leave the host's state as it was.
+
+        Args:
+            prefer: Host to use whenever it is available and not full, e.g.
+                the one holding a session's evaluated context
+
+        Raises:
+            HostUnavailableError: If no host becomes free within acquire_timeout
+        """
+        host = self._reserve(prefer)
+        failed = False
+        succeeded = False
+        try:
+            yield host
+            succeeded = True
+        except Exception as e:
+            failed = self.is_failure(e)
+            raise
+        finally:
+            # Also runs when an abandoned stream closes the request early
+            self._release(host, failed=failed, succeeded=succeeded)
+
+    def _reserve(self, prefer: Optional[PooledHost] = None) -> PooledHost:
+        deadline = None if self.acquire_timeout is None else time.monotonic() + self.acquire_timeout
+
+        with self._condition:
+            while True:
+                host = self._pick(time.monotonic(), prefer)
+                if host is not None:
+                    host.outstanding += 1
+                    host.total_requests += 1
+                    return host
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise HostUnavailableError(
+                        f"No Ollama host available among {[h.url for h in self.hosts]}"
+                    )
+                # Wake up periodically so expired ejections are noticed
+                self._condition.wait(timeout=min(remaining or 1.0, 1.0))
+
+    def _pick(self, now: float, prefer: Optional[PooledHost] = None) -> Optional[PooledHost]:
+        """Choose the available host with the fewest outstanding requests."""
+        if prefer is not None and prefer.is_available(now) and not self._is_full(prefer):
+            return prefer
+        candidates = [host for host in self.hosts if host.is_available(now) and not self._is_full(host)]
+        if not candidates:
+            if any(host.is_available(now) for host in self.hosts):
+                # Every available host is at its limit
+                return None
+            # Every host is ejected; try the one that comes back first
+            # rather than failing requests outright
+            candidates = [host for host in self.hosts if not self._is_full(host)]
+            if not candidates:
+                return None
+            return min(candidates, key=lambda host: (host.ejected_until, host.outstanding))
+        return min(candidates, key=lambda host: host.outstanding)
+
+    def _is_full(self, host: PooledHost) -> bool:
+        return self.max_requests_per_host is not None and host.outstanding >= self.max_requests_per_host
+
+    def _release(self, host: PooledHost, failed: bool, succeeded: bool = False) -> None:
+        with self._condition:
+            host.outstanding -= 1
+            if failed:
+                host.total_failures += 1
+                host.consecutive_failures += 1
+                if host.consecutive_failures >= self.eject_after_failures:
+                    self._eject(host)
+            elif succeeded:
+                host.consecutive_failures = 0
+                host.ejected_until = 0.0
+            self._condition.notify_all()
+
+    def _eject(self, host: PooledHost) -> None:
+        if host.is_available(time.monotonic()):
+            logger.warning(f"Ejecting Ollama host {host.url} after "
+                           f"{host.consecutive_failures} consecutive failures")
+        host.ejected_until = time.monotonic() + self.eject_seconds
+
+    def check_health(self) -> None:
+        """Probe every host once, ejecting unreachable ones and restoring recovered ones."""
+        for host in self.hosts:
+            healthy = self._probe(host.url)
+            with self._condition:
+                if healthy:
+                    if not host.is_available(time.monotonic()):
+                        logger.info(f"Ollama host {host.url} is healthy again")
+                    host.consecutive_failures = 0
+                    host.ejected_until = 0.0
+                    self._condition.notify_all()
+                else:
+                    # Keep unreachable hosts out until a check succeeds
+                    host.consecutive_failures = max(host.consecutive_failures, self.eject_after_failures)
+                    self._eject(host)
+
+    def _probe(self, url: str) -> bool:
+        """Check that an Ollama server answers its version endpoint."""
+        try:
+            response = httpx.get(f"{url.rstrip('/')}/api/version", timeout=2.0)
+            return response.status_code == 200
+        except Exception:
+            return False
+
+    def _health_loop(self) -> None:
+        while not self._stopped.wait(self.health_check_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.error(f"Error checking Ollama host health: {e}")
+
+    def stats(self) -> List[dict]:
+        """Routing counters per host."""
+        now = time.monotonic()
+        with self._condition:
+            return [{
+                "url": host.url,
+                "available": host.is_available(now),
+                "outstanding": host.outstanding,
+                "requests": host.total_requests,
+                "failures": host.total_failures
+            } for host in self.hosts]
+
+    def close(self) -> None:
+        """Stop the health checks."""
+        self._stopped.set()
+        if self._health_thread is not None:
+            self._health_thread.join(timeout=5)
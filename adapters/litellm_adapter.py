@@ -1,8 +1,27 @@
 # adapters/litellm_adapter.py
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterator
 import litellm
+import logging
 import os
-from .base_adapter import LLMAdapter
+import re
+from .base_adapter import LLMAdapter, LLMError, LLMTimeoutError
+
+logger = logging.getLogger(__name__)
+
+def resolve_api_key(api_key):
+    """
+    Expand `${ENV_VAR}` references in a configured API key.
+    
+    Returns:
+        str: The key, or None if it is empty or names an unset variable
+    """
+    if not api_key:
+        return None
+    resolved = os.path.expandvars(api_key)
+    if re.search(r"\$(\w+|\{[^}]*\})", resolved):
+        logger.warning(f"API key '{api_key}' references an unset environment variable, ignoring it")
+        return None
+    return resolved
 
 class LiteLLMAdapter(LLMAdapter):
     """Adapter for communicating with LLMs through LiteLLM."""
@@ -11,6 +30,7 @@ class LiteLLMAdapter(LLMAdapter):
         self.model = None
         self.temperature = 0.7
         self.max_tokens = 1000
+        self.timeout = 300
         self.api_key = None
         
     def initialize(self, config: Dict[str, Any]) -> None:
@@ -18,36 +38,49 @@ class LiteLLMAdapter(LLMAdapter):
         self.model = config.get("model", "gpt-3.5-turbo")
         self.temperature = config.get("temperature", 0.7)
         self.max_tokens = config.get("max_tokens", 1000)
+        self.timeout = config.get("timeout", 300)
         
-        # Handle API keys from config
-        self.api_key = config.get("api_key")
-        if self.api_key:
-            self._set_api_key(self.model, self.api_key)
+        # Passed with each request, so configs for the same provider
+        # can use different keys
+        self.api_key = resolve_api_key(config.get("api_key"))
     
     def set_config(self, config: Dict[str, Any]) -> None:
         """Update the adapter configuration."""
         self.model = config.get("model", self.model)
         self.temperature = config.get("temperature", self.temperature)
         self.max_tokens = config.get("max_tokens", self.max_tokens)
+        if config.get("api_key"):
+            self.api_key = resolve_api_key(config["api_key"])
         
-        # Update API key if provided
-        api_key = config.get("api_key")
-        if api_key and api_key != self.api_key:
-            self.api_key = api_key
-            self._set_api_key(self.model, self.api_key)
-    
-    def _set_api_key(self, model, api_key):
-        """Helper to set the appropriate API key."""
-        model_prefix = model.split("-")[0].lower()
-        if "gemini" in model_prefix:
-            os.environ["GOOGLE_API_KEY"] = api_key
-        elif "gpt" in model_prefix or "openai" in model_prefix:
-            os.environ["OPENAI_API_KEY"] = api_key
-        elif "claude" in model_prefix:
-            os.environ["ANTHROPIC_API_KEY"] = api_key
-        else:
-            # Generic fallback
-            litellm.api_key = api_key
+    def _build_request(self, prompt, system_prompt, temperature, max_tokens, stop_sequences):
+        """Build the completion arguments, falling back to initialized values."""
+        messages = []
+        
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        
+        messages.append({"role": "user", "content": prompt})
+        
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": temperature if temperature is not None else self.temperature,
+            "max_tokens": max_tokens if max_tokens is not None else self.max_tokens,
+            "stop": stop_sequences,
+            "timeout": self.timeout
+        }
+        if self.api_key:
+            request["api_key"] = self.api_key
+        return request
+        
+    def _request_error(self, error):
+        """Wrap a failed request in the matching LLMError."""
+        print(f"Error generating response with LiteLLM: {str(error)}")
+        if isinstance(error, LLMError):
+            return error
+        if isinstance(error, (litellm.Timeout, TimeoutError)):
+            return LLMTimeoutError(f"LiteLLM request timed out: {error}")
+        return LLMError(f"LiteLLM request failed: {error}")
         
     def generate(self, 
                 prompt: str, 
@@ -56,30 +89,91 @@ class LiteLLMAdapter(LLMAdapter):
                 max_tokens: Optional[int] = None,
                 stop_sequences: Optional[List[str]] = None) -> str:
         """Generate a response using LiteLLM."""
-        # Use provided params or fall back to initialized values
-        temp = temperature if temperature is not None else self.temperature
-        tokens = max_tokens if max_tokens is not None else self.max_tokens
-        
-        messages = []
-        
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
+        request = self._build_request(prompt, system_prompt, temperature, max_tokens, stop_sequences)
         
-        messages.append({"role": "user", "content": prompt})
+        try:
+            response = litellm.completion(**request)
+            
+            return response.choices[0].message.content
+        except Exception as e:
+            raise self._request_error(e) from e
+    
+    async def agenerate(self, 
+                prompt: str, 
+                system_prompt: Optional[str] = None,
+                temperature: Optional[float] = None,
+                max_tokens: Optional[int] = None,
+                stop_sequences: Optional[List[str]] = None) -> str:
+        """Generate a response using litellm.acompletion."""
+        request = self._build_request(prompt, system_prompt, temperature, max_tokens, stop_sequences)
         
         try:
-            response = litellm.completion(
-                model=self.model,
-                messages=messages,
-                temperature=temp,
-                max_tokens=tokens,
-                stop=stop_sequences
-            )
+            response = await litellm.acompletion(**request)
             
             return response.choices[0].message.content
         except Exception as e:
-            print(f"Error generating response with LiteLLM: {str(e)}")
-            return f"Error generating response: {str(e)}"
+            raise self._request_error(e) from e
+    
+    def generate_stream(self, 
+                prompt: str, 
+                system_prompt: Optional[str] = None,
+                temperature: Optional[float] = None,
+                max_tokens: Optional[int] = None,
+                stop_sequences: Optional[List[str]] = None) -> Iterator[str]:
+        """Generate a response using LiteLLM, yielding chunks as they arrive."""
+        request = self._build_request(prompt, system_prompt, temperature, max_tokens, stop_sequences)
+        
+        try:
+            for chunk in litellm.completion(stream=True, **request):
+                text = chunk.choices[0].delta.content
+                if text:
+                    yield text
+        except Exception as e:
+            raise self._request_error(e) from e
+    
+    def generate_batch(self, 
+                prompts: List[str], 
+                system_prompt: Optional[str] = None,
+                temperature: Optional[float] = None,
+                max_tokens: Optional[int] = None,
+                stop_sequences: Optional[List[str]] = None,
+                max_concurrency: Optional[int] = None) -> List[str]:
+        """Generate responses for several prompts with litellm.batch_completion."""
+        if not prompts:
+            return []
+        
+        requests = [
+            self._build_request(prompt, system_prompt, temperature, max_tokens, stop_sequences)
+            for prompt in prompts
+        ]
+        batch_kwargs = dict(requests[0])
+        batch_kwargs["messages"] = [request["messages"] for request in requests]
+        if max_concurrency:
+            batch_kwargs["max_workers"] = max_concurrency
+        
+        try:
+            responses = litellm.batch_completion(**batch_kwargs)
+        except Exception as e:
+            error = self._request_error(e)
+            return [error] * len(prompts)
+        
+        results = []
+        for response in responses:
+            # Failed requests come back as the exception instead of a response
+            if isinstance(response, Exception):
+                results.append(self._request_error(response))
+            else:
+                results.append(response.choices[0].message.content)
+        return results
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Compute embeddings with litellm.embedding."""
+        try:
+            kwargs = {"api_key": self.api_key} if self.api_key else {}
+            response = litellm.embedding(model=self.model, input=texts, timeout=self.timeout, **kwargs)
+        except Exception as e:
+            raise self._request_error(e) from e
+        return [item["embedding"] if isinstance(item, dict) else item.embedding for item in response.data]
     
     def close(self) -> None:
         """Close any open resources."""
@@ -1,8 +1,113 @@
 # adapters/ollama_adapter.py
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterator
+from contextlib import contextmanager
+import asyncio
+import threading
+import httpx
 import ollama
 import os
-from .base_adapter import LLMAdapter
+from .base_adapter import LLMAdapter, LLMSession, LLMError, LLMTimeoutError
+from .host_pool import OllamaHostPool, PooledHost
+
+# Sent once per session; the model only has to acknowledge the content
+SESSION_PRIMER = "Here is a thought to work on. Reply only with OK.\n\nThought content:\n\n{content}"
+
+class OllamaSession(LLMSession):
+    """
+    Thought content evaluated once by an Ollama model.
+    
+    Ollama returns the evaluated tokens of a request as its `context`.
+    Every request of the session continues from the context of the
+    priming request, so the model only processes the new prompt, and
+    parallel requests can all branch from the same context. With a host
+    pool, requests go to the host that evaluated the context while it is
+    available, since another host would have to evaluate it again.
+    
+    Ollama applies a system prompt only at the start of a conversation, so
+    a stage's system prompt is sent as the first paragraph of its prompt
+    instead. Stages that rely on the system/user split should run with
+    thought sessions disabled.
+    """
+    
+    def __init__(self, adapter: "OllamaAdapter", context: List[int], prefill_tokens: int, prefill_ms: float,
+                 host: Optional[PooledHost] = None):
+        self.adapter = adapter
+        self.context = context
+        self.prefill_tokens = prefill_tokens
+        self.prefill_ms = prefill_ms
+        self.host = host
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.prompt_ms = 0.0
+        self.measured_requests = 0
+        self.baseline_tokens = 0
+        self.baseline_ms = 0.0
+        self.measured_tokens = 0
+        self.measured_ms = 0.0
+        self._lock = threading.Lock()
+    
+    def generate(self, prompt: str, system_prompt: Optional[str] = None) -> str:
+        """Generate a response to a prompt that follows the thought content."""
+        if system_prompt:
+            # A system message after the content would start a new conversation
+            prompt = f"{system_prompt}\n\n{prompt}"
+        response = self.adapter._generate_in_context(prompt, self.context, self.host)
+        evaluated = response.prompt_eval_count or 0
+        evaluated_ms = (response.prompt_eval_duration or 0) / 1e6
+        new_tokens = self._prompt_tokens_of(response)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += evaluated
+            self.prompt_ms += evaluated_ms
+            if new_tokens is not None:
+                # Without the session, the request would have evaluated the
+                # content like the priming request did, plus its own prompt
+                self.measured_requests += 1
+                self.baseline_tokens += self.prefill_tokens + new_tokens
+                if self.prefill_tokens:
+                    self.baseline_ms += self.prefill_ms * (self.prefill_tokens + new_tokens) / self.prefill_tokens
+                self.measured_tokens += evaluated
+                self.measured_ms += evaluated_ms
+        return response.response
+    
+    def _prompt_tokens_of(self, response) -> Optional[int]:
+        """
+        Get the tokens of a request's own prompt: its returned context less
+        the session context and the generated tokens. Whatever Ollama
+        evaluated beyond that was session context evaluated again.
+        
+        Returns:
+            int: The token count, or None if the response has no context
+        """
+        if not response.context:
+            return None
+        tokens = len(response.context) - len(self.context) - (response.eval_count or 0)
+        return tokens if tokens >= 0 else None
+    
+    def stats(self) -> Dict[str, Any]:
+        """
+        Token counts of the session, measured from Ollama's prompt_eval_count.
+        
+        The savings compare the tokens the requests evaluated, plus the
+        priming request, with what the same requests would have evaluated
+        without the session. They are negative when the session cost more,
+        e.g. when the context had to be evaluated again.
+        """
+        with self._lock:
+            stats = {
+                "model": self.adapter.model,
+                "requests": self.requests,
+                "prefill_tokens": self.prefill_tokens,
+                "prompt_tokens": self.prompt_tokens,
+                "measured_requests": self.measured_requests,
+                "saved_tokens": 0,
+                "saved_ms": 0.0
+            }
+            if self.measured_requests:
+                stats["baseline_tokens"] = self.baseline_tokens
+                stats["saved_tokens"] = self.baseline_tokens - self.measured_tokens - self.prefill_tokens
+                stats["saved_ms"] = round(self.baseline_ms - self.measured_ms - self.prefill_ms, 1)
+            return stats
 
 class OllamaAdapter(LLMAdapter):
     """Adapter for direct communication with Ollama API."""
@@ -10,31 +115,122 @@ class OllamaAdapter(LLMAdapter):
     def __init__(self):
         self.model = None
         self.client = None
+        self.base_url = None
+        self.host_pool = None
+        self.client_kwargs = {}
+        self.async_client = None
+        self._async_loop = None
         self.temperature = 0.7
         self.max_tokens = 1000
+        self.batch_concurrency = 4
+        self.keep_alive = None
+        self.context_window = None
         
     def initialize(self, config: Dict[str, Any]) -> None:
         """Initialize the Ollama adapter with configuration."""
         self.model = config.get("model", "llama3.2")
         self.temperature = config.get("temperature", 0.7)
         self.max_tokens = config.get("max_tokens", 1000)
+        # How long Ollama keeps the model loaded after a request, e.g. "30m" or -1 for always
+        self.keep_alive = config.get("keep_alive")
+        # Ollama otherwise uses its own, much smaller default context size
+        self.context_window = config.get("context_window")
         
-        # Get base URL from environment variable or use default
-        base_url = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+        # Get base URLs from the config, the environment or use default.
+        # Several URLs (a list, or comma separated) spread requests over a host pool.
+        base_url = config.get("base_url") or os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+        urls = base_url if isinstance(base_url, list) else [url.strip() for url in base_url.split(",")]
+        
+        # Bound every request so a stuck server cannot hang a worker, and
+        # optionally cap the size of the client's connection pool
+        self.client_kwargs = {"timeout": config.get("timeout", 300)}
+        if config.get("max_connections"):
+            self.client_kwargs["limits"] = httpx.Limits(max_connections=config["max_connections"])
+        
+        if self.host_pool is not None:
+            self.host_pool.close()
+            self.host_pool = None
+        if len(urls) > 1:
+            self.host_pool = OllamaHostPool(
+                urls,
+                lambda url: ollama.Client(host=url, **self.client_kwargs),
+                max_requests_per_host=config.get("max_requests_per_host"),
+                eject_after_failures=config.get("eject_after_failures", 3),
+                eject_seconds=config.get("eject_seconds", 30.0),
+                health_check_interval=config.get("health_check_interval", 10.0),
+                acquire_timeout=config.get("acquire_timeout")
+            )
+        
+        # Enough concurrent batch requests to keep every host busy
+        per_host = config.get("max_requests_per_host") or config.get("max_connections") or 4
+        self.batch_concurrency = config.get("batch_concurrency", per_host * len(urls))
         
         # Create client with appropriate base URL
-        self.client = ollama.Client(host=base_url)
+        self.client = ollama.Client(host=urls[0], **self.client_kwargs)
+        self.base_url = urls[0]
     
     def set_config(self, config: Dict[str, Any]) -> None:
         """Update the adapter configuration."""
         self.model = config.get("model", self.model)
         self.temperature = config.get("temperature", self.temperature)
         self.max_tokens = config.get("max_tokens", self.max_tokens)
+        self.keep_alive = config.get("keep_alive", self.keep_alive)
+        self.context_window = config.get("context_window", self.context_window)
         
-        # Update base URL if provided
+        # Update base URL if provided; a host pool keeps its hosts
         base_url = config.get("base_url", os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434"))
-        if hasattr(self.client, 'host') and base_url != self.client.host:
-            self.client = ollama.Client(host=base_url)
+        if self.host_pool is None and isinstance(base_url, str) and \
+                hasattr(self.client, 'host') and base_url != self.client.host:
+            self.client = ollama.Client(host=base_url, **self.client_kwargs)
+            self.base_url = base_url
+            self.async_client = None
+    
+    def _build_options(self, temperature, max_tokens, stop_sequences):
+        """Build the Ollama options dict, falling back to initialized values."""
+        options = {
+            "temperature": temperature if temperature is not None else self.temperature,
+            "num_predict": max_tokens if max_tokens is not None else self.max_tokens
+        }
+        
+        if self.context_window:
+            options["num_ctx"] = self.context_window
+        
+        if stop_sequences:
+            options["stop"] = stop_sequences
+        
+        return options
+    
+    @contextmanager
+    def _client(self):
+        """Yield the client for one request, routed through the host pool if there is one."""
+        with self._pooled_client() as (client, _):
+            yield client
+    
+    @contextmanager
+    def _pooled_client(self, prefer: Optional[PooledHost] = None):
+        """Yield the client for one request and its pooled host, None without a pool."""
+        if self.host_pool is None:
+            yield self.client, None
+            return
+        with self.host_pool.acquire(prefer) as host:
+            yield host.client, host
+    
+    def _request_error(self, error):
+        """Wrap a failed request in the matching LLMError."""
+        print(f"Error generating response with Ollama: {str(error)}")
+        if isinstance(error, LLMError):
+            return error
+        if isinstance(error, httpx.TimeoutException):
+            return LLMTimeoutError(f"Ollama request timed out: {error}")
+        return LLMError(f"Ollama request failed: {error}")
+    
+    def _get_async_client(self):
+        """Return an AsyncClient bound to the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self.async_client is None or self._async_loop is not loop:
+            self.async_client = ollama.AsyncClient(host=self.base_url, **self.client_kwargs)
+            self._async_loop = loop
+        return self.async_client
         
     def generate(self, 
                 prompt: str, 
@@ -43,39 +239,187 @@ class OllamaAdapter(LLMAdapter):
                 max_tokens: Optional[int] = None,
                 stop_sequences: Optional[List[str]] = None) -> str:
         """Generate a response using Ollama client."""
-        # Use provided params or fall back to initialized values
-        temp = temperature if temperature is not None else self.temperature
-        tokens = max_tokens if max_tokens is not None else self.max_tokens
+        options = self._build_options(temperature, max_tokens, stop_sequences)
+            
+        try:
+            with self._client() as client:
+                if system_prompt:
+                    response = client.generate(
+                        model=self.model,
+                        prompt=prompt,
+                        system=system_prompt,
+                        options=options,
+                        keep_alive=self.keep_alive
+                    )
+                else:
+                    response = client.generate(
+                        model=self.model,
+                        prompt=prompt,
+                        options=options,
+                        keep_alive=self.keep_alive
+                    )
+            
+            return response.response
+        except Exception as e:
+            raise self._request_error(e) from e
+    
+    async def agenerate(self, 
+                prompt: str, 
+                system_prompt: Optional[str] = None,
+                temperature: Optional[float] = None,
+                max_tokens: Optional[int] = None,
+                stop_sequences: Optional[List[str]] = None) -> str:
+        """Generate a response using the Ollama AsyncClient."""
+        if self.host_pool is not None:
+            # Host selection may wait for a free host, so keep it off the event loop
+            return await super().agenerate(
+                prompt,
+                system_prompt=system_prompt,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stop_sequences=stop_sequences
+            )
         
-        options = {
-            "temperature": temp,
-            "num_predict": tokens
-        }
+        # Read the settings before the first await so concurrent requests
+        # cannot see each other's configuration
+        model = self.model
+        options = self._build_options(temperature, max_tokens, stop_sequences)
         
-        if stop_sequences:
-            options["stop"] = stop_sequences
-            
         try:
+            client = self._get_async_client()
             if system_prompt:
-                response = self.client.generate(
-                    model=self.model,
+                response = await client.generate(
+                    model=model,
                     prompt=prompt,
                     system=system_prompt,
-                    options=options
+                    options=options,
+                    keep_alive=self.keep_alive
                 )
             else:
-                response = self.client.generate(
-                    model=self.model,
+                response = await client.generate(
+                    model=model,
                     prompt=prompt,
-                    options=options
+                    options=options,
+                    keep_alive=self.keep_alive
                 )
             
             return response.response
         except Exception as e:
-            print(f"Error generating response with Ollama: {str(e)}")
-            return f"Error generating response: {str(e)}"
+            raise self._request_error(e) from e
+    
+    def generate_stream(self, 
+                prompt: str, 
+                system_prompt: Optional[str] = None,
+                temperature: Optional[float] = None,
+                max_tokens: Optional[int] = None,
+                stop_sequences: Optional[List[str]] = None) -> Iterator[str]:
+        """Generate a response using Ollama client, yielding chunks as they arrive."""
+        request = {
+            "model": self.model,
+            "prompt": prompt,
+            "options": self._build_options(temperature, max_tokens, stop_sequences),
+            "stream": True,
+            "keep_alive": self.keep_alive
+        }
+        if system_prompt:
+            request["system"] = system_prompt
+        
+        try:
+            with self._client() as client:
+                for chunk in client.generate(**request):
+                    if chunk.response:
+                        yield chunk.response
+        except Exception as e:
+            raise self._request_error(e) from e
+    
+    def generate_batch(self, 
+                prompts: List[str], 
+                system_prompt: Optional[str] = None,
+                temperature: Optional[float] = None,
+                max_tokens: Optional[int] = None,
+                stop_sequences: Optional[List[str]] = None,
+                max_concurrency: Optional[int] = None) -> List[str]:
+        """
+        Generate responses for several prompts with concurrent requests.
+        
+        Ollama has no batch endpoint, but it serves parallel requests to a
+        loaded model, so up to `batch_concurrency` requests share the client.
+        """
+        return super().generate_batch(
+            prompts,
+            system_prompt=system_prompt,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stop_sequences=stop_sequences,
+            max_concurrency=max_concurrency or self.batch_concurrency
+        )
+    
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Compute embeddings with Ollama's embed endpoint."""
+        try:
+            with self._client() as client:
+                response = client.embed(model=self.model, input=texts, keep_alive=self.keep_alive)
+        except Exception as e:
+            raise self._request_error(e) from e
+        return [list(vector) for vector in response.embeddings]
+    
+    def open_session(self, content: str) -> OllamaSession:
+        """
+        Evaluate thought content once and keep Ollama's context for the
+        requests that follow.
+        
+        Raises:
+            LLMError: If the priming request failed
+        """
+        options = self._build_options(None, 2, None)
+        try:
+            with self._pooled_client() as (client, host):
+                response = client.generate(
+                    model=self.model,
+                    prompt=SESSION_PRIMER.format(content=content),
+                    options=options,
+                    keep_alive=self.keep_alive
+                )
+        except Exception as e:
+            raise self._request_error(e) from e
+        
+        if not response.context:
+            raise LLMError(f"Ollama returned no context for model {self.model}")
+        return OllamaSession(
+            self,
+            list(response.context),
+            response.prompt_eval_count or 0,
+            (response.prompt_eval_duration or 0) / 1e6,
+            host=host
+        )
+    
+    def _generate_in_context(self, prompt: str, context: List[int], host: Optional[PooledHost] = None):
+        """Generate a response continuing from an earlier request's context, preferably on `host`."""
+        options = self._build_options(None, None, None)
+        try:
+            with self._pooled_client(host) as (client, _):
+                return client.generate(
+                    model=self.model,
+                    prompt=prompt,
+                    context=context,
+                    options=options,
+                    keep_alive=self.keep_alive
+                )
+        except Exception as e:
+            raise self._request_error(e) from e
+    
+    def warmup(self) -> bool:
+        """Load the model with an empty prompt, on every host of a host pool."""
+        clients = [host.client for host in self.host_pool.hosts] if self.host_pool else [self.client]
+        try:
+            for client in clients:
+                client.generate(model=self.model, prompt="", keep_alive=self.keep_alive)
+        except Exception as e:
+            raise self._request_error(e) from e
+        return True
     
     def close(self) -> None:
         """Close any open resources."""
         # The Ollama Client doesn't need explicit cleanup
-        pass
\ No newline at end of file
+        if self.host_pool is not None:
+            self.host_pool.close()
\ No newline at end of file
@@ -0,0 +1,96 @@
+# adapters/registry.py
+import logging
+import threading
+from typing import Dict, Any, List
+
+from .base_adapter import LLMAdapter, LLMError
+from .factory import create_adapter_from_config
+
+logger = logging.getLogger(__name__)
+
+class AdapterRegistry:
+    """
+    Holds one initialized adapter per `llm_configs` entry.
+
+    Adapters are created on first use, so configs that are never requested
+    (e.g. example API configs) don't touch their provider at startup. Once
+    created they are never reconfigured, so workers can share them without
+    locking and each keeps its own HTTP connection pool.
+    """
+
+    def __init__(self, llm_configs: Dict[str, Dict[str, Any]], default_adapter: str = "ollama"):
+        """
+        Args:
+            llm_configs: Mapping of config name to LLM configuration
+            default_adapter: Adapter type for configs that don't name one
+        """
+        self.default_adapter = default_adapter
+        self._configs = {}
+        self._adapters = {}
+        self._lock = threading.Lock()
+
+        for name, config in llm_configs.items():
+            self.register(name, config)
+
+    def register(self, name: str, config: Dict[str, Any]) -> None:
+        """Register a configuration; its adapter is created on first use."""
+        adapter_config = dict(config or {})
+        adapter_config.setdefault("adapter", self.default_adapter)
+
+        with self._lock:
+            previous = self._adapters.pop(name, None)
+            self._configs[name] = adapter_config
+
+        if previous is not None:
+            previous.close()
+        logger.info(f"Registered {adapter_config['adapter']} adapter for LLM config '{name}' "
+                    f"(model: {adapter_config.get('model', 'unknown')})")
+
+    def resolve_name(self, name: str) -> str:
+        """Get the config name actually used for a request, falling back to 'default'."""
+        if name in self._configs:
+            return name
+        if "default" in self._configs:
+            return "default"
+        raise KeyError(f"No configuration found for '{name}' and no default available")
+
+    def get(self, name: str) -> LLMAdapter:
+        """
+        Get the adapter for a config name, falling back to 'default'.
+
+        Raises:
+            LLMError: If the adapter could not be created
+        """
+        name = self.resolve_name(name)
+        adapter = self._adapters.get(name)
+        if adapter is not None:
+            return adapter
+
+        with self._lock:
+            adapter = self._adapters.get(name)
+            if adapter is None:
+                try:
+                    adapter = create_adapter_from_config(self._configs[name])
+                except Exception as e:
+                    logger.error(f"Could not create adapter for LLM config '{name}': {e}")
+                    raise LLMError(f"Could not create adapter for LLM config '{name}': {e}") from e
+                self._adapters[name] = adapter
+        return adapter
+
+    def get_config(self, name: str) -> Dict[str, Any]:
+        """Get the configuration for a config name, falling back to 'default'."""
+        return self._configs[self.resolve_name(name)]
+
+    def names(self) -> List[str]:
+        """Names of all registered configurations."""
+        return list(self._configs.keys())
+
+    def close(self) -> None:
+        """Close every registered adapter."""
+        with self._lock:
+            adapters = list(self._adapters.values())
+            self._adapters.clear()
+            self._configs.clear()
+
+        for adapter in adapters:
+            adapter.close()
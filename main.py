@@ -1,6 +1,7 @@
 # main.py
 import os
 import sys
+import asyncio
 import yaml
 import time
 from typing import Dict, Any
@@ -20,7 +21,17 @@ except ImportError:
         pass
 
 from adapters.factory import create_adapter_from_config
+from tools import llm_handler
 from tools.file_watcher import watch_folder, process_existing_files, CaptureHandler
+from tools.pipeline_executor import PipelineExecutor, AsyncPipelineExecutor, BatchPipelineExecutor, AffinityPipelineExecutor
+from tools.stage_scheduler import run_stage_graph, arun_stage_graph
+from tools.pipeline_plan import build_pipeline_plan
+from tools.batch_runner import run_stage_batches
+from tools.affinity_scheduler import AffinityScheduler
+from tools.manifest import ProcessedManifest
+from tools.near_duplicates import NearDuplicateIndex
+from tools.output_writer import write_result, ResultWriter, PartialResultWriter
+from tools.result_store import get_result_store
 
 def load_env_vars(env_path: str = None):
     """Load environment variables from .env file."""
@@ -67,11 +78,45 @@ def load_configs(
         "agents": agents_config.get("agents", {}),
         "llm_configs": llms_config,
         "prompts": prompts_config,
-        "folders": system_config.get("folders", {})
+        "folders": system_config.get("folders", {}),
+        "pipeline": system_config.get("pipeline", {}),
+        "llm_cache": system_config.get("llm_cache", {}),
+        "manifest": system_config.get("manifest", {}),
+        "watcher": system_config.get("watcher", {}),
+        "output": system_config.get("output", {}),
+        "warmup": system_config.get("warmup", {}),
+        "token_budget": system_config.get("token_budget", {}),
+        "chunking": system_config.get("chunking", {}),
+        "semantic_cache": system_config.get("semantic_cache", {}),
+        "near_duplicates": system_config.get("near_duplicates", {}),
+        "related_thoughts": system_config.get("related_thoughts", {})
     }
     
     return merged_config
 
+def get_agent_llm_configs(config):
+    """Get the names of the LLM configs used by the configured agents."""
+    return sorted({
+        (agent_config or {}).get("llm_config") or "default"
+        for agent_config in config.get("agents", {}).values()
+    })
+
+def warmup_agent_models(config):
+    """Load every model the agents use and report how long each took."""
+    from tools.llm_handler import warmup_models
+    
+    print("Warming up models...")
+    start = time.perf_counter()
+    for entry in warmup_models(get_agent_llm_configs(config)):
+        configs = ", ".join(entry["configs"])
+        if entry["error"]:
+            print(f"  {entry['model']} ({configs}): failed - {entry['error']}")
+        elif entry["seconds"] is None:
+            print(f"  {entry['model']} ({configs}): nothing to load")
+        else:
+            print(f"  {entry['model']} ({configs}): loaded in {entry['seconds']}s")
+    print(f"Warmup finished in {time.perf_counter() - start:.2f}s")
+
 def setup_folder_processing(config):
     """Set up folder watching and processing based on config."""
     # Get folder paths from config
@@ -81,71 +126,356 @@ def setup_folder_processing(config):
     
     print(f"Watching folder: {capture_folder}")
     
-    # Process any existing files first
-    process_existing_files(capture_folder, lambda x: process_thought(x, config))
+    # Compile the pipeline once; workers share the plan
+    plan = build_pipeline_plan(config)
+    
+    # Load the manifest of already processed files
+    manifest = None
+    manifest_path = config.get("manifest", {}).get("path")
+    if manifest_path:
+        manifest = ProcessedManifest(manifest_path)
+    near_duplicates = create_near_duplicate_index(config)
     
-    # Set up folder watching
-    observer = watch_folder(capture_folder, lambda x: process_thought(x, config))
+    # Results are written by a background thread when configured
+    writer = create_result_writer(config)
+    partial_writer = create_partial_writer(config)
     
-    return observer
+    # Start the worker pool that runs thoughts through the pipeline
+    pipeline_settings = config.get("pipeline", {})
+    mode = pipeline_settings.get("mode", "threads")
+    if mode == "async":
+        executor = AsyncPipelineExecutor(
+            lambda x: aprocess_thought(x, config, plan, manifest, writer),
+            max_in_flight=pipeline_settings.get("max_in_flight", 16)
+        ).start()
+    elif mode == "batch":
+        executor = BatchPipelineExecutor(
+            lambda batch: process_thought_batch(batch, config, plan, manifest, writer),
+            max_workers=pipeline_settings.get("batch_workers", 1),
+            max_in_flight=pipeline_settings.get("max_in_flight", 16),
+            batch_size=pipeline_settings.get("batch_size", 32),
+            batch_wait=pipeline_settings.get("batch_wait", 0.5)
+        ).start()
+    elif mode == "affinity":
+        from tools.llm_handler import communicate_with_llm_batch, get_model_key
+        scheduler = AffinityScheduler(
+            plan,
+            communicate_with_llm_batch,
+            model_for=get_model_key,
+            max_wait=pipeline_settings.get("affinity_max_wait", 30.0),
+            batch_size=pipeline_settings.get("batch_size", 32)
+        )
+        executor = AffinityPipelineExecutor(
+            scheduler,
+            lambda x: save_result(x, config, manifest, writer),
+            fail_fn=lambda x, error: release_manifest_claim(x, manifest),
+            max_in_flight=pipeline_settings.get("max_in_flight", 16)
+        ).start()
+    else:
+        executor = PipelineExecutor(
+            lambda x: process_thought(x, config, plan, manifest, writer, partial_writer),
+            max_workers=pipeline_settings.get("max_workers", 4),
+            max_in_flight=pipeline_settings.get("max_in_flight", 16)
+        ).start()
+    
+    submit = make_thought_submitter(executor, manifest, near_duplicates)
+    
+    # Process any existing files first, skipping unchanged ones
+    process_existing_files(capture_folder, submit, manifest)
+    
+    # Set up folder watching; the watcher only enqueues new thoughts
+    watcher_settings = config.get("watcher", {})
+    observer = watch_folder(
+        capture_folder,
+        submit,
+        debounce_seconds=watcher_settings.get("debounce_seconds", 0.2),
+        poll_interval=watcher_settings.get("poll_interval", 0.1)
+    )
+    
+    return observer, executor, writer
 
-def process_thought(thought_object, config):
-    """Process a thought through the pipeline using tools module."""
-    from tools.document_processor import process_with_agent, pass_to_next_agent
-    from tools.output_writer import write_result
-    
-    # Get agent pipeline
-    agent_pipeline = [
-        ("capture", "Capture"),
-        ("contextualize", "Contextualize"),
-        ("clarify", "Clarify"),
-        ("categorize", "Categorize"),
-        ("crystallize", "Crystallize"),
-        ("connect", "Connect")
-    ]
-    
-    # Setup prompt templates
-    prompt_templates = {}
-    for agent_id in [stage[0] for stage in agent_pipeline]:
-        template_key = f"{agent_id}_prompt_template"
-        if template_key in config.get("prompts", {}):
-            prompt_templates[agent_id] = config["prompts"][template_key]
-    
-    # Create a mock agent for each stage
-    agents = {}
-    for agent_id, agent_config in config.get("agents", {}).items():
-        # Create a simple object with attributes needed by the document_processor
-        agent = type('Agent', (), {})()
-        agent.role = agent_config.get("role", "")
-        agent.goal = agent_config.get("goal", "")
-        agent.backstory = agent_config.get("backstory", "")
-        agent.llm_config = agent_config.get("llm_config", "default")
-        agents[agent_id] = agent
-    
-    # Process the thought through each stage
-    current_thought = thought_object
-    
-    for agent_id, agent_name in agent_pipeline:
-        if agent_id in agents:
-            print(f"Processing with {agent_name} agent...")
-            agent = agents[agent_id]
-            current_thought = process_with_agent(
-                current_thought, 
-                agent,
-                agent_name,
-                agent_id,
-                prompt_templates
-            )
-    
-    # Write the final result
-    output_folder = os.path.join(
+def create_near_duplicate_index(config):
+    """Create the index of captured thoughts, or None if near-duplicate detection is off."""
+    settings = config.get("near_duplicates", {})
+    if not settings.get("enabled", False):
+        return None
+    
+    return NearDuplicateIndex(
+        path=settings.get("path"),
+        threshold=settings.get("threshold", 0.85),
+        num_perm=settings.get("num_perm", 128),
+        shingle_size=settings.get("shingle_size", 3),
+        snapshot_every=settings.get("snapshot_every", 10000)
+    )
+
+def make_thought_submitter(executor, manifest=None, near_duplicates=None):
+    """
+    Build the callback that hands captured thoughts to the executor.
+    
+    Thoughts whose content was already processed, or is being processed,
+    are recorded against the earlier thought instead of being run again.
+    With a near-duplicate index, the same goes for thoughts that differ
+    only slightly, e.g. sync conflict copies. The manifest records the
+    duplicate's file as another source of the earlier thought once that
+    thought is written.
+    """
+    def submit(thought_object):
+        if manifest is not None and "content_hash" in thought_object:
+            duplicate_of = manifest.claim(thought_object["content_hash"], thought_object["id"])
+            if duplicate_of is not None:
+                print(f"Skipping {thought_object['original_filename']}: same content as {duplicate_of}")
+                manifest.record_duplicate(thought_object, duplicate_of)
+                return False
+        
+        if near_duplicates is not None:
+            # Only thoughts that were written or are in progress count, not failed ones
+            is_known = manifest.is_known if manifest is not None else None
+            duplicate_of, similarity = near_duplicates.check(thought_object, is_known)
+            if duplicate_of is not None:
+                print(f"Skipping {thought_object['original_filename']}: "
+                      f"{similarity:.0%} similar to {duplicate_of}")
+                if manifest is not None and "content_hash" in thought_object:
+                    manifest.record_duplicate(thought_object, duplicate_of)
+                return False
+        
+        return executor.submit(thought_object)
+    
+    return submit
+
+def get_output_folder(config):
+    """Get the folder processed thoughts are written to."""
+    return os.path.join(
         config.get("folders", {}).get("base", ""),
         config.get("folders", {}).get("connect", "6-Connect")
     )
-    write_result(current_thought, output_folder)
+
+def get_output_layout(config):
+    """Get the result file layout settings from the output config."""
+    output_settings = config.get("output", {})
+    return {
+        "layout": output_settings.get("layout", "flat"),
+        "shard_chars": output_settings.get("shard_chars", 1),
+        "compact": output_settings.get("compact", False)
+    }
+
+def create_result_store(config):
+    """Get the results database, or None if results are written as files."""
+    output_settings = config.get("output", {})
+    if output_settings.get("backend", "files") != "sqlite":
+        return None
+    
+    return get_result_store(os.path.join(get_output_folder(config), output_settings.get("database", "thoughts.db")))
+
+def create_result_writer(config):
+    """Create the background result writer, or None if results are written inline."""
+    output_settings = config.get("output", {})
+    if not output_settings.get("background_writer", False):
+        return None
+    
+    return ResultWriter(
+        get_output_folder(config),
+        fsync=output_settings.get("fsync", "batch"),
+        batch_size=output_settings.get("batch_size", 64),
+        flush_interval=output_settings.get("flush_interval", 0.5),
+        store=create_result_store(config),
+        **get_output_layout(config)
+    )
+
+def create_partial_writer(config):
+    """Create the writer for results still being generated, or None if disabled."""
+    pipeline_settings = config.get("pipeline", {})
+    if not (pipeline_settings.get("stream", False) and pipeline_settings.get("partial_results", False)):
+        return None
+    
+    return PartialResultWriter(
+        get_output_folder(config),
+        interval=pipeline_settings.get("partial_interval", 2.0)
+    )
+
+def save_result(thought_object, config, manifest=None, writer=None, partial_writer=None):
+    """
+    Write a processed thought and record it in the manifest once written.
+    
+    With a background writer the thought is only queued, so the caller
+    never waits on disk I/O; if the write fails, the thought's manifest
+    claim is released so its file is processed again on the next start.
+    The thought's partial result file is removed once the final result is
+    on disk, or once writing it failed.
+    """
+    def on_written(path):
+        record_in_manifest(thought_object, manifest)
+        if partial_writer is not None:
+            partial_writer.clear(thought_object["id"])
+    
+    def on_failed(error):
+        release_manifest_claim(thought_object, manifest)
+        if partial_writer is not None:
+            partial_writer.clear(thought_object["id"])
+    
+    if writer is not None:
+        writer.submit(thought_object, on_written=on_written, on_failed=on_failed)
+        return
+    
+    path = write_result(
+        thought_object,
+        get_output_folder(config),
+        fsync=config.get("output", {}).get("fsync", "never"),
+        store=create_result_store(config),
+        **get_output_layout(config)
+    )
+    on_written(path)
+
+def process_thought(thought_object, config, plan=None, manifest=None, writer=None, partial_writer=None):
+    """Process a thought through the pipeline using tools module."""
+    from tools.document_processor import run_stage, split_thought
+    from tools.sessions import ThoughtSessions
+    
+    if plan is None:
+        plan = build_pipeline_plan(config)
+    
+    # Near-duplicates of processed thoughts reuse their stage results
+    semantic_cache = llm_handler.semantic_cache
+    vector, reused = None, {}
+    if semantic_cache is not None:
+        vector, reused = semantic_cache.reuse(thought_object, plan)
+        llm_handler.share_embedding(thought_object, vector)
+    
+    # Large documents are split once and every stage maps over the chunks
+    chunks = split_thought(thought_object, plan.chunker)
+    
+    # Stages sharing an LLM config reuse the content the model already evaluated
+    sessions = None
+    if plan.thought_sessions and not chunks:
+        sessions = ThoughtSessions(thought_object["content"], plan.session_configs(skip=reused))
+    
+    on_partial = None
+    if partial_writer is not None:
+        on_partial = lambda agent_id, text: partial_writer.update(thought_object, agent_id, text)
+    
+    def run(agent_id, agent_name):
+        if agent_id in reused:
+            return reused[agent_id]
+        return run_stage(
+            thought_object, plan.get(agent_id), stream=plan.stream, on_partial=on_partial,
+            chunks=chunks, chunker=plan.chunker, sessions=sessions
+        )
+    
+    try:
+        # Run the stages, starting independent ones in parallel
+        current_thought = run_stage_graph(
+            thought_object,
+            plan.stage_order,
+            plan.dependencies,
+            run,
+            max_parallel=plan.max_parallel
+        )
+        
+        if sessions is not None:
+            saved = sessions.record(current_thought)
+            if saved:
+                print(f"Thought sessions saved evaluating {saved} prompt tokens")
+        
+        # Write the final result
+        save_result(current_thought, config, manifest, writer, partial_writer)
+        if semantic_cache is not None:
+            semantic_cache.add(current_thought, vector, plan)
+        if llm_handler.related_thoughts is not None:
+            llm_handler.related_thoughts.add(current_thought)
+    except Exception:
+        release_manifest_claim(thought_object, manifest)
+        if partial_writer is not None:
+            partial_writer.clear(thought_object["id"])
+        raise
+    
+    return current_thought
+
+async def aprocess_thought(thought_object, config, plan=None, manifest=None, writer=None):
+    """Process a thought through the pipeline on the running event loop."""
+    from tools.document_processor import arun_stage, split_thought
+    
+    if plan is None:
+        plan = build_pipeline_plan(config)
+    
+    semantic_cache = llm_handler.semantic_cache
+    vector, reused = None, {}
+    if semantic_cache is not None:
+        vector, reused = await asyncio.to_thread(semantic_cache.reuse, thought_object, plan)
+        llm_handler.share_embedding(thought_object, vector)
+    
+    chunks = split_thought(thought_object, plan.chunker)
+    
+    async def run(agent_id, agent_name):
+        if agent_id in reused:
+            return reused[agent_id]
+        return await arun_stage(thought_object, plan.get(agent_id), chunks=chunks, chunker=plan.chunker)
+    
+    try:
+        # Run the stages, awaiting independent ones concurrently
+        current_thought = await arun_stage_graph(
+            thought_object,
+            plan.stage_order,
+            plan.dependencies,
+            run,
+            max_parallel=plan.max_parallel
+        )
+        
+        # Write the final result without blocking the event loop
+        if writer is not None:
+            save_result(current_thought, config, manifest, writer)
+        else:
+            await asyncio.to_thread(save_result, current_thought, config, manifest)
+        if semantic_cache is not None:
+            await asyncio.to_thread(semantic_cache.add, current_thought, vector, plan)
+        if llm_handler.related_thoughts is not None:
+            await asyncio.to_thread(llm_handler.related_thoughts.add, current_thought)
+    except Exception:
+        release_manifest_claim(thought_object, manifest)
+        raise
     
     return current_thought
 
+def process_thought_batch(thought_objects, config, plan=None, manifest=None, writer=None):
+    """
+    Process several thoughts together, sending each stage's prompts for
+    all of them to the LLM in one batch.
+    """
+    from tools.llm_handler import communicate_with_llm_batch
+    
+    if plan is None:
+        plan = build_pipeline_plan(config)
+    
+    try:
+        processed = run_stage_batches(thought_objects, plan, communicate_with_llm_batch)
+        
+        for thought_object in processed:
+            save_result(thought_object, config, manifest, writer)
+    except Exception:
+        for thought_object in thought_objects:
+            release_manifest_claim(thought_object, manifest)
+        raise
+    
+    return processed
+
+def record_in_manifest(thought_object, manifest):
+    """
+    Record a processed thought's capture file in the manifest.
+    
+    Thoughts with failed stages are left out, so their file is processed
+    again on the next start.
+    """
+    if thought_object.get("stage_errors"):
+        release_manifest_claim(thought_object, manifest)
+        return
+    if manifest is not None and "content_hash" in thought_object:
+        manifest.record_thought(thought_object)
+
+def release_manifest_claim(thought_object, manifest):
+    """Let a failed thought's content, and that of its duplicates, be processed again."""
+    if manifest is not None and "content_hash" in thought_object:
+        for duplicate in manifest.release(thought_object["content_hash"]):
+            print(f"Not recording {duplicate.get('original_filename')}: {thought_object['id']} failed, "
+                  f"it will be processed on the next start")
+
 def main():
     # Load configuration
     config = load_configs(
@@ -159,11 +489,28 @@ def main():
     load_env_vars()
     
     # Import and initialize LLM configurations
-    from tools.llm_handler import initialize_llm_configs
+    from tools.llm_handler import (initialize_llm_configs, initialize_response_cache,
+                                   initialize_token_budget, initialize_semantic_cache,
+                                   initialize_related_thoughts)
     initialize_llm_configs("config/llms.yaml")  # Actually call the function
+    initialize_response_cache(config.get("llm_cache", {}))
+    initialize_token_budget(config.get("token_budget", {}))
+    semantic_cache = initialize_semantic_cache(config.get("semantic_cache", {}))
+    related_thoughts = initialize_related_thoughts(config.get("related_thoughts", {}))
+    if related_thoughts is not None:
+        # Thoughts processed before the index existed, or while it was off
+        result_store = create_result_store(config)
+        if result_store is not None:
+            related_thoughts.index_thoughts(result_store.iter_thoughts())
+        else:
+            related_thoughts.index_folder(get_output_folder(config))
+    
+    # Load the models before the first thought so it doesn't pay the load time
+    if config.get("warmup", {}).get("enabled", False):
+        warmup_agent_models(config)
     
     # Set up folder processing
-    observer = setup_folder_processing(config)
+    observer, executor, writer = setup_folder_processing(config)
     
     # Keep the main thread running
     try:
@@ -173,6 +520,15 @@ def main():
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
+    executor.shutdown()
+    if writer is not None:
+        writer.close()
+    if semantic_cache is not None:
+        stats = semantic_cache.stats()
+        print(f"Semantic cache: {stats['hits']} similar thoughts, {stats['saved_calls']} LLM calls saved")
+    if related_thoughts is not None:
+        stats = related_thoughts.stats()
+        print(f"Related thoughts: {stats['found']} found in {stats['lookups']} lookups, {stats['entries']} indexed")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
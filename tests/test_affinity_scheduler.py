@@ -0,0 +1,150 @@
+# tests/test_affinity_scheduler.py
+import copy
+import pytest
+from tools.affinity_scheduler import AffinityScheduler
+from tools.pipeline_executor import AffinityPipelineExecutor
+from tools.pipeline_plan import build_pipeline_plan
+
+MODELS = {
+    "capture": "fast", "contextualize": "balanced", "clarify": "comprehensive",
+    "categorize": "fast", "crystallize": "balanced", "connect": "comprehensive"
+}
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def make_plan(test_config, independent=False):
+    config = copy.deepcopy(test_config)
+    for agent_id, agent_config in config["agents"].items():
+        agent_config["llm_config"] = MODELS[agent_id]
+        if independent:
+            agent_config["depends_on"] = []
+    return build_pipeline_plan(config)
+
+def make_thought(index):
+    return {
+        "id": f"thought_{index}",
+        "content": f"Thought {index}",
+        "processing_stage": "capture",
+        "processing_history": []
+    }
+
+def recording_batch(calls):
+    def generate_batch(prompts, llm_config):
+        calls.append((llm_config, list(prompts)))
+        return [f"{llm_config}: {prompt}" for prompt in prompts]
+    return generate_batch
+
+def run_to_completion(scheduler):
+    completed = []
+    while len(scheduler):
+        done, failed = scheduler.step()
+        assert failed == []
+        completed.extend(done)
+    return completed
+
+def test_scheduler_runs_all_work_for_a_model_before_switching(test_config):
+    """Test that independent stages of many thoughts are grouped by model."""
+    calls = []
+    scheduler = AffinityScheduler(make_plan(test_config, independent=True), recording_batch(calls))
+    for i in range(4):
+        scheduler.add(make_thought(i))
+
+    completed = run_to_completion(scheduler)
+
+    assert [llm_config for llm_config, _ in calls] == ["fast", "balanced", "comprehensive"]
+    assert all(len(prompts) == 8 for _, prompts in calls)
+    assert scheduler.model_switches == 2
+    assert len(completed) == 4
+    assert completed[0]["connect_results"].startswith("comprehensive: ")
+
+def test_scheduler_keeps_stage_order_per_thought(test_config):
+    """Test that dependent stages of a thought run one after another."""
+    calls = []
+    scheduler = AffinityScheduler(make_plan(test_config), recording_batch(calls))
+    scheduler.add(make_thought(0))
+    scheduler.step()
+    scheduler.add(make_thought(1))
+
+    completed = run_to_completion(scheduler)
+
+    for thought in completed:
+        stages = [llm_config for llm_config, prompts in calls
+                  for prompt in prompts if prompt.endswith(thought["content"])]
+        assert stages == [MODELS[agent_id] for agent_id in MODELS]
+        assert [entry["stage"] for entry in thought["processing_history"]] == [
+            "capture", "capture", "contextualize", "clarify", "categorize", "crystallize"
+        ]
+
+def test_scheduler_bounds_waiting_time(test_config):
+    """Test that work waiting longer than max_wait runs before the resident model's work."""
+    calls = []
+    clock = FakeClock()
+    plan = make_plan(test_config, independent=True)
+    scheduler = AffinityScheduler(plan, recording_batch(calls), max_wait=10, batch_size=2, clock=clock)
+    scheduler.add(make_thought(0))
+    scheduler.step()
+
+    # New work for the resident model keeps arriving
+    clock.now = 5
+    scheduler.add(make_thought(1))
+    scheduler.add(make_thought(2))
+    scheduler.step()
+
+    # The balanced work has now waited too long, although fast work is still ready
+    clock.now = 11
+    scheduler.step()
+
+    assert [llm_config for llm_config, _ in calls] == ["fast", "fast", "balanced"]
+
+def test_affinity_executor_processes_finished_thoughts(test_config):
+    """Test that the executor saves finished thoughts and reports failures."""
+    saved, failures = [], []
+    def generate_batch(prompts, llm_config):
+        if any("Thought 2" in prompt for prompt in prompts) and llm_config == "balanced":
+            raise RuntimeError("server unavailable")
+        return ["ok"] * len(prompts)
+
+    scheduler = AffinityScheduler(make_plan(test_config), generate_batch, batch_size=1)
+    executor = AffinityPipelineExecutor(
+        scheduler, saved.append, fail_fn=lambda thought, error: failures.append(thought["id"]), max_in_flight=8
+    ).start()
+    try:
+        for i in range(4):
+            assert executor.submit(make_thought(i))
+        assert executor.join(timeout=5)
+    finally:
+        executor.shutdown()
+
+    assert sorted(thought["id"] for thought in saved) == ["thought_0", "thought_1", "thought_3"]
+    assert failures == ["thought_2"]
+    assert executor.failed_count == 1
+
+def test_affinity_executor_survives_scheduler_errors(test_config):
+    """Test that an error in the scheduler fails its thoughts but keeps the worker running."""
+    saved, failures = [], []
+    scheduler = AffinityScheduler(make_plan(test_config), lambda prompts, llm_config: ["ok"] * len(prompts))
+    original_step = scheduler.step
+    def step():
+        if len(failures) == 0:
+            raise RuntimeError("scheduler bug")
+        return original_step()
+    scheduler.step = step
+
+    executor = AffinityPipelineExecutor(
+        scheduler, saved.append, fail_fn=lambda thought, error: failures.append(thought["id"]), max_in_flight=8
+    ).start()
+    try:
+        assert executor.submit(make_thought(0))
+        assert executor.join(timeout=5)
+        assert executor.submit(make_thought(1))
+        assert executor.join(timeout=5)
+    finally:
+        executor.shutdown()
+
+    assert failures == ["thought_0"]
+    assert [thought["id"] for thought in saved] == ["thought_1"]
+    assert executor.failed_count == 1
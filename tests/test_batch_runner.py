@@ -0,0 +1,92 @@
+# tests/test_batch_runner.py
+import threading
+import pytest
+import tools.llm_handler
+from tools.batch_runner import stage_waves, run_stage_batches
+from tools.pipeline_executor import BatchPipelineExecutor
+from tools.pipeline_plan import build_pipeline_plan
+from tests.mock_adapter import MockLLMAdapter
+
+def make_thought(index):
+    return {
+        "id": f"thought_{index}",
+        "content": f"Thought number {index}.",
+        "processing_stage": "capture",
+        "processing_history": []
+    }
+
+def test_stage_waves_follow_dependencies():
+    """Test that stages are grouped into waves that respect depends_on."""
+    stages = [("capture", "Capture"), ("clarify", "Clarify"), ("categorize", "Categorize"), ("connect", "Connect")]
+    dependencies = {"capture": [], "clarify": ["capture"], "categorize": ["capture"], "connect": ["clarify", "categorize"]}
+
+    assert stage_waves(stages, dependencies) == [["capture"], ["clarify", "categorize"], ["connect"]]
+
+def test_run_stage_batches_sends_one_call_per_stage(test_config):
+    """Test that each stage's prompts for all thoughts go out in one batch."""
+    calls = []
+    def generate_batch(prompts, config_name):
+        calls.append((len(prompts), config_name))
+        return [f"Response to {prompt}" for prompt in prompts]
+
+    plan = build_pipeline_plan(test_config)
+    thoughts = [make_thought(i) for i in range(5)]
+    processed = run_stage_batches(thoughts, plan, generate_batch)
+
+    assert calls == [(5, "test_llm")] * len(plan.stages)
+    assert processed[3]["clarify_results"] == (
+        "Response to You are acting as the Clarify agent. Thought: Thought number 3."
+    )
+    assert processed[3]["processing_stage"] == "connect"
+    assert len(processed[3]["processing_history"]) == len(plan.stages)
+
+def test_batch_executor_groups_queued_thoughts():
+    """Test that queued thoughts are handed over in batches of at most batch_size."""
+    release = threading.Event()
+    batches = []
+
+    def process_batch(batch):
+        release.wait()
+        batches.append([thought["id"] for thought in batch])
+
+    executor = BatchPipelineExecutor(process_batch, max_in_flight=10, batch_size=4, batch_wait=0.05).start()
+    try:
+        for i in range(10):
+            assert executor.submit(make_thought(i))
+        release.set()
+
+        assert executor.join(timeout=5)
+        assert sum(len(batch) for batch in batches) == 10
+        assert max(len(batch) for batch in batches) == 4
+        assert executor.processed_count == 10
+    finally:
+        executor.shutdown()
+
+def test_communicate_with_llm_batch_skips_cached_and_repeated_prompts(monkeypatch):
+    """Test that only uncached, distinct prompts reach the adapter's batch call."""
+    from tools.llm_cache import LLMResponseCache
+
+    class BatchAdapter(MockLLMAdapter):
+        def generate_batch(self, prompts, **kwargs):
+            self.calls.append({"batch": list(prompts)})
+            return [f"Answer to {prompt}" for prompt in prompts]
+
+    class Registry:
+        adapter = BatchAdapter()
+        def resolve_name(self, name):
+            return "default"
+        def get(self, name):
+            return self.adapter
+        def get_config(self, name):
+            return {"adapter": "ollama", "model": "test-model"}
+
+    cache = LLMResponseCache()
+    monkeypatch.setattr(tools.llm_handler, "adapter_registry", Registry())
+    monkeypatch.setattr(tools.llm_handler, "response_cache", cache)
+    monkeypatch.setattr(tools.llm_handler, "call_policies", {})
+    cache.set(tools.llm_handler.get_cache_key({"adapter": "ollama", "model": "test-model"}, "a"), "Cached a")
+
+    responses = tools.llm_handler.communicate_with_llm_batch(["a", "b", "c", "b"])
+
+    assert responses == ["Cached a", "Answer to b", "Answer to c", "Answer to b"]
+    assert Registry.adapter.calls == [{"batch": ["b", "c"]}]
@@ -0,0 +1,156 @@
+# tests/test_chunking.py
+import asyncio
+import threading
+import time
+import pytest
+import yaml
+import tools.llm_handler
+from adapters import LLMError
+from tools.chunking import DocumentChunker, split_content
+from tools.document_processor import run_stage, arun_stage, split_thought
+from tools.pipeline_plan import build_pipeline_plan
+from tools.token_budget import TokenBudget, get_tokenizer
+
+def make_document(sections, paragraph_words=40):
+    parts = []
+    for section in range(sections):
+        parts.append(f"## Section {section}")
+        parts.append(" ".join(f"word{section}" for _ in range(paragraph_words)) + ".")
+    return "\n\n".join(parts)
+
+def test_split_content_breaks_at_headings_and_paragraphs():
+    """Test that chunks stay under the limit and keep headings with their text."""
+    tokenizer = get_tokenizer(None, "estimate")
+    content = make_document(6)
+
+    chunks = split_content(content, 150, tokenizer)
+
+    assert len(chunks) > 1
+    assert all(tokenizer.count(chunk) <= 150 for chunk in chunks)
+    assert all(chunk.startswith("## Section") for chunk in chunks)
+    assert "\n\n".join(chunks) == content
+
+def test_split_content_splits_oversized_paragraphs():
+    """Test that a single paragraph over the limit is still split."""
+    tokenizer = get_tokenizer(None, "estimate")
+    content = "x" * 1000
+
+    chunks = split_content(content, 100, tokenizer)
+
+    assert all(tokenizer.count(chunk) <= 100 for chunk in chunks)
+    assert "".join(chunks) == content
+
+def test_small_content_is_not_chunked():
+    """Test that content under the threshold is sent whole."""
+    chunker = DocumentChunker(chunk_tokens=100, threshold_tokens=500, tokenizer="estimate")
+    assert chunker.split("A short thought.") is None
+    assert len(chunker.split(make_document(20))) > 1
+
+def test_stage_maps_chunks_in_parallel_and_reduces(test_config, monkeypatch):
+    """Test that each chunk is sent at the same time and the results are combined."""
+    running = []
+    peak = []
+    lock = threading.Lock()
+    prompts = []
+    def mock_communicate_with_llm(prompt, config_name='default'):
+        with lock:
+            prompts.append(prompt)
+            running.append(prompt)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(prompt)
+        return f"summary {len(prompts)}"
+
+    monkeypatch.setattr(tools.llm_handler, "communicate_with_llm", mock_communicate_with_llm)
+    monkeypatch.setattr(tools.llm_handler, "token_budget", None)
+
+    test_config["chunking"] = {"enabled": True, "chunk_tokens": 100, "max_parallel": 4,
+                               "reduce_fan_in": 8, "tokenizer": "estimate"}
+    plan = build_pipeline_plan(test_config)
+    thought = {"id": "big", "content": make_document(5)}
+
+    chunks = split_thought(thought, plan.chunker)
+    result = run_stage(thought, plan.get("clarify"), chunks=chunks, chunker=plan.chunker)
+
+    assert thought["chunk_count"] == 5
+    assert max(peak) > 1
+    assert len(prompts) == 6
+    reduce_prompt = prompts[-1]
+    assert "You are acting as the Clarify agent" in reduce_prompt
+    assert "Part 1:\nsummary" in reduce_prompt and "Part 5:\nsummary" in reduce_prompt
+    assert result == "summary 6"
+    assert thought["stage_metrics"]["clarify"]["chunks"] == 5
+    assert thought["stage_metrics"]["clarify"]["reduce_calls"] == 1
+
+def test_reduce_runs_in_rounds_and_errors_fail_the_stage(test_config, monkeypatch):
+    """Test the reduce tree for many chunks and that a failed chunk records a stage error."""
+    calls = []
+    async def mock_acommunicate_with_llm(prompt, config_name='default'):
+        calls.append(prompt)
+        if "FAIL" in prompt:
+            raise LLMError("backend down")
+        return "partial"
+
+    monkeypatch.setattr(tools.llm_handler, "acommunicate_with_llm", mock_acommunicate_with_llm)
+    monkeypatch.setattr(tools.llm_handler, "token_budget", None)
+
+    test_config["chunking"] = {"enabled": True, "reduce_fan_in": 2, "tokenizer": "estimate"}
+    plan = build_pipeline_plan(test_config)
+    stage = plan.get("clarify")
+
+    thought = {"id": "big", "content": ""}
+    result = asyncio.run(arun_stage(thought, stage, chunks=["a", "b", "c", "d"], chunker=plan.chunker))
+    assert result == "partial"
+    # Four map calls, two reduce calls for the pairs, one for the final pair
+    assert len(calls) == 7
+    assert thought["stage_metrics"]["clarify"]["reduce_calls"] == 3
+
+    failed = {"id": "big", "content": ""}
+    assert asyncio.run(arun_stage(failed, stage, chunks=["a", "FAIL"], chunker=plan.chunker)) is None
+    assert "backend down" in failed["stage_errors"]["clarify"]
+
+def test_chunks_and_reduce_groups_fit_the_shipped_budgets(test_config, monkeypatch):
+    """Test that chunk and reduce prompts stay within the fast model's budget without truncation."""
+    with open("config/llms.yaml") as f:
+        configs = yaml.safe_load(f)["llm_configs"]
+    budget = TokenBudget(configs.__getitem__, lambda: list(configs), strategy="truncate",
+                         reserve_tokens=64, tokenizer="estimate")
+    tokenizer = get_tokenizer(None, "estimate")
+    prompts = []
+    lock = threading.Lock()
+    def mock_communicate_with_llm(prompt, config_name='default', system_prompt=None):
+        with lock:
+            prompts.append((prompt, system_prompt))
+        # Long partial results, so that reduce groups must be smaller than the fan-in
+        return "finding " * 200
+
+    monkeypatch.setattr(tools.llm_handler, "communicate_with_llm", mock_communicate_with_llm)
+    monkeypatch.setattr(tools.llm_handler, "token_budget", budget)
+    monkeypatch.setattr(tools.llm_handler, "adapter_registry", type("Registry", (), {
+        "resolve_name": lambda self, name: name
+    })())
+
+    test_config["agents"]["clarify"]["llm_config"] = "default_model_fast"
+    test_config["chunking"] = {"enabled": True, "chunk_tokens": 2000, "threshold_tokens": 3000,
+                               "reduce_fan_in": 8, "tokenizer": "estimate"}
+    plan = build_pipeline_plan(test_config)
+    stage = plan.get("clarify")
+    stage.system_prompt = "You are a careful editor. " * 20
+    thought = {"id": "big", "content": make_document(40, paragraph_words=120)}
+
+    chunks = split_thought(thought, plan.chunker)
+    assert max(tokenizer.count(chunk) for chunk in chunks) > budget.content_budget(
+        stage.template, "default_model_fast", stage.system_prompt)
+    result = run_stage(thought, stage, chunks=chunks, chunker=plan.chunker)
+
+    limit = budget.budget_for("default_model_fast")
+    assert result is not None
+    assert all(budget.count(prompt, "default_model_fast") + budget.count(system_prompt or "", "default_model_fast") <= limit
+               for prompt, system_prompt in prompts)
+    assert budget.truncated_count == 0
+    map_prompts = [prompt for prompt, system_prompt in prompts if system_prompt]
+    for section in range(40):
+        assert any(f"## Section {section}" in prompt for prompt in map_prompts)
+    assert thought["stage_metrics"]["clarify"]["chunks"] == len(map_prompts)
+    assert thought["stage_metrics"]["clarify"]["reduce_calls"] > 1
@@ -54,4 +54,49 @@ def test_file_watcher_setup():
         finally:
             # Stop the observer
             observer.stop()
-            observer.join()
\ No newline at end of file
+            observer.join()
+
+
+def test_file_watcher_waits_for_complete_writes():
+    """Test that a file written in several bursts is processed once, with its final content."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        received = []
+        observer = watch_folder(temp_dir, received.append, debounce_seconds=0.3, poll_interval=0.05)
+        
+        try:
+            time.sleep(0.1)
+            file_path = os.path.join(temp_dir, "slow_thought.txt")
+            with open(file_path, 'w') as f:
+                for part in ["This is ", "a slowly ", "written thought."]:
+                    f.write(part)
+                    f.flush()
+                    time.sleep(0.1)
+            
+            time.sleep(0.8)
+            
+            assert len(received) == 1
+            assert received[0]["content"] == "This is a slowly written thought."
+        finally:
+            observer.stop()
+            observer.join()
+
+def test_file_watcher_handles_renamed_temp_files():
+    """Test that editors' write-then-rename saves are picked up under the final name."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        received = []
+        observer = watch_folder(temp_dir, received.append, debounce_seconds=0.1, poll_interval=0.05)
+        
+        try:
+            time.sleep(0.1)
+            temp_path = os.path.join(temp_dir, ".thought.txt.tmp")
+            with open(temp_path, 'w') as f:
+                f.write("Saved via rename.")
+            os.rename(temp_path, os.path.join(temp_dir, "thought.txt"))
+            
+            time.sleep(0.5)
+            
+            assert [thought["original_filename"] for thought in received] == ["thought.txt"]
+            assert received[0]["content"] == "Saved via rename."
+        finally:
+            observer.stop()
+            observer.join()
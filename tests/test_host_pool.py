@@ -0,0 +1,212 @@
+# tests/test_host_pool.py
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+from adapters import LLMError
+from adapters.host_pool import OllamaHostPool
+from adapters.ollama_adapter import OllamaAdapter
+
+class StandInOllama:
+    """Minimal local HTTP server answering the Ollama endpoints the adapter uses."""
+
+    def __init__(self, name, delay=0.0):
+        self.name = name
+        self.delay = delay
+        self.healthy = True
+        self.missing_model = False
+        self.requests = 0
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if server.healthy:
+                    self._reply(200, {"version": "0.0.0"})
+                else:
+                    self._reply(503, {"error": "unavailable"})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not server.healthy:
+                    self._reply(500, {"error": "model runner crashed"})
+                    return
+                if server.missing_model:
+                    self._reply(404, {"error": "model 'test-model' not found"})
+                    return
+                with server._lock:
+                    server.requests += 1
+                    server.running += 1
+                    server.peak = max(server.peak, server.running)
+                time.sleep(server.delay)
+                with server._lock:
+                    server.running -= 1
+                self._reply(200, {
+                    "model": "test-model",
+                    "created_at": "2025-01-01T00:00:00Z",
+                    "response": f"from {server.name}",
+                    "done": True
+                })
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def stand_ins():
+    servers = [StandInOllama("a", delay=0.05), StandInOllama("b", delay=0.05)]
+    yield servers
+    for server in servers:
+        server.stop()
+
+def test_requests_are_spread_with_per_host_limits(stand_ins):
+    """Test that concurrent requests use every host without exceeding its limit."""
+    adapter = OllamaAdapter()
+    adapter.initialize({
+        "model": "test-model",
+        "base_url": [server.url for server in stand_ins],
+        "max_requests_per_host": 2,
+        "health_check_interval": 0
+    })
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda i: adapter.generate(f"prompt {i}"), range(12)))
+    finally:
+        adapter.close()
+
+    assert sorted(set(responses)) == ["from a", "from b"]
+    assert stand_ins[0].requests + stand_ins[1].requests == 12
+    assert stand_ins[0].peak <= 2 and stand_ins[1].peak <= 2
+    assert adapter.batch_concurrency == 4
+
+def test_failing_host_is_ejected_and_restored(stand_ins):
+    """Test that a failing host stops receiving requests until a health check passes."""
+    failing, healthy = stand_ins
+    failing.healthy = False
+    adapter = OllamaAdapter()
+    adapter.initialize({
+        "model": "test-model",
+        "base_url": [failing.url, healthy.url],
+        "eject_after_failures": 2,
+        "eject_seconds": 60,
+        "health_check_interval": 0
+    })
+    try:
+        responses = []
+        for i in range(8):
+            try:
+                responses.append(adapter.generate(f"prompt {i}"))
+            except LLMError:
+                responses.append(None)
+        assert responses.count(None) == 2
+        assert responses.count("from b") == 6
+        assert [host["available"] for host in adapter.host_pool.stats()] == [False, True]
+
+        failing.healthy = True
+        adapter.host_pool.check_health()
+        assert [host["available"] for host in adapter.host_pool.stats()] == [True, True]
+    finally:
+        adapter.close()
+
+def test_model_errors_do_not_eject_hosts(stand_ins):
+    """Test that errors the host answered with, like an unknown model, leave it in the pool."""
+    for server in stand_ins:
+        server.missing_model = True
+    adapter = OllamaAdapter()
+    adapter.initialize({
+        "model": "test-model",
+        "base_url": [server.url for server in stand_ins],
+        "eject_after_failures": 1,
+        "health_check_interval": 0
+    })
+    try:
+        for i in range(4):
+            with pytest.raises(LLMError):
+                adapter.generate(f"prompt {i}")
+        assert [host["available"] for host in adapter.host_pool.stats()] == [True, True]
+        assert [host["failures"] for host in adapter.host_pool.stats()] == [0, 0]
+    finally:
+        adapter.close()
+
+def test_pool_prefers_least_outstanding_host():
+    """Test that a request goes to the host with the fewest requests in progress."""
+    pool = OllamaHostPool(["http://a", "http://b"], lambda url: url, health_check_interval=0)
+
+    with pool.acquire() as first:
+        with pool.acquire() as second:
+            assert {first.url, second.url} == {"http://a", "http://b"}
+        with pool.acquire() as third:
+            assert third.url == second.url
+
+def test_pool_keeps_preferred_host_while_it_has_room():
+    """Test that a session's host is used while it is available and not full."""
+    pool = OllamaHostPool(["http://a", "http://b"], lambda url: url, max_requests_per_host=1,
+                          health_check_interval=0)
+
+    with pool.acquire() as primed:
+        pass
+    with pool.acquire() as other:
+        with pool.acquire(prefer=other) as pinned:
+            assert pinned is not other
+    with pool.acquire(prefer=primed) as first:
+        assert first is primed
+        with pool.acquire(prefer=primed) as second:
+            assert second is not primed
+
+def test_only_completed_requests_restore_an_ejected_host():
+    """Test that answered errors and abandoned streams leave an ejected host out."""
+    class NotFound(Exception):
+        status_code = 404
+
+    pool = OllamaHostPool(["http://a"], lambda url: url, eject_after_failures=1,
+                          eject_seconds=60, health_check_interval=0)
+    with pytest.raises(httpx.ConnectError):
+        with pool.acquire():
+            raise httpx.ConnectError("refused")
+    assert pool.stats()[0]["available"] is False
+
+    with pytest.raises(NotFound):
+        with pool.acquire():
+            raise NotFound()
+    def stream():
+        with pool.acquire():
+            yield "chunk"
+    chunks = stream()
+    next(chunks)
+    chunks.close()
+    assert pool.stats()[0]["available"] is False
+
+    with pool.acquire():
+        pass
+    assert pool.stats()[0]["available"] is True
+
+def test_acquire_timeout_is_read_from_the_config():
+    """Test that requests wait at most acquire_timeout for a free host."""
+    adapter = OllamaAdapter()
+    adapter.initialize({"model": "test-model", "base_url": ["http://a", "http://b"],
+                        "acquire_timeout": 2.5, "health_check_interval": 0})
+    try:
+        assert adapter.host_pool.acquire_timeout == 2.5
+    finally:
+        adapter.close()
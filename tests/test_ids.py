@@ -0,0 +1,37 @@
+# tests/test_ids.py
+import threading
+from datetime import datetime, timezone
+from utils.ids import new_thought_id, new_ulid, ulid_datetime
+
+def test_thought_ids_are_unique_and_sortable():
+    """Test that IDs created in a tight loop never collide and sort by creation."""
+    ids = [new_thought_id() for _ in range(10000)]
+    
+    assert len(set(ids)) == len(ids)
+    assert ids == sorted(ids)
+    assert all(thought_id.startswith("thought_") and len(thought_id) == 34 for thought_id in ids)
+
+def test_thought_ids_are_unique_across_threads():
+    """Test that concurrent workers get distinct IDs."""
+    ids = []
+    lock = threading.Lock()
+    
+    def create_ids():
+        created = [new_ulid() for _ in range(1000)]
+        with lock:
+            ids.extend(created)
+    
+    threads = [threading.Thread(target=create_ids) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(set(ids)) == 8000
+
+def test_ulid_encodes_creation_time():
+    """Test that the creation time can be read back from an ID."""
+    created = ulid_datetime(new_ulid())
+    
+    assert abs((datetime.now(timezone.utc) - created).total_seconds()) < 5
+    assert ulid_datetime("not-a-ulid") is None
@@ -1,4 +1,5 @@
 # tests/test_llm_adapter.py - revised
+import os
 import pytest
 from unittest.mock import patch
 from adapters.factory import create_adapter
@@ -53,4 +54,253 @@ def test_adapter_functionality():
     # Test set_config method
     adapter.set_config({"temperature": 0.5})
     assert adapter.config["temperature"] == 0.5
-    assert adapter.config["model"] == "test-model"  # Original config preserved
\ No newline at end of file
+    assert adapter.config["model"] == "test-model"  # Original config preserved
+
+
+def test_adapter_async_generation():
+    """Test that agenerate falls back to generate for adapters without an async client."""
+    import asyncio
+    adapter = MockLLMAdapter({"test query": "test response"})
+    adapter.initialize({"model": "test-model"})
+    
+    response = asyncio.run(adapter.agenerate("Here is a test query for you.", max_tokens=50))
+    
+    assert response == "test response"
+    assert adapter.calls[0]["max_tokens"] == 50
+
+@patch('adapters.factory.OllamaAdapter')
+def test_adapter_registry_creates_one_adapter_per_config(mock_adapter_class):
+    """Test that every LLM config gets its own initialized adapter."""
+    from adapters.registry import AdapterRegistry
+    mock_adapter_class.side_effect = lambda: MockLLMAdapter()
+    
+    registry = AdapterRegistry({
+        "fast": {"model": "small-model", "temperature": 0.7},
+        "comprehensive": {"adapter": "ollama", "model": "large-model", "temperature": 0.5},
+        "default": {"model": "default-model"}
+    })
+    
+    # Check that adapters are separate and keep their own configuration
+    assert registry.get("fast") is not registry.get("comprehensive")
+    assert registry.get("fast").config["model"] == "small-model"
+    assert registry.get("comprehensive").config["model"] == "large-model"
+    assert registry.get("fast").config["adapter"] == "ollama"
+    
+    # Unknown names fall back to the default config
+    assert registry.get("missing") is registry.get("default")
+
+@patch('adapters.factory.OllamaAdapter')
+def test_communicate_with_llm_uses_config_adapter(mock_adapter_class, monkeypatch):
+    """Test that requests go to the adapter of the requested config without reconfiguring it."""
+    import tools.llm_handler
+    from adapters.registry import AdapterRegistry
+    mock_adapter_class.side_effect = lambda: MockLLMAdapter({"query": "response"})
+    registry = AdapterRegistry({
+        "fast": {"model": "small-model"},
+        "default": {"model": "default-model"}
+    })
+    monkeypatch.setattr(tools.llm_handler, "adapter_registry", registry)
+    
+    assert tools.llm_handler.communicate_with_llm("a query", "fast") == "response"
+    
+    assert len(registry.get("fast").calls) == 1
+    assert len(registry.get("default").calls) == 0
+    assert registry.get("fast").config == {"adapter": "ollama", "model": "small-model"}
+
+@patch('adapters.factory.OllamaAdapter')
+def test_stream_with_llm_records_metrics(mock_adapter_class, monkeypatch):
+    """Test that streamed responses are assembled and their latency is recorded."""
+    import tools.llm_handler
+    from adapters.registry import AdapterRegistry
+    mock_adapter_class.side_effect = lambda: MockLLMAdapter({"query": "streamed response"})
+    registry = AdapterRegistry({"default": {"model": "default-model"}})
+    monkeypatch.setattr(tools.llm_handler, "adapter_registry", registry)
+    monkeypatch.setattr(tools.llm_handler, "response_cache", None)
+    
+    partials = []
+    response, metrics = tools.llm_handler.stream_with_llm("a query", on_text=partials.append)
+    
+    assert response == "streamed response"
+    assert partials == ["streamed response"]
+    assert metrics["chunks"] == 1
+    assert metrics["ttft_ms"] is not None
+    assert metrics["cached"] is False
+
+def test_ollama_generate_stream_yields_chunks():
+    """Test that the Ollama adapter yields the text of each streamed chunk."""
+    from unittest.mock import MagicMock
+    from adapters.ollama_adapter import OllamaAdapter
+    
+    adapter = OllamaAdapter()
+    adapter.initialize({"model": "test-model"})
+    adapter.client = MagicMock()
+    adapter.client.generate.return_value = iter([
+        MagicMock(response="Hello"), MagicMock(response=", "), MagicMock(response="world")
+    ])
+    
+    assert list(adapter.generate_stream("a prompt")) == ["Hello", ", ", "world"]
+    assert adapter.client.generate.call_args.kwargs["stream"] is True
+
+def test_generate_batch_runs_prompts_concurrently():
+    """Test that the default batch generation keeps prompt order while running in parallel."""
+    import threading
+    import time
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    class SlowAdapter(MockLLMAdapter):
+        def generate(self, prompt, **kwargs):
+            with lock:
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            time.sleep(0.05)
+            with lock:
+                state["running"] -= 1
+            return f"Response to {prompt}"
+
+    adapter = SlowAdapter()
+    responses = adapter.generate_batch([f"prompt {i}" for i in range(6)], max_concurrency=3)
+
+    assert responses == [f"Response to prompt {i}" for i in range(6)]
+    assert state["peak"] == 3
+
+@patch('litellm.batch_completion')
+def test_litellm_generate_batch_uses_batch_completion(mock_batch_completion):
+    """Test that LiteLLM batches are sent as one batch_completion call."""
+    from unittest.mock import MagicMock
+    from adapters.litellm_adapter import LiteLLMAdapter
+
+    def make_response(text):
+        response = MagicMock()
+        response.choices[0].message.content = text
+        return response
+    mock_batch_completion.return_value = [make_response("First"), RuntimeError("rate limited")]
+
+    adapter = LiteLLMAdapter()
+    adapter.initialize({"model": "gpt-4o-mini"})
+    responses = adapter.generate_batch(["one", "two"])
+
+    from adapters import LLMError
+    assert responses[0] == "First"
+    assert isinstance(responses[1], LLMError)
+    assert "rate limited" in str(responses[1])
+    kwargs = mock_batch_completion.call_args.kwargs
+    assert kwargs["messages"] == [[{"role": "user", "content": "one"}], [{"role": "user", "content": "two"}]]
+
+def test_ollama_warmup_loads_model_with_keep_alive():
+    """Test that warmup loads the model with an empty prompt and the configured keep_alive."""
+    from unittest.mock import MagicMock
+    from adapters.ollama_adapter import OllamaAdapter
+
+    adapter = OllamaAdapter()
+    adapter.initialize({"model": "test-model", "keep_alive": "30m"})
+    adapter.client = MagicMock()
+    adapter.client.generate.return_value = MagicMock(response="Hello")
+
+    assert adapter.warmup() is True
+    assert adapter.client.generate.call_args.kwargs == {"model": "test-model", "prompt": "", "keep_alive": "30m"}
+
+    adapter.generate("a prompt")
+    assert adapter.client.generate.call_args.kwargs["keep_alive"] == "30m"
+
+@patch('adapters.factory.OllamaAdapter')
+def test_warmup_models_loads_each_model_once(mock_adapter_class, monkeypatch):
+    """Test that configs sharing a model are warmed up together and timed."""
+    import tools.llm_handler
+    from adapters.registry import AdapterRegistry
+
+    class WarmupAdapter(MockLLMAdapter):
+        def warmup(self):
+            self.calls.append({"warmup": True})
+            return True
+
+    mock_adapter_class.side_effect = lambda: WarmupAdapter()
+    registry = AdapterRegistry({
+        "fast": {"model": "small-model"},
+        "fast_creative": {"model": "small-model", "temperature": 1.0},
+        "comprehensive": {"model": "large-model"}
+    })
+    monkeypatch.setattr(tools.llm_handler, "adapter_registry", registry)
+
+    report = tools.llm_handler.warmup_models(["fast", "fast_creative", "comprehensive"])
+
+    assert [(entry["model"], entry["configs"]) for entry in report] == [
+        ("small-model", ["fast", "fast_creative"]),
+        ("large-model", ["comprehensive"])
+    ]
+    assert all(entry["seconds"] is not None and entry["error"] is None for entry in report)
+    assert len(registry.get("fast").calls) + len(registry.get("fast_creative").calls) == 1
+
+def test_ollama_session_reuses_context():
+    """Test that a session sends the content once and later requests continue from its context."""
+    from unittest.mock import MagicMock
+    from adapters.ollama_adapter import OllamaAdapter
+
+    adapter = OllamaAdapter()
+    adapter.initialize({"model": "test-model"})
+    adapter.client = MagicMock()
+    context = list(range(510))
+    def reply(text, prompt_tokens, evaluated, ms):
+        # The returned context is the session context, the prompt and the 5 generated tokens
+        return MagicMock(response=text, context=context + [0] * (prompt_tokens + 5), eval_count=5,
+                         prompt_eval_count=evaluated, prompt_eval_duration=ms * 1_000_000)
+    adapter.client.generate.side_effect = [
+        MagicMock(response="OK", context=context, prompt_eval_count=500, prompt_eval_duration=2_000_000_000),
+        reply("First", 20, 20, 80),
+        reply("Second", 30, 30, 120),
+        # The server lost the context and evaluated it again
+        reply("Third", 40, 550, 2200)
+    ]
+
+    session = adapter.open_session("A long thought")
+    assert "A long thought" in adapter.client.generate.call_args.kwargs["prompt"]
+
+    assert session.generate("Clarify it", system_prompt="You clarify.") == "First"
+    assert session.generate("Categorize it") == "Second"
+    for call in adapter.client.generate.call_args_list[1:]:
+        assert call.kwargs["context"] == context
+        assert "A long thought" not in call.kwargs["prompt"]
+    assert adapter.client.generate.call_args_list[1].kwargs["prompt"] == "You clarify.\n\nClarify it"
+
+    # Without the session: 520 and 530 tokens at the priming request's 4 ms per token
+    assert session.stats() == {"model": "test-model", "requests": 2, "prefill_tokens": 500,
+                               "prompt_tokens": 50, "measured_requests": 2, "baseline_tokens": 1050,
+                               "saved_tokens": 500, "saved_ms": 2000.0}
+
+    assert session.generate("Crystallize it") == "Third"
+    assert session.stats()["saved_tokens"] == 490
+    assert session.stats()["saved_ms"] == 1960.0
+
+@patch('litellm.completion')
+def test_litellm_passes_resolved_api_key_per_request(mock_completion, monkeypatch):
+    """Test that API keys are expanded from the environment and never written back to it."""
+    from unittest.mock import MagicMock
+    from adapters.litellm_adapter import LiteLLMAdapter
+    monkeypatch.delenv("UNSET_API_KEY", raising=False)
+    monkeypatch.setenv("OPENAI_API_KEY", "real-key")
+    monkeypatch.setenv("PROJECT_API_KEY", "project-key")
+    mock_completion.return_value = MagicMock(choices=[MagicMock(message=MagicMock(content="response"))])
+
+    placeholder = LiteLLMAdapter()
+    placeholder.initialize({"model": "gpt-4", "api_key": "${UNSET_API_KEY}"})
+    placeholder.generate("a prompt")
+    assert placeholder.api_key is None
+    assert "api_key" not in mock_completion.call_args.kwargs
+    assert os.environ["OPENAI_API_KEY"] == "real-key"
+
+    configured = LiteLLMAdapter()
+    configured.initialize({"model": "gpt-4", "api_key": "${PROJECT_API_KEY}"})
+    configured.generate("a prompt")
+    assert mock_completion.call_args.kwargs["api_key"] == "project-key"
+    assert os.environ["OPENAI_API_KEY"] == "real-key"
+
+def test_adapter_registry_creates_adapters_on_first_use():
+    """Test that configs are only turned into adapters when requested."""
+    from adapters import LLMError
+    from adapters.registry import AdapterRegistry
+    registry = AdapterRegistry({"broken": {"adapter": "unknown"}, "default": {"adapter": "unknown"}})
+
+    assert registry.names() == ["broken", "default"]
+    assert registry.get_config("missing")["adapter"] == "unknown"
+    with pytest.raises(LLMError):
+        registry.get("broken")
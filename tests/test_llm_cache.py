@@ -0,0 +1,99 @@
+# tests/test_llm_cache.py
+import os
+import time
+import pytest
+import tools.llm_handler
+from unittest.mock import patch
+from tools.llm_cache import LLMResponseCache
+from tests.mock_adapter import MockLLMAdapter
+
+def test_cache_key_covers_request_parameters():
+    """Test that any change to model, parameters or prompt changes the key."""
+    key = LLMResponseCache.make_key("ollama", "llama3:8b", 0.7, 2048, None, "prompt")
+    
+    assert key == LLMResponseCache.make_key("ollama", "llama3:8b", 0.7, 2048, None, "prompt")
+    assert key != LLMResponseCache.make_key("ollama", "llama3:8b", 0.5, 2048, None, "prompt")
+    assert key != LLMResponseCache.make_key("ollama", "llama3:8b", 0.7, 2048, "system", "prompt")
+    assert key != LLMResponseCache.make_key("litellm", "llama3:8b", 0.7, 2048, None, "prompt")
+    assert key != LLMResponseCache.make_key("ollama", "llama3:8b", 0.7, 2048, None, "other prompt")
+
+def test_cache_persists_and_counts_hits(temp_dir):
+    """Test that responses survive a restart and hits are counted per level."""
+    path = os.path.join(temp_dir, "cache", "responses.sqlite3")
+    cache = LLMResponseCache(path=path)
+    cache.set("key", "cached response")
+    assert cache.get("key") == "cached response"
+    assert cache.get("missing") is None
+    cache.close()
+    
+    reopened = LLMResponseCache(path=path)
+    assert reopened.get("key") == "cached response"
+    assert reopened.get("key") == "cached response"
+    
+    stats = reopened.stats()
+    assert stats["disk_hits"] == 1
+    assert stats["memory_hits"] == 1
+    assert stats["misses"] == 0
+    reopened.close()
+
+def test_cache_evicts_by_size_and_age():
+    """Test LRU eviction in memory and expiry by TTL."""
+    cache = LLMResponseCache(max_memory_entries=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    cache.get("a")
+    cache.set("c", "3")
+    
+    # "b" was least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    
+    expiring = LLMResponseCache(ttl_seconds=0.05)
+    expiring.set("a", "1")
+    time.sleep(0.1)
+    assert expiring.get("a") is None
+
+@patch('adapters.factory.OllamaAdapter')
+def test_communicate_with_llm_uses_cache(mock_adapter_class, monkeypatch):
+    """Test that repeated prompts are served from the cache unless the config opts out."""
+    from adapters.registry import AdapterRegistry
+    mock_adapter_class.side_effect = lambda: MockLLMAdapter({"query": "response"})
+    registry = AdapterRegistry({
+        "default": {"model": "default-model"},
+        "creative": {"model": "default-model", "temperature": 1.2, "cache": False}
+    })
+    monkeypatch.setattr(tools.llm_handler, "adapter_registry", registry)
+    monkeypatch.setattr(tools.llm_handler, "response_cache", None)
+    cache = tools.llm_handler.initialize_response_cache({"enabled": True})
+    
+    try:
+        for _ in range(3):
+            assert tools.llm_handler.communicate_with_llm("a query", "default") == "response"
+            assert tools.llm_handler.communicate_with_llm("a query", "creative") == "response"
+        
+        assert len(registry.get("default").calls) == 1
+        assert len(registry.get("creative").calls) == 3
+        assert cache.stats()["hits"] == 2
+    finally:
+        tools.llm_handler.initialize_response_cache({})
+
+@patch('adapters.factory.OllamaAdapter')
+def test_system_prompt_is_sent_and_part_of_cache_key(mock_adapter_class, monkeypatch):
+    """Test that the system prompt reaches the adapter and separates cache entries."""
+    from adapters.registry import AdapterRegistry
+    mock_adapter_class.side_effect = lambda: MockLLMAdapter({"query": "response"})
+    registry = AdapterRegistry({"default": {"model": "default-model"}})
+    monkeypatch.setattr(tools.llm_handler, "adapter_registry", registry)
+    monkeypatch.setattr(tools.llm_handler, "call_policies", {})
+    monkeypatch.setattr(tools.llm_handler, "response_cache", None)
+    tools.llm_handler.initialize_response_cache({"enabled": True})
+    
+    try:
+        tools.llm_handler.communicate_with_llm("a query", "default", system_prompt="You are A.")
+        tools.llm_handler.communicate_with_llm("a query", "default", system_prompt="You are A.")
+        tools.llm_handler.communicate_with_llm("a query", "default", system_prompt="You are B.")
+        
+        calls = registry.get("default").calls
+        assert [call["system_prompt"] for call in calls] == ["You are A.", "You are B."]
+    finally:
+        tools.llm_handler.initialize_response_cache({})
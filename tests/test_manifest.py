@@ -0,0 +1,110 @@
+# tests/test_manifest.py
+import os
+import pytest
+from tools.manifest import ProcessedManifest
+from tools.file_watcher import process_existing_files, read_file
+
+def write_capture(folder, name, content):
+    path = os.path.join(folder, name)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+def test_manifest_persists_processed_files(temp_dir):
+    """Test that recorded files are remembered after reloading the manifest."""
+    manifest_path = os.path.join(temp_dir, "manifest.jsonl")
+    capture_path = write_capture(temp_dir, "thought.txt", "An idea")
+    thought = read_file(capture_path)
+    
+    manifest = ProcessedManifest(manifest_path)
+    manifest.record_thought(thought)
+    
+    reloaded = ProcessedManifest(manifest_path)
+    stat = os.stat(capture_path)
+    assert len(reloaded) == 1
+    assert reloaded.is_unchanged(capture_path, stat.st_size, stat.st_mtime_ns)
+    assert reloaded.claim(thought["content_hash"], "thought_new") == thought["id"]
+
+def test_startup_scan_skips_unchanged_files(temp_dir):
+    """Test that only new or modified files are processed on startup."""
+    capture_folder = os.path.join(temp_dir, "capture")
+    os.makedirs(capture_folder)
+    manifest = ProcessedManifest(os.path.join(temp_dir, "manifest.jsonl"))
+    
+    processed = []
+    first = write_capture(capture_folder, "first.txt", "First idea")
+    write_capture(capture_folder, "second.txt", "Second idea")
+    assert process_existing_files(capture_folder, processed.append, manifest) == 2
+    for thought in processed:
+        manifest.record_thought(thought)
+    
+    # Nothing changed, nothing is processed again
+    processed.clear()
+    assert process_existing_files(capture_folder, processed.append, manifest) == 0
+    
+    # A modified file is picked up again
+    write_capture(capture_folder, "first.txt", "First idea, now longer")
+    assert process_existing_files(capture_folder, processed.append, manifest) == 1
+    assert processed[0]["original_path"] == first
+
+def test_duplicate_content_is_not_resubmitted(temp_dir):
+    """Test that a copy of processed content is recorded instead of processed."""
+    from main import make_thought_submitter
+    manifest = ProcessedManifest(os.path.join(temp_dir, "manifest.jsonl"))
+    submitted = []
+    executor = type('Executor', (), {"submit": lambda self, thought: submitted.append(thought) or True})()
+    submit = make_thought_submitter(executor, manifest)
+    
+    original = read_file(write_capture(temp_dir, "idea.txt", "Same idea"))
+    copy = read_file(write_capture(temp_dir, "idea copy.txt", "Same idea"))
+    copy["id"] = "thought_copy"
+    
+    assert submit(original) is True
+    assert submit(copy) is False
+    assert submitted == [original]
+    # The copy is recorded once the original is written
+    assert not manifest.is_unchanged(copy["original_path"], copy["original_size"], copy["original_mtime_ns"])
+    manifest.record_thought(original)
+    assert manifest.is_unchanged(copy["original_path"], copy["original_size"], copy["original_mtime_ns"])
+    assert sorted(manifest.sources(original["id"])) == sorted([original["original_path"], copy["original_path"]])
+
+def test_failed_background_write_releases_claim(temp_dir):
+    """Test that content whose result could not be written is processed again."""
+    from main import make_thought_submitter, save_result
+    from tools.output_writer import ResultWriter, PartialResultWriter
+    manifest = ProcessedManifest(os.path.join(temp_dir, "manifest.jsonl"))
+    submitted = []
+    executor = type('Executor', (), {"submit": lambda self, thought: submitted.append(thought) or True})()
+    submit = make_thought_submitter(executor, manifest)
+    
+    original = read_file(write_capture(temp_dir, "idea.txt", "Same idea"))
+    assert submit(original) is True
+    original["unserializable"] = {"a set"}
+    
+    partial_writer = PartialResultWriter(os.path.join(temp_dir, "output"))
+    partial_writer.update(original, "clarify", "Half an answer", force=True)
+    writer = ResultWriter(os.path.join(temp_dir, "output"), flush_interval=0.01)
+    save_result(original, {}, manifest, writer, partial_writer)
+    writer.close()
+    
+    assert writer.failed_count == 1
+    assert not os.path.exists(partial_writer.path_for(original["id"]))
+    retry = read_file(original["original_path"])
+    retry["id"] = "thought_retry"
+    assert submit(retry) is True
+
+def test_failed_processing_clears_partial_result(temp_dir, test_config, monkeypatch):
+    """Test that a thought whose processing raised leaves no partial result behind."""
+    import main
+    from tools.output_writer import PartialResultWriter
+    partial_writer = PartialResultWriter(os.path.join(temp_dir, "output"))
+    thought = {"id": "thought_failed", "content": "An idea"}
+    
+    def failing_graph(thought_object, *args, **kwargs):
+        partial_writer.update(thought_object, "clarify", "Half an answer", force=True)
+        raise RuntimeError("worker crashed")
+    monkeypatch.setattr(main, "run_stage_graph", failing_graph)
+    
+    with pytest.raises(RuntimeError):
+        main.process_thought(thought, test_config, partial_writer=partial_writer)
+    assert not os.path.exists(partial_writer.path_for("thought_failed"))
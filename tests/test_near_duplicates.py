@@ -0,0 +1,116 @@
+# tests/test_near_duplicates.py
+import os
+from tools.near_duplicates import MinHasher, NearDuplicateIndex, choose_bands
+from tools.manifest import ProcessedManifest
+from tools.file_watcher import read_file
+
+NOTE = ("Call the plumber about the leaking kitchen tap before the weekend, and ask whether "
+        "they can also look at the water heater in the basement while they are here. "
+        "Remember to get a written quote first and compare it with last year's invoice.")
+
+def make_thought(thought_id, content):
+    return {"id": thought_id, "content": content}
+
+def test_signatures_estimate_similarity():
+    """Test that near-identical texts get near-identical signatures and unrelated ones don't."""
+    hasher = MinHasher()
+    original = hasher.signature(NOTE)
+    edited = hasher.signature(NOTE.replace("weekend", "Weekend!") + " ")
+    unrelated = hasher.signature("Outline for the conference talk on distributed tracing.")
+
+    assert (original == edited).mean() == 1.0
+    assert (original == unrelated).mean() < 0.2
+    assert choose_bands(0.85, 128) == (16, 8)
+
+def test_index_finds_near_duplicates_after_reload(temp_dir):
+    """Test that a persisted index still recognizes earlier captures."""
+    path = os.path.join(temp_dir, "near_duplicates")
+    index = NearDuplicateIndex(path=path, threshold=0.8, snapshot_every=2)
+    for number in range(3):
+        assert index.check(make_thought(f"other_{number}", f"Unrelated note number {number} about errands")) == (None, None)
+    assert index.check(make_thought("original", NOTE)) == (None, None)
+
+    reopened = NearDuplicateIndex(path=path, threshold=0.8)
+    duplicate_of, similarity = reopened.check(make_thought("copy", NOTE.replace("first", "beforehand")))
+    assert len(reopened) == 4
+    assert duplicate_of == "original"
+    assert similarity >= 0.8
+    assert reopened.stats()["duplicates"] == 1
+
+def write_notes(folder, *contents):
+    paths = []
+    for number, content in enumerate(contents):
+        paths.append(os.path.join(folder, f"tap {number}.txt"))
+        with open(paths[-1], 'w') as f:
+            f.write(content)
+    return paths
+
+def test_submitter_collapses_near_duplicates(temp_dir):
+    """Test that a near-duplicate capture is recorded as a source once the original is written."""
+    from main import make_thought_submitter
+    manifest = ProcessedManifest(os.path.join(temp_dir, "manifest.jsonl"))
+    submitted = []
+    executor = type('Executor', (), {"submit": lambda self, thought: submitted.append(thought) or True})()
+    submit = make_thought_submitter(executor, manifest, NearDuplicateIndex(threshold=0.8))
+
+    paths = write_notes(temp_dir, NOTE, NOTE + "\n\nSent from my phone")
+    original = read_file(paths[0])
+    conflict = read_file(paths[1])
+    conflict["id"] = "thought_conflict"
+
+    assert submit(original) is True
+    assert submit(conflict) is False
+    assert submitted == [original]
+    assert "sources" not in original
+    assert not manifest.is_unchanged(conflict["original_path"], conflict["original_size"], conflict["original_mtime_ns"])
+
+    manifest.record_thought(original)
+    assert sorted(manifest.sources(original["id"])) == sorted(paths)
+
+def test_failed_thought_is_retried_after_restart(temp_dir):
+    """Test that a capture whose thought failed is not skipped as a duplicate of it."""
+    from main import make_thought_submitter, release_manifest_claim
+    manifest_path = os.path.join(temp_dir, "manifest.jsonl")
+    index_path = os.path.join(temp_dir, "near_duplicates")
+    submitted = []
+    executor = type('Executor', (), {"submit": lambda self, thought: submitted.append(thought) or True})()
+
+    manifest = ProcessedManifest(manifest_path)
+    submit = make_thought_submitter(executor, manifest, NearDuplicateIndex(index_path, threshold=0.8))
+    paths = write_notes(temp_dir, NOTE, NOTE + " Thanks!")
+    first = read_file(paths[0])
+    conflict = read_file(paths[1])
+    conflict["id"] = "thought_conflict"
+    assert submit(first) is True
+    assert submit(conflict) is False
+    release_manifest_claim(first, manifest)
+
+    manifest = ProcessedManifest(manifest_path)
+    submit = make_thought_submitter(executor, manifest, NearDuplicateIndex(index_path, threshold=0.8))
+    retry = read_file(paths[0])
+    retry["id"] = "thought_retry"
+    assert not manifest.is_unchanged(paths[1], conflict["original_size"], conflict["original_mtime_ns"])
+    assert submit(retry) is True
+    assert submitted[-1] is retry
+
+def test_edited_note_is_not_a_duplicate_of_its_earlier_version(temp_dir):
+    """Test that a small edit to a processed note is processed again, also after a restart."""
+    from main import make_thought_submitter
+    manifest = ProcessedManifest(os.path.join(temp_dir, "manifest.jsonl"))
+    index_path = os.path.join(temp_dir, "near_duplicates")
+    submitted = []
+    executor = type('Executor', (), {"submit": lambda self, thought: submitted.append(thought) or True})()
+    submit = make_thought_submitter(executor, manifest, NearDuplicateIndex(index_path, threshold=0.8))
+
+    path, = write_notes(temp_dir, NOTE)
+    first = read_file(path)
+    assert submit(first) is True
+    manifest.record_thought(first)
+
+    with open(path, 'a') as f:
+        f.write(" Also ask about the garden hose.")
+    edited = read_file(path)
+    edited["id"] = "thought_edited"
+    submit = make_thought_submitter(executor, manifest, NearDuplicateIndex(index_path, threshold=0.8))
+    assert submit(edited) is True
+    assert submitted == [first, edited]
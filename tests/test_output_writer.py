@@ -49,4 +49,117 @@ def test_output_writing():
         assert saved_thought["processing_stage"] == thought["processing_stage"]
         assert len(saved_thought["processing_history"]) == len(thought["processing_history"])
         assert "capture_results" in saved_thought
-        assert "connect_results" in saved_thought
\ No newline at end of file
+        assert "connect_results" in saved_thought
+def test_sharded_output_layout():
+    """Test that results are sharded by date and hash and can be found by ID."""
+    from tools.output_writer import find_result, load_index
+    from utils.ids import new_thought_id, ulid_datetime
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        thoughts = [{"id": new_thought_id(), "timestamp": "2025-03-13T12:00:00", "content": f"Thought {i}"}
+                    for i in range(3)]
+        paths = [write_result(thought, temp_dir, layout="sharded", shard_chars=2) for thought in thoughts]
+        
+        # Check that results live in date and hash shard directories
+        created = ulid_datetime(thoughts[0]["id"].split("_", 1)[1])
+        relative = os.path.relpath(paths[0], temp_dir).split(os.sep)
+        assert relative[:3] == [f"{created:%Y}", f"{created:%m}", f"{created:%d}"]
+        assert len(relative[3]) == 2
+        
+        # Check that every result can be found from its ID and is indexed
+        index = load_index(temp_dir)
+        for thought, path in zip(thoughts, paths):
+            assert find_result(temp_dir, thought["id"], shard_chars=2) == path
+            assert os.path.join(temp_dir, index[thought["id"]]["path"]) == path
+
+def test_background_writer_writes_batches_atomically():
+    """Test that queued thoughts are written by the writer thread without temp files left behind."""
+    from tools.output_writer import ResultWriter, load_index
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        written = []
+        writer = ResultWriter(temp_dir, compact=True, fsync="batch", batch_size=10, flush_interval=0.05)
+        try:
+            for i in range(25):
+                writer.submit({"id": f"thought_{i}", "content": f"Thought {i}"}, on_written=written.append)
+            writer.flush()
+        finally:
+            writer.close()
+        
+        assert len(written) == 25
+        assert writer.written_count == 25
+        assert len(load_index(temp_dir)) == 25
+        assert not [name for name in os.listdir(temp_dir) if name.endswith(".tmp")]
+        
+        # Compact output has no indentation
+        with open(written[0], 'r') as f:
+            text = f.read()
+        assert "\n" not in text
+        assert json.loads(text)["content"] == "Thought 0"
+
+def test_background_writer_survives_batch_failures(monkeypatch):
+    """Test that a failed index update fails the batch but keeps the writer running."""
+    import tools.output_writer
+    from tools.output_writer import ResultWriter
+    
+    def failing_append_to_index(output_folder, written):
+        raise OSError("disk full")
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        written = []
+        failed = []
+        writer = ResultWriter(temp_dir, batch_size=10, flush_interval=0.05)
+        try:
+            monkeypatch.setattr(tools.output_writer, "append_to_index", failing_append_to_index)
+            for i in range(3):
+                writer.submit({"id": f"thought_{i}"}, on_written=written.append, on_failed=failed.append)
+            writer.flush()
+            
+            assert written == []
+            assert len(failed) == 3 and all("disk full" in str(e) for e in failed)
+            assert writer.failed_count == 3
+            
+            monkeypatch.undo()
+            writer.submit({"id": "thought_3"}, on_written=written.append, on_failed=failed.append)
+            writer.flush()
+            assert len(written) == 1
+        finally:
+            writer.close()
+
+def test_atomic_write_keeps_previous_file_on_failure():
+    """Test that a failed write never leaves a truncated result."""
+    class Unserializable:
+        pass
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_path = os.path.join(temp_dir, "processed_thought.json")
+        thought = {"id": "thought", "content": "Original"}
+        write_result(thought, temp_dir)
+        
+        with pytest.raises(TypeError):
+            write_result({"id": "thought", "content": Unserializable()}, temp_dir)
+        
+        with open(output_path, 'r') as f:
+            assert json.load(f)["content"] == "Original"
+        assert sorted(os.listdir(temp_dir)) == ["index.jsonl", "processed_thought.json"]
+
+def test_partial_result_writer_throttles_and_clears():
+    """Test that partial results are rewritten at most once per interval and removed when done."""
+    from tools.output_writer import PartialResultWriter
+    
+    with tempfile.TemporaryDirectory() as temp_dir:
+        partial_writer = PartialResultWriter(temp_dir, interval=60)
+        thought = {"id": "thought_1", "original_filename": "idea.md"}
+        path = partial_writer.path_for("thought_1")
+        
+        partial_writer.update(thought, "clarify", "The first")
+        partial_writer.update(thought, "clarify", "The first words")
+        with open(path, 'r') as f:
+            assert json.load(f)["partial_results"] == {"clarify": "The first"}
+        
+        partial_writer.update(thought, "clarify", "The first words", force=True)
+        with open(path, 'r') as f:
+            assert json.load(f)["partial_results"] == {"clarify": "The first words"}
+        
+        partial_writer.clear("thought_1")
+        assert not os.path.exists(path)
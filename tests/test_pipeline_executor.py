@@ -0,0 +1,85 @@
+# tests/test_pipeline_executor.py
+import threading
+import time
+import pytest
+from tools.pipeline_executor import PipelineExecutor
+
+def test_executor_processes_thoughts_concurrently():
+    """Test that thoughts are processed by several workers at once."""
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0, "done": []}
+
+    def slow_process(thought):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.1)
+        with lock:
+            state["running"] -= 1
+            state["done"].append(thought["id"])
+
+    executor = PipelineExecutor(slow_process, max_workers=3, max_in_flight=6).start()
+    try:
+        for i in range(6):
+            assert executor.submit({"id": f"thought_{i}"})
+
+        # Check that all thoughts were drained by the workers
+        assert executor.join(timeout=5)
+        assert sorted(state["done"]) == [f"thought_{i}" for i in range(6)]
+        assert state["peak"] == 3
+        assert executor.in_flight == 0
+    finally:
+        executor.shutdown()
+
+def test_executor_bounds_in_flight_thoughts():
+    """Test that submit refuses work when max_in_flight is reached."""
+    release = threading.Event()
+    executor = PipelineExecutor(lambda thought: release.wait(), max_workers=1, max_in_flight=2).start()
+    try:
+        assert executor.submit({"id": "thought_1"})
+        assert executor.submit({"id": "thought_2"})
+        assert executor.submit({"id": "thought_3"}, block=False) is False
+        assert executor.in_flight == 2
+    finally:
+        release.set()
+        executor.join(timeout=5)
+        executor.shutdown()
+
+def test_executor_survives_processing_errors():
+    """Test that a failing thought does not stop the worker."""
+    def process(thought):
+        if thought["id"] == "bad":
+            raise RuntimeError("boom")
+
+    executor = PipelineExecutor(process, max_workers=1, max_in_flight=4).start()
+    try:
+        executor.submit({"id": "bad"})
+        executor.submit({"id": "good"})
+        assert executor.join(timeout=5)
+        assert executor.failed_count == 1
+        assert executor.processed_count == 1
+    finally:
+        executor.shutdown()
+
+def test_async_executor_runs_thoughts_on_one_loop():
+    """Test that the async executor keeps many thoughts in flight on one thread."""
+    import asyncio
+    from tools.pipeline_executor import AsyncPipelineExecutor
+    threads = set()
+
+    async def aprocess(thought):
+        threads.add(threading.current_thread().name)
+        await asyncio.sleep(0.1)
+
+    executor = AsyncPipelineExecutor(aprocess, max_in_flight=20).start()
+    try:
+        start = time.monotonic()
+        for i in range(20):
+            executor.submit({"id": f"thought_{i}"})
+        assert executor.join(timeout=5)
+
+        assert time.monotonic() - start < 0.5
+        assert executor.processed_count == 20
+        assert threads == {"thought-event-loop"}
+    finally:
+        executor.shutdown()
@@ -0,0 +1,127 @@
+# tests/test_pipeline_plan.py
+import os
+import pytest
+import tools.llm_handler
+from tools.pipeline_plan import build_pipeline_plan, CompiledTemplate
+from tools.document_processor import run_stage
+
+def test_plan_resolves_agents_and_templates(test_config):
+    """Test that the plan is compiled from the merged configuration."""
+    plan = build_pipeline_plan(test_config)
+
+    assert [agent_id for agent_id, _ in plan.stage_order] == [
+        "capture", "contextualize", "clarify", "categorize", "crystallize", "connect"
+    ]
+    stage = plan.get("clarify")
+    assert stage.agent.role == "Thought Clarifier"
+    assert stage.llm_config == "test_llm"
+    assert stage.result_key == "clarify_results"
+    assert stage.template.render("Hello") == "You are acting as the Clarify agent. Thought: Hello"
+
+def test_compiled_template_fills_every_placeholder():
+    """Test that compiled templates match the old replace-based filling."""
+    template = CompiledTemplate("A {thought_content} B {thought_content}")
+    assert template.render("x") == "A x B x"
+    assert CompiledTemplate("No placeholder").render("x") == "No placeholder"
+
+def test_run_stage_uses_planned_config(test_config, monkeypatch):
+    """Test that a planned stage sends the rendered prompt to its LLM config."""
+    calls = []
+    def mock_communicate_with_llm(prompt, config_name='default'):
+        calls.append((prompt, config_name))
+        return "Connected"
+    monkeypatch.setattr(tools.llm_handler, "communicate_with_llm", mock_communicate_with_llm)
+
+    plan = build_pipeline_plan(test_config)
+    result = run_stage({"content": "This is a test thought."}, plan.get("connect"))
+
+    assert result == "Connected"
+    assert calls == [("You are acting as the Connect agent. Thought: This is a test thought.", "test_llm")]
+
+def test_process_thought_with_plan(test_config, test_thought, temp_dir, monkeypatch):
+    """Test the full pipeline run with a precompiled plan."""
+    from main import process_thought
+    monkeypatch.setattr(tools.llm_handler, "communicate_with_llm", lambda prompt, config_name='default': "ok")
+    test_config["folders"]["base"] = temp_dir
+
+    plan = build_pipeline_plan(test_config)
+    result = process_thought(test_thought, test_config, plan)
+
+    assert result["processing_stage"] == "connect"
+    assert len(result["processing_history"]) == 6
+    assert os.path.exists(os.path.join(temp_dir, "connect", "processed_test_thought_1.json"))
+
+def test_cascade_escalates_when_checks_fail(test_config, monkeypatch):
+    """Test that a cheap response failing the checks is replaced by the agent's config."""
+    calls = []
+    def mock_communicate_with_llm(prompt, config_name='default'):
+        calls.append(config_name)
+        if config_name == "cheap_llm":
+            return "Too short"
+        return "Connections: A and B. Next step: read more about B."
+
+    monkeypatch.setattr(tools.llm_handler, "communicate_with_llm", mock_communicate_with_llm)
+    monkeypatch.setattr(tools.llm_handler, "token_budget", None)
+
+    test_config["agents"]["connect"]["cascade"] = {
+        "configs": ["cheap_llm"],
+        "min_length": 20,
+        "required_sections": ["next step"]
+    }
+    plan = build_pipeline_plan(test_config)
+    stage = plan.get("connect")
+    thought = {"id": "t", "content": "A thought"}
+
+    result = run_stage(thought, stage, stream=True)
+
+    assert calls == ["cheap_llm", "test_llm"]
+    assert result.startswith("Connections")
+    decision = thought["stage_metrics"]["connect"]["cascade"]
+    assert decision["answered_by"] == "test_llm"
+    assert decision["escalations"][0]["config"] == "cheap_llm"
+    assert "missing 'next step'" in decision["escalations"][0]["reasons"]
+
+def test_cascade_keeps_cheap_response_that_passes(test_config, monkeypatch):
+    """Test that a cheap response passing the checks is used without escalating."""
+    calls = []
+    def mock_communicate_with_llm(prompt, config_name='default'):
+        calls.append(config_name)
+        return "A perfectly good answer with a next step."
+
+    monkeypatch.setattr(tools.llm_handler, "communicate_with_llm", mock_communicate_with_llm)
+    monkeypatch.setattr(tools.llm_handler, "token_budget", None)
+
+    test_config["agents"]["connect"]["cascade"] = ["cheap_llm"]
+    plan = build_pipeline_plan(test_config)
+    thought = {"id": "t", "content": "A thought"}
+
+    assert run_stage(thought, plan.get("connect")) == "A perfectly good answer with a next step."
+    assert calls == ["cheap_llm"]
+    assert plan.get("connect").cascade.stats() == {"accepted": {"cheap_llm": 1}, "escalations": 0}
+
+def test_split_template_builds_system_prompt(test_config, monkeypatch):
+    """Test that split templates send agent and instructions as a fixed system prompt."""
+    calls = []
+    def mock_communicate_with_llm(prompt, config_name='default', system_prompt=None):
+        calls.append((prompt, system_prompt))
+        return "Clarified"
+
+    monkeypatch.setattr(tools.llm_handler, "communicate_with_llm", mock_communicate_with_llm)
+    monkeypatch.setattr(tools.llm_handler, "token_budget", None)
+
+    test_config["prompts"]["clarify_prompt_template"] = {
+        "system": "Expand abbreviations.",
+        "user": "Thought content: {thought_content}"
+    }
+    plan = build_pipeline_plan(test_config)
+    stage = plan.get("clarify")
+
+    run_stage({"id": "a", "content": "First"}, stage)
+    run_stage({"id": "b", "content": "Second"}, stage)
+
+    assert stage.system_prompt.startswith("You are the Thought Clarifier.")
+    assert stage.system_prompt.endswith("Expand abbreviations.")
+    assert calls == [("Thought content: First", stage.system_prompt),
+                     ("Thought content: Second", stage.system_prompt)]
+    # Stages with plain string templates keep sending a single prompt
+    assert plan.get("capture").llm_kwargs() == {}
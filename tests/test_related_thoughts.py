@@ -0,0 +1,94 @@
+# tests/test_related_thoughts.py
+import os
+import numpy as np
+import tools.llm_handler
+from tools.vector_index import VectorIndex
+from tools.related_thoughts import RelatedThoughts
+from tools.output_writer import write_result
+
+VOCABULARY = ["garden", "tomatoes", "plant", "water", "tax", "return", "deadline", "file"]
+
+def bag_of_words(texts):
+    """Embed texts as counts of a fixed vocabulary, so similar wordings get similar vectors."""
+    return [[float(sum(word.startswith(term) for word in text.lower().replace(".", "").split()))
+             for term in VOCABULARY] for text in texts]
+
+def make_thought(thought_id, content):
+    return {"id": thought_id, "content": content, "original_filename": f"{thought_id}.txt",
+            "processing_stage": "input", "processing_history": []}
+
+def test_partitioned_search_matches_exhaustive_search(temp_dir):
+    """Test that the IVF search finds the same neighbours, also after reloading the index."""
+    rng = np.random.RandomState(0)
+    centers = rng.randn(20, 16)
+    vectors = centers[rng.randint(20, size=2000)] + 0.1 * rng.randn(2000, 16)
+    entries = [{"id": f"t{i}"} for i in range(2000)]
+
+    exhaustive = VectorIndex(ivf_min_rows=0)
+    exhaustive.add(vectors, entries)
+    path = os.path.join(temp_dir, "vectors")
+    partitioned = VectorIndex(path=path, nlist=20, nprobe=3, ivf_min_rows=500)
+    partitioned.add(vectors[:1000], entries[:1000])
+    partitioned.add(vectors[1000:], entries[1000:])
+    partitioned.rebuild()
+    reopened = VectorIndex(path=path, nlist=20, nprobe=3, ivf_min_rows=500)
+    assert partitioned.partitioned and reopened.partitioned
+
+    queries = vectors[:5]
+    expected = [[entry["id"] for entry, _ in hits] for hits in exhaustive.search(queries, k=3)]
+    assert [[entry["id"] for entry, _ in hits] for hits in partitioned.search(queries, k=3)] == expected
+    assert [[entry["id"] for entry, _ in hits] for hits in reopened.search(queries, k=3)] == expected
+    assert len(reopened) == 2000
+    assert "t1999" in reopened
+    assert reopened.search(vectors[0], k=1, exclude={"t0"})[0][0][0]["id"] != "t0"
+
+def test_connect_stage_gets_related_thoughts(test_config, monkeypatch):
+    """Test that a stage with related_thoughts sees the most similar processed thoughts."""
+    from tools.pipeline_plan import build_pipeline_plan
+    from tools.document_processor import run_stage
+    prompts = []
+    def mock_communicate_with_llm(prompt, config_name='default'):
+        prompts.append(prompt)
+        return "ok"
+
+    related = RelatedThoughts(bag_of_words, VectorIndex(), min_score=0.5)
+    related.add(make_thought("garden", "Plant tomatoes in the garden."))
+    related.add(make_thought("taxes", "File the tax return before the deadline."))
+    monkeypatch.setattr(tools.llm_handler, "related_thoughts", related)
+    monkeypatch.setattr(tools.llm_handler, "communicate_with_llm", mock_communicate_with_llm)
+    test_config["agents"]["connect"]["related_thoughts"] = 3
+    plan = build_pipeline_plan(test_config)
+
+    thought = make_thought("new", "Water the tomatoes in the garden.")
+    run_stage(thought, plan.get("clarify"))
+    run_stage(thought, plan.get("connect"))
+
+    assert "Related thoughts" not in prompts[0]
+    assert "[garden] garden.txt" in prompts[1]
+    assert "tax return" not in prompts[1]
+    assert thought["related_thoughts"][0]["id"] == "garden"
+
+    related.add(thought)
+    assert len(related.index) == 3
+    assert related.stats()["found"] == 1
+
+def test_index_folder_indexes_written_results(temp_dir):
+    """Test that results already in the output folder are indexed once."""
+    for thought_id, content in (("garden", "Plant tomatoes."), ("taxes", "File the tax return.")):
+        write_result(make_thought(thought_id, content), temp_dir)
+    related = RelatedThoughts(bag_of_words, VectorIndex())
+
+    assert related.index_folder(temp_dir) == 2
+    assert related.index_folder(temp_dir) == 0
+
+def test_index_folder_scans_results_without_an_index(temp_dir):
+    """Test that result files written before the output index existed are indexed too."""
+    from tools.output_writer import INDEX_FILENAME
+    for thought_id, content in (("garden", "Plant tomatoes."), ("taxes", "File the tax return.")):
+        write_result(make_thought(thought_id, content), temp_dir)
+    os.remove(os.path.join(temp_dir, INDEX_FILENAME))
+    related = RelatedThoughts(bag_of_words, VectorIndex())
+
+    assert related.index_folder(temp_dir) == 2
+    assert "garden" in related.index and "taxes" in related.index
+    assert related.find(make_thought("new", "Plant the tomatoes."), 1)[0][0]["id"] == "garden"
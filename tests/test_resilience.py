@@ -0,0 +1,173 @@
+# tests/test_resilience.py
+import threading
+import time
+import pytest
+import tools.llm_handler
+from adapters import LLMError, LLMTimeoutError
+from tools.resilience import CallPolicy, CircuitBreaker, CircuitOpenError
+from tools.document_processor import run_stage
+from tools.pipeline_plan import build_pipeline_plan
+from tests.mock_adapter import MockLLMAdapter
+
+class FlakyAdapter(MockLLMAdapter):
+    """Mock adapter failing its first `failures` requests."""
+
+    def __init__(self, failures=0, response="Recovered"):
+        super().__init__()
+        self.failures = failures
+        self.default_response = response
+
+    def generate(self, prompt, **kwargs):
+        self.calls.append({"prompt": prompt})
+        if len(self.calls) <= self.failures:
+            raise LLMError("backend unavailable")
+        return self.default_response
+
+class FakeRegistry:
+    def __init__(self, adapters, configs):
+        self.adapters = adapters
+        self.configs = configs
+    def resolve_name(self, name):
+        if name not in self.adapters:
+            raise KeyError(name)
+        return name
+    def get(self, name):
+        return self.adapters[name]
+    def get_config(self, name):
+        return self.configs[name]
+
+@pytest.fixture
+def use_registry(monkeypatch):
+    def install(adapters, configs):
+        monkeypatch.setattr(tools.llm_handler, "adapter_registry", FakeRegistry(adapters, configs))
+        monkeypatch.setattr(tools.llm_handler, "response_cache", None)
+        monkeypatch.setattr(tools.llm_handler, "call_policies", {})
+    return install
+
+def test_policy_retries_failed_attempts():
+    """Test that failed attempts are retried and the retry count recorded."""
+    adapter = FlakyAdapter(failures=2)
+    policy = CallPolicy("test", retries=2, backoff=0)
+
+    assert policy.call(lambda: adapter.generate("prompt")) == "Recovered"
+    assert len(adapter.calls) == 3
+    assert policy.retry_count == 2
+
+    with pytest.raises(LLMError):
+        CallPolicy("test", retries=1, backoff=0).call(lambda: FlakyAdapter(failures=5).generate("prompt"))
+
+def test_policy_times_out_and_hedges_slow_requests():
+    """Test that attempts are bounded by the timeout and slow ones are hedged."""
+    release = threading.Event()
+    with pytest.raises(LLMTimeoutError):
+        CallPolicy("test", timeout=0.1).call(lambda: release.wait(5))
+    release.set()
+
+    calls = []
+    def first_slow():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            time.sleep(1)
+            return "slow"
+        return "fast"
+
+    policy = CallPolicy("test", timeout=5, hedge=True, hedge_after_ms=50)
+    assert policy.call(first_slow) == "fast"
+    assert policy.hedge_count == 1
+
+def test_timeout_starts_when_the_attempt_runs(monkeypatch):
+    """Test that time spent queued for a pool thread does not count against the timeout."""
+    from concurrent.futures import ThreadPoolExecutor
+    import tools.resilience
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(tools.resilience, "_call_pool", pool)
+    try:
+        busy = pool.submit(time.sleep, 0.3)
+        assert CallPolicy("test", timeout=0.2).call(lambda: "answered") == "answered"
+        assert list(CallPolicy("test", timeout=0.2).stream(lambda: iter(["a", "b"]))) == ["a", "b"]
+        busy.result()
+    finally:
+        pool.shutdown()
+
+def test_streams_retry_and_time_out_waiting_for_chunks():
+    """Test that streams are retried before their first chunk and bounded by the chunk timeouts."""
+    attempts = []
+    def flaky_stream():
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise LLMError("backend unavailable")
+        yield "Hello"
+        yield ", world"
+
+    policy = CallPolicy("test", retries=1, backoff=0)
+    assert list(policy.stream(flaky_stream)) == ["Hello", ", world"]
+    assert policy.retry_count == 1
+
+    release = threading.Event()
+    def stalled_stream():
+        yield "Hello"
+        release.wait(5)
+        yield "never"
+
+    policy = CallPolicy("test", timeout=5, idle_timeout=0.1, retries=2, backoff=0)
+    chunks = []
+    with pytest.raises(LLMTimeoutError):
+        for chunk in policy.stream(stalled_stream):
+            chunks.append(chunk)
+    release.set()
+    # Text was already handed out, so the stream is not retried
+    assert chunks == ["Hello"]
+    assert policy.timeout_count == 1 and policy.retry_count == 0
+
+def test_stream_falls_back_when_no_text_arrives(use_registry):
+    """Test that a stream that never starts goes to the fallback config."""
+    class SilentAdapter(FlakyAdapter):
+        def generate_stream(self, prompt, **kwargs):
+            time.sleep(1)
+            yield "too late"
+
+    use_registry(
+        {"test_llm": SilentAdapter(), "backup": FlakyAdapter(response="From backup")},
+        {"test_llm": {"model": "primary", "first_chunk_timeout": 0.1, "fallback": "backup"},
+         "backup": {"model": "backup"}}
+    )
+
+    response, metrics = tools.llm_handler.stream_with_llm("a prompt", "test_llm")
+    assert response == "From backup"
+    assert metrics["answered_by"] == "backup"
+
+def test_circuit_breaker_opens_and_allows_trial_after_reset():
+    """Test the closed, open and half-open states of the breaker."""
+    now = [0.0]
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=10, clock=lambda: now[0])
+    policy = CallPolicy("test", breaker=breaker)
+    failing = FlakyAdapter(failures=100)
+
+    for _ in range(2):
+        with pytest.raises(LLMError):
+            policy.call(lambda: failing.generate("prompt"))
+    with pytest.raises(CircuitOpenError):
+        policy.call(lambda: failing.generate("prompt"))
+    assert len(failing.calls) == 2
+
+    now[0] = 11
+    assert policy.call(lambda: "Recovered") == "Recovered"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+def test_failed_config_falls_back_and_records_stage_error(use_registry, test_config):
+    """Test fallback to another config, and that final failures are kept out of the results."""
+    primary = FlakyAdapter(failures=100)
+    backup = FlakyAdapter(response="From backup")
+    use_registry(
+        {"test_llm": primary, "backup": backup},
+        {"test_llm": {"model": "primary", "fallback": "backup"}, "backup": {"model": "backup"}}
+    )
+
+    assert tools.llm_handler.communicate_with_llm("a prompt", "test_llm") == "From backup"
+
+    use_registry({"test_llm": primary}, {"test_llm": {"model": "primary"}})
+    thought = {"content": "This is a test thought."}
+    result = run_stage(thought, build_pipeline_plan(test_config).get("clarify"))
+
+    assert result is None
+    assert "backend unavailable" in thought["stage_errors"]["clarify"]
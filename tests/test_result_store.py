@@ -0,0 +1,69 @@
+# tests/test_result_store.py
+import os
+from tools.result_store import ResultStore
+from tools.output_writer import ResultWriter, write_result
+
+def make_thought(thought_id, content, connect="No connections"):
+    return {
+        "id": thought_id,
+        "timestamp": "2025-03-13T12:00:00",
+        "original_filename": f"{thought_id}.txt",
+        "content": content,
+        "processing_stage": "connect",
+        "processing_history": [{"stage": "input", "timestamp": "2025-03-13T12:00:00"}],
+        "capture_results": "Captured",
+        "connect_results": connect
+    }
+
+def test_store_searches_content_and_stage_results(temp_dir):
+    """Test that stored thoughts are found by content and stage results, also after replacing them."""
+    store = ResultStore(os.path.join(temp_dir, "thoughts.db"))
+    store.write_many([
+        make_thought("garden", "Plant tomatoes in the garden.", connect="Links to the allotment plan"),
+        make_thought("taxes", "File the tax return before the deadline.")
+    ])
+
+    assert [match["id"] for match in store.search("tomatoes")] == ["garden"]
+    assert store.search("allotment")[0]["field"] == "connect"
+    assert store.search("allotment", agent="capture") == []
+    assert store.search("allotment", agent="content") == []
+
+    store.write(make_thought("garden", "Water the roses.", connect="Links to the watering schedule"))
+    assert store.search("tomatoes") == []
+    assert store.search("allotment") == []
+    assert store.search("roses")[0]["snippet"] == "Water the [roses]."
+    assert store.get("garden")["connect_results"] == "Links to the watering schedule"
+    assert store.stats() == {"thoughts": 2, "stage_results": 4, "full_text": True}
+    assert len(ResultStore(store.path)) == 2
+
+def test_writers_store_results_in_database(temp_dir):
+    """Test that write_result and the background writer use the store instead of files."""
+    store = ResultStore(os.path.join(temp_dir, "thoughts.db"))
+    assert write_result(make_thought("inline", "Inline thought."), temp_dir, store=store) == store.path
+
+    written = []
+    writer = ResultWriter(temp_dir, store=store, flush_interval=0.01)
+    for number in range(5):
+        writer.submit(make_thought(f"queued_{number}", f"Queued thought {number}."), on_written=written.append)
+    writer.close()
+
+    assert written == [store.path] * 5
+    assert writer.written_count == 5
+    assert len(store) == 6
+    assert not [name for name in os.listdir(temp_dir) if name.endswith(".json")]
+
+def test_query_cli_imports_and_searches(temp_dir, capsys):
+    """Test that the CLI imports existing result files and searches them."""
+    from tools.query_cli import main
+    for thought_id, content in (("garden", "Plant tomatoes."), ("taxes", "File the tax return.")):
+        write_result(make_thought(thought_id, content), temp_dir, layout="sharded")
+    database = os.path.join(temp_dir, "thoughts.db")
+
+    assert main(["--db", database, "search", "tomatoes"]) == 1
+    assert main(["--db", database, "import", "--folder", temp_dir]) == 0
+    assert main(["--db", database, "search", "tomatoes"]) == 0
+    output = capsys.readouterr().out
+    assert "Imported 2 thoughts" in output
+    assert "garden  content" in output
+    assert "1 matches" in output
+    assert main(["--db", database, "search", '"unbalanced']) == 1
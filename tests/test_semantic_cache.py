@@ -0,0 +1,114 @@
+# tests/test_semantic_cache.py
+import os
+import pytest
+import tools.llm_handler
+from adapters import LLMError
+from tools.pipeline_plan import build_pipeline_plan
+from tools.semantic_cache import SemanticCache, SimilarityIndex
+
+VOCABULARY = ["garden", "tomatoes", "plant", "water", "tax", "return", "deadline", "file"]
+
+def bag_of_words(text):
+    """Embed a text as counts of a fixed vocabulary, so similar wordings get similar vectors."""
+    words = text.lower().replace(".", "").split()
+    return [float(sum(word.startswith(term) for word in words)) for term in VOCABULARY]
+
+def make_thought(thought_id, content):
+    return {"id": thought_id, "content": content, "processing_stage": "input", "processing_history": []}
+
+def test_similarity_index_finds_nearest_and_grows():
+    """Test that the most similar vector is found after the matrix grows."""
+    index = SimilarityIndex(capacity=2)
+    for vector in ([1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0]):
+        index.add(index.normalize(vector))
+
+    row, score = index.most_similar(index.normalize([0.9, 1.0, 0]))
+    assert len(index) == 4
+    assert row == 3
+    assert score == pytest.approx(0.998, abs=0.001)
+    assert index.most_similar(index.normalize([1, 0]))[0] is None
+
+def test_similar_thought_reuses_results_and_persists(test_config, temp_dir):
+    """Test that a rephrased thought reuses stored results, also after a restart."""
+    path = os.path.join(temp_dir, "cache", "semantic.jsonl")
+    plan = build_pipeline_plan(test_config)
+    cache = SemanticCache(bag_of_words, path=path, threshold=0.9, rerun_stages=["capture"])
+
+    first = make_thought("first", "Plant tomatoes in the garden and water them.")
+    vector, reused = cache.reuse(first, plan)
+    assert reused == {}
+    for stage in plan.stages:
+        first[stage.result_key] = f"{stage.agent_id} result"
+    cache.add(first, vector, plan)
+
+    reopened = SemanticCache(bag_of_words, path=path, threshold=0.9, rerun_stages=["capture"])
+    second = make_thought("second", "Water the tomatoes and plant them in the garden.")
+    _, reused = reopened.reuse(second, plan)
+
+    assert "capture" not in reused
+    assert reused["connect"] == "connect result"
+    assert second["semantic_match"]["id"] == "first"
+    assert reopened.stats() == {"entries": 1, "hits": 1, "misses": 0, "saved_calls": 5}
+
+    unrelated = make_thought("third", "File the tax return before the deadline.")
+    assert reopened.reuse(unrelated, plan)[1] == {}
+
+def test_process_thought_skips_llm_calls_for_near_duplicates(test_config, temp_dir, monkeypatch):
+    """Test that the pipeline only runs the rerun stages for a near-duplicate."""
+    from main import process_thought
+    calls = []
+    def mock_communicate_with_llm(prompt, config_name='default'):
+        calls.append(prompt)
+        return "ok"
+
+    monkeypatch.setattr(tools.llm_handler, "communicate_with_llm", mock_communicate_with_llm)
+    monkeypatch.setattr(tools.llm_handler, "semantic_cache",
+                        SemanticCache(bag_of_words, threshold=0.9, rerun_stages=["capture"]))
+    test_config["folders"]["base"] = temp_dir
+    plan = build_pipeline_plan(test_config)
+
+    process_thought(make_thought("first", "Plant tomatoes in the garden."), test_config, plan)
+    assert len(calls) == 6
+
+    duplicate = process_thought(make_thought("second", "In the garden, plant tomatoes."), test_config, plan)
+    assert len(calls) == 7
+    assert "In the garden, plant tomatoes." in calls[-1]
+    assert duplicate["connect_results"] == "ok"
+    assert duplicate["processing_stage"] == "connect"
+    assert tools.llm_handler.semantic_cache.saved_calls == 5
+
+def test_embedding_failure_processes_thought_normally(test_config):
+    """Test that a thought is processed without the cache when it cannot be embedded."""
+    def failing_embed(text):
+        raise LLMError("no embedding model")
+
+    cache = SemanticCache(failing_embed)
+    thought = make_thought("first", "Plant tomatoes.")
+    assert cache.reuse(thought, build_pipeline_plan(test_config)) == (None, {})
+    cache.add(thought, None, build_pipeline_plan(test_config))
+    assert cache.stats()["entries"] == 0
+
+def test_related_thoughts_reuse_the_semantic_cache_vector(monkeypatch):
+    """Test that a thought is embedded once when both features use the same embeddings."""
+    from tools.related_thoughts import RelatedThoughts
+    from tools.vector_index import VectorIndex
+    embedded = []
+    def embed(text):
+        embedded.append(text)
+        return bag_of_words(text)
+
+    cache = SemanticCache(embed)
+    related = RelatedThoughts(lambda texts: [embed(text) for text in texts], VectorIndex())
+    monkeypatch.setattr(tools.llm_handler, "semantic_cache", cache)
+    monkeypatch.setattr(tools.llm_handler, "related_thoughts", related)
+    monkeypatch.setattr(tools.llm_handler, "_embedding_settings", {
+        "semantic_cache": ("embeddings", 8000), "related_thoughts": ("embeddings", 8000)
+    })
+
+    thought = make_thought("new", "Water the tomatoes in the garden.")
+    tools.llm_handler.share_embedding(thought, cache.embed_content(thought["content"]))
+    related.find(thought, 3)
+    related.add(thought)
+
+    assert embedded == [thought["content"]]
+    assert "new" in related.index
@@ -171,4 +171,83 @@ def test_complete_pipeline():
     assert "clarify_results" in current_thought
     assert "categorize_results" in current_thought
     assert "crystallize_results" in current_thought
-    assert "connect_results" in current_thought
\ No newline at end of file
+    assert "connect_results" in current_thought
+
+
+def test_async_stage(monkeypatch):
+    """Test the async processing path for a single stage."""
+    import asyncio
+    from tools.document_processor import aprocess_with_agent
+    
+    async def mock_acommunicate_with_llm(prompt, config_name='default'):
+        return mock_communicate_with_llm(prompt, config_name)
+    
+    monkeypatch.setattr(tools.llm_handler, "acommunicate_with_llm", mock_acommunicate_with_llm)
+    
+    thought = {
+        "id": "test_thought_1",
+        "content": "This is a test thought.",
+        "processing_stage": "capture",
+        "processing_history": []
+    }
+    agent = create_mock_agent("Thought Clarifier", "Expand thoughts", "You make thoughts coherent")
+    
+    result = asyncio.run(aprocess_with_agent(thought, agent, "Clarify", "clarify", MOCK_PROMPT_TEMPLATES))
+    
+    assert result["processing_stage"] == "clarify"
+    assert result["clarify_results"] == "Your thought has been clarified."
+
+
+def test_process_with_agent_reuses_thought_session(test_config, test_thought, monkeypatch):
+    """Test that agents sharing an LLM config send the thought content only once."""
+    import tools.llm_handler
+    from adapters import LLMSession
+    from tools.document_processor import process_with_agent
+    from tools.sessions import ThoughtSessions, SESSION_CONTENT
+
+    class Session(LLMSession):
+        def __init__(self):
+            self.prompts = []
+        def generate(self, prompt, system_prompt=None):
+            self.prompts.append(prompt)
+            return f"Session response {len(self.prompts)}"
+        def stats(self):
+            return {"requests": len(self.prompts), "saved_tokens": 100 * (len(self.prompts) - 1)}
+
+    class Adapter:
+        def __init__(self):
+            self.opened = []
+            self.session = Session()
+        def open_session(self, content):
+            self.opened.append(content)
+            return self.session
+
+    class Registry:
+        adapter = Adapter()
+        def resolve_name(self, name):
+            return name
+        def get(self, name):
+            return self.adapter
+        def get_config(self, name):
+            return {"model": "test-model"}
+
+    registry = Registry()
+    monkeypatch.setattr(tools.llm_handler, "adapter_registry", registry)
+    monkeypatch.setattr(tools.llm_handler, "call_policies", {})
+
+    templates = {agent_id: test_config["prompts"][f"{agent_id}_prompt_template"]
+                 for agent_id in ("clarify", "categorize")}
+    agent = type("Agent", (), {"llm_config": "test_llm"})()
+    sessions = ThoughtSessions(test_thought["content"], ["test_llm", "test_llm"])
+
+    process_with_agent(test_thought, agent, "Clarify", "clarify", templates, sessions)
+    process_with_agent(test_thought, agent, "Categorize", "categorize", templates, sessions)
+
+    assert registry.adapter.opened == [test_thought["content"]]
+    assert registry.adapter.session.prompts == [
+        f"You are acting as the Clarify agent. Thought: {SESSION_CONTENT}",
+        f"You are acting as the Categorize agent. Thought: {SESSION_CONTENT}"
+    ]
+    assert test_thought["categorize_results"] == "Session response 2"
+    assert sessions.record(test_thought) == 100
+    assert test_thought["session_metrics"]["test_llm"]["requests"] == 2
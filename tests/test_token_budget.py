@@ -0,0 +1,83 @@
+# tests/test_token_budget.py
+import pytest
+import tools.llm_handler
+from tools.pipeline_plan import CompiledTemplate, build_pipeline_plan
+from tools.document_processor import run_stage
+from tools.token_budget import TokenBudget, PromptTooLargeError, TRUNCATION_NOTICE, get_tokenizer
+
+CONFIGS = {
+    "small": {"model": "small-model", "context_window": 1000, "max_tokens": 200},
+    "medium": {"model": "medium-model", "context_window": 4000, "max_tokens": 1000},
+    "large": {"model": "large-model", "context_window": 32000, "max_tokens": 1000},
+    "unbounded": {"model": "other-model"}
+}
+
+def make_budget(strategy, configs=CONFIGS):
+    return TokenBudget(configs.__getitem__, lambda: list(configs), strategy=strategy, tokenizer="estimate")
+
+TEMPLATE = CompiledTemplate("Summarize this thought: {thought_content}")
+
+def test_prompts_within_budget_are_unchanged():
+    """Test that prompts that fit are sent as they are, to their own config."""
+    budget = make_budget("reject")
+
+    assert budget.budget_for("small") == 800
+    assert budget.budget_for("unbounded") is None
+    assert budget.fit(TEMPLATE, "A short thought.", "small") == ("Summarize this thought: A short thought.", "small")
+    assert budget.fit(TEMPLATE, "x" * 100000, "unbounded")[1] == "unbounded"
+
+def test_truncate_and_reject_strategies():
+    """Test that oversized content is cut to the budget, or rejected without a call."""
+    content = "word " * 2000
+    prompt, config_name = make_budget("truncate").fit(TEMPLATE, content, "small")
+
+    assert config_name == "small"
+    assert prompt.endswith(TRUNCATION_NOTICE)
+    assert get_tokenizer("small-model", "estimate").count(prompt) <= 800
+
+    with pytest.raises(PromptTooLargeError):
+        make_budget("reject").fit(TEMPLATE, content, "small")
+
+def test_route_picks_smallest_config_that_fits():
+    """Test that oversized prompts go to the smallest larger config, and are truncated if none fits."""
+    budget = make_budget("route")
+
+    assert budget.fit(TEMPLATE, "word " * 2000, "small")[1] == "medium"
+    assert budget.fit(TEMPLATE, "word " * 20000, "small")[1] == "large"
+
+    prompt, config_name = budget.fit(TEMPLATE, "word " * 200000, "small")
+    assert config_name == "small" and prompt.endswith(TRUNCATION_NOTICE)
+    assert budget.routed_count == 2 and budget.truncated_count == 1
+
+def test_route_stays_within_the_adapter_unless_targets_are_listed():
+    """Test that prompts are not routed to another adapter, e.g. a cloud API, by default."""
+    configs = {
+        "local": {"adapter": "ollama", "model": "local-model", "context_window": 1000, "max_tokens": 200},
+        "local_large": {"adapter": "ollama", "model": "local-model", "context_window": 8000, "max_tokens": 200},
+        "cloud": {"adapter": "litellm", "model": "gpt-4", "context_window": 128000, "max_tokens": 1000}
+    }
+    budget = make_budget("route", configs)
+
+    assert budget.fit(TEMPLATE, "word " * 2000, "local")[1] == "local_large"
+    assert budget.fit(TEMPLATE, "word " * 20000, "local")[1] == "local"
+
+    configs["local"]["overflow_configs"] = ["cloud"]
+    assert budget.fit(TEMPLATE, "word " * 20000, "local")[1] == "cloud"
+
+def test_rejected_stage_skips_the_llm_call(test_config, monkeypatch):
+    """Test that a stage over budget records an error instead of calling the LLM."""
+    calls = []
+    monkeypatch.setattr(tools.llm_handler, "communicate_with_llm", lambda *args: calls.append(args))
+    monkeypatch.setattr(tools.llm_handler, "adapter_registry", type("Registry", (), {
+        "resolve_name": lambda self, name: name
+    })())
+    monkeypatch.setattr(tools.llm_handler, "token_budget", make_budget("reject", {
+        "test_llm": {"model": "test-model", "context_window": 100, "max_tokens": 50}
+    }))
+
+    thought = {"content": "word " * 1000}
+    result = run_stage(thought, build_pipeline_plan(test_config).get("clarify"))
+
+    assert result is None
+    assert calls == []
+    assert "token budget" in thought["stage_errors"]["clarify"]
@@ -9,16 +9,24 @@ import litellm  # Changed from langchain_community.llms import Ollama
 
 # Re-export all tools
 from .file_watcher import CaptureHandler, process_existing_files, watch_folder, read_file
-from .llm_handler import communicate_with_llm
-from .document_processor import process_with_agent, pass_to_next_agent
+from .llm_handler import communicate_with_llm, acommunicate_with_llm, communicate_with_llm_batch
+from .document_processor import process_with_agent, aprocess_with_agent, pass_to_next_agent
 from .output_writer import write_result
+from .pipeline_executor import PipelineExecutor, AsyncPipelineExecutor, BatchPipelineExecutor, AffinityPipelineExecutor
 
 __all__ = [
     'process_existing_files',
     'watch_folder',
     'read_file',
     'communicate_with_llm',
+    'acommunicate_with_llm',
+    'communicate_with_llm_batch',
     'process_with_agent',
+    'aprocess_with_agent',
     'pass_to_next_agent',
-    'write_result'
+    'write_result',
+    'PipelineExecutor',
+    'AsyncPipelineExecutor',
+    'BatchPipelineExecutor',
+    'AffinityPipelineExecutor'
 ]
@@ -0,0 +1,166 @@
+import time
+import logging
+
+from .document_processor import record_stage_result, record_stage_error
+from .batch_runner import generate_stage_batch
+
+logger = logging.getLogger(__name__)
+
+class _ThoughtProgress:
+    """Stage progress of one thought inside the affinity scheduler."""
+
+    def __init__(self, thought_object, order, dependencies, now):
+        self.thought = thought_object
+        self.pending = {agent_id: set(dependencies.get(agent_id, [])) & set(order) for agent_id in order}
+        self.results = {}
+        self.ready_since = {}
+        self.mark_ready(order, now)
+
+    def mark_ready(self, order, now):
+        """Note when stages become ready, so their waiting time can be bounded."""
+        for agent_id in order:
+            if agent_id in self.pending and agent_id not in self.ready_since \
+                    and not (self.pending[agent_id] - self.results.keys()):
+                self.ready_since[agent_id] = now
+
+class AffinityScheduler:
+    """
+    Runs the stages of many thoughts, grouping work by model.
+
+    When stages use different models on one Ollama server, running every
+    thought through its stages in order makes the server swap models all
+    the time. This scheduler keeps many thoughts in progress and runs all
+    ready stage work for the resident model before switching to another,
+    while each thought's stages still run in dependency order. Work that
+    has been ready for `max_wait` seconds is run next regardless of model,
+    so no stage waits indefinitely.
+    """
+
+    def __init__(self, plan, generate_batch, model_for=None, max_wait=30.0, batch_size=32, clock=time.monotonic):
+        """
+        Args:
+            plan (PipelinePlan): The compiled pipeline plan
+            generate_batch (function): Called as generate_batch(prompts, llm_config),
+                returns the responses in prompt order
+            model_for (function): Maps an llm_config name to the model it loads;
+                configs mapping to the same model are grouped together
+            max_wait (float): Seconds ready work may wait for its model
+            batch_size (int): Maximum number of stage runs sent in one step
+            clock (function): Time source, replaceable in tests
+        """
+        self.plan = plan
+        self.generate_batch = generate_batch
+        self.model_for = model_for or (lambda llm_config: llm_config)
+        self.max_wait = max_wait
+        self.batch_size = max(1, int(batch_size))
+        self.clock = clock
+
+        self.order = [agent_id for agent_id, _ in plan.stage_order]
+        self.resident_model = None
+        self.model_switches = 0
+        self._thoughts = []
+
+    def __len__(self):
+        """Number of thoughts in progress."""
+        return len(self._thoughts)
+
+    def add(self, thought_object):
+        """Start scheduling the stages of a thought."""
+        self._thoughts.append(_ThoughtProgress(thought_object, self.order, self.plan.dependencies, self.clock()))
+
+    def clear(self):
+        """
+        Stop scheduling every thought in progress.
+
+        Returns:
+            list: The thought objects that were in progress
+        """
+        thoughts = [progress.thought for progress in self._thoughts]
+        self._thoughts = []
+        return thoughts
+
+    def step(self):
+        """
+        Run one batch of ready stage work for a single model.
+
+        Returns:
+            tuple: (completed, failed) where completed lists the thought objects
+                that finished every stage, with their results merged, and
+                failed lists (thought_object, error) tuples
+        """
+        work = self._ready_work()
+        if not work:
+            return [], []
+
+        model = self._choose_model(work)
+        if model != self.resident_model:
+            if self.resident_model is not None:
+                self.model_switches += 1
+            logger.info(f"Switching to model {model} ({len(work[model])} stage runs ready)")
+            self.resident_model = model
+
+        selected = work[model][:self.batch_size]
+        failed = {}
+        self._run_items([(progress, agent_id) for _, progress, agent_id in selected], failed)
+
+        return self._collect(failed)
+
+    def _ready_work(self):
+        """Group ready stage runs by model, oldest first."""
+        work = {}
+        for progress in self._thoughts:
+            for agent_id, ready_since in progress.ready_since.items():
+                if agent_id in progress.pending:
+                    model = self.model_for(self.plan.get(agent_id).llm_config)
+                    work.setdefault(model, []).append((ready_since, progress, agent_id))
+
+        for items in work.values():
+            items.sort(key=lambda item: item[0])
+        return work
+
+    def _choose_model(self, work):
+        """Pick the model to run next."""
+        oldest_model = min(work, key=lambda model: work[model][0][0])
+        if self.clock() - work[oldest_model][0][0] >= self.max_wait:
+            return oldest_model
+        if self.resident_model in work:
+            return self.resident_model
+        # Switch to the model with the most waiting work, oldest first on ties
+        return max(work, key=lambda model: (len(work[model]), -work[model][0][0]))
+
+    def _run_items(self, items, failed):
+        """Run the selected stage work, one batch call per LLM config."""
+        try:
+            results = generate_stage_batch(
+                [(self.plan.get(agent_id), progress.thought) for progress, agent_id in items],
+                self.generate_batch
+            )
+        except Exception as e:
+            for progress, _ in items:
+                failed[id(progress)] = (progress, e)
+            return
+
+        now = self.clock()
+        for (progress, agent_id), result in zip(items, results):
+            if isinstance(result, Exception):
+                result = record_stage_error(progress.thought, agent_id, result)
+            del progress.pending[agent_id]
+            progress.results[agent_id] = result
+            progress.mark_ready(self.order, now)
+
+    def _collect(self, failed):
+        """Remove finished and failed thoughts, merging the finished ones."""
+        completed = []
+        remaining = []
+        for progress in self._thoughts:
+            if id(progress) in failed:
+                continue
+            if progress.pending:
+                remaining.append(progress)
+                continue
+            for agent_id, agent_name in self.plan.stage_order:
+                record_stage_result(progress.thought, agent_name, progress.results[agent_id])
+            completed.append(progress.thought)
+
+        self._thoughts = remaining
+        return completed, [(progress.thought, error) for progress, error in failed.values()]
@@ -0,0 +1,117 @@
+import logging
+
+from adapters import LLMError
+from .document_processor import record_stage_result, record_stage_error
+from .stage_scheduler import _pop_ready_stages
+
+logger = logging.getLogger(__name__)
+
+def stage_waves(stages, dependencies):
+    """
+    Group stages into waves that can run once the previous waves are done.
+
+    Args:
+        stages (list): Ordered (agent_id, agent_name) tuples
+        dependencies (dict): Mapping from build_stage_graph
+
+    Returns:
+        list: Lists of agent_ids, in the order the waves run
+    """
+    order = [agent_id for agent_id, _ in stages]
+    pending = {agent_id: set(dependencies.get(agent_id, [])) & set(order) for agent_id in order}
+    completed = {}
+    waves = []
+
+    while pending:
+        wave = _pop_ready_stages(order, pending, completed)
+        if not wave:
+            raise ValueError(f"Stages can never run: {sorted(pending)}")
+        waves.append(wave)
+        completed.update((agent_id, None) for agent_id in wave)
+
+    return waves
+
+def generate_stage_batch(items, generate_batch):
+    """
+    Run stage work for several thoughts with one batch call per LLM config.
+
+    Prompts are fitted to the token budget first, which may send some of
+    them to a different config than their stage's. Stages with a system
+    prompt get their own batch, as the system prompt applies to all of it.
+
+    Args:
+        items (list): (PlannedStage, thought_object) tuples
+        generate_batch (function): Called as generate_batch(prompts, llm_config),
+            plus a `system_prompt` keyword for stages that have one; returns
+            the responses in prompt order, with an exception in place of
+            each response that failed
+
+    Returns:
+        list: The results in item order, with an exception for each failed item
+    """
+    from .llm_handler import fit_prompt
+
+    results = [None] * len(items)
+    groups = {}
+    for index, (stage, thought) in enumerate(items):
+        if stage.template is None:
+            results[index] = f"Processed by {stage.agent_name} (no LLM interaction)"
+            continue
+        try:
+            prompt, llm_config = fit_prompt(stage.template, thought["content"], stage.llm_config,
+                                            **stage.llm_kwargs())
+        except LLMError as e:
+            results[index] = e
+            continue
+        groups.setdefault((llm_config, stage.system_prompt), []).append((index, prompt))
+
+    for (llm_config, system_prompt), entries in groups.items():
+        kwargs = {"system_prompt": system_prompt} if system_prompt else {}
+        responses = generate_batch([prompt for _, prompt in entries], llm_config, **kwargs)
+        if len(responses) != len(entries):
+            raise ValueError(f"Batch for LLM config {llm_config} returned {len(responses)} "
+                             f"responses for {len(entries)} prompts")
+        for (index, _), response in zip(entries, responses):
+            results[index] = response
+
+    return results
+
+def run_stage_batches(thought_objects, plan, generate_batch):
+    """
+    Run several thoughts through the pipeline together.
+
+    Instead of each thought walking through every stage on its own, each
+    stage is run for all thoughts at once, so its prompts reach the LLM in
+    a single batch call. Results are merged in pipeline order, as in
+    run_stage_graph.
+
+    Args:
+        thought_objects (list): The thought objects to process
+        plan (PipelinePlan): The compiled pipeline plan
+        generate_batch (function): Called as generate_batch(prompts, llm_config),
+            returns the responses in prompt order, with an exception in
+            place of each response that failed
+
+    Returns:
+        list: The processed thought objects
+    """
+    if not thought_objects:
+        return thought_objects
+
+    results = {}
+    for wave in stage_waves(plan.stage_order, plan.dependencies):
+        for agent_id in wave:
+            stage = plan.get(agent_id)
+            print(f"Processing {len(thought_objects)} thoughts with {stage.agent_name} agent...")
+            results[agent_id] = generate_stage_batch(
+                [(stage, thought) for thought in thought_objects], generate_batch
+            )
+
+    for index, thought in enumerate(thought_objects):
+        for agent_id, agent_name in plan.stage_order:
+            result = results[agent_id][index]
+            if isinstance(result, Exception):
+                result = record_stage_error(thought, agent_id, result)
+            record_stage_result(thought, agent_name, result)
+
+    return thought_objects
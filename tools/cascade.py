@@ -0,0 +1,166 @@
+import logging
+import threading
+
+from adapters import LLMError
+from .token_budget import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+class CascadePolicy:
+    """
+    Tries cheaper LLM configs before an agent's own config.
+
+    Each config in `configs` is tried in order and its response is kept
+    when it passes the checks: at least `min_length` characters, every
+    string in `required_sections` present and none of `error_markers`
+    present (both case-insensitive). Otherwise, or when the call fails,
+    the next config is tried, ending with the agent's `llm_config`,
+    whose response is always kept.
+    """
+
+    def __init__(self, configs, min_length=0, required_sections=None, error_markers=None,
+                 max_content_tokens=None):
+        """
+        Args:
+            configs (list): Cheaper LLM config names, tried in order
+            min_length (int): Minimum response length in characters
+            required_sections (list): Strings a response must contain
+            error_markers (list): Strings a response must not contain
+            max_content_tokens (int): Content over this many tokens goes
+                straight to the agent's own config, or None for no limit
+        """
+        self.configs = list(configs)
+        self.min_length = min_length
+        self.required_sections = list(required_sections or [])
+        self.error_markers = list(error_markers or [])
+        self.max_content_tokens = max_content_tokens
+
+        self.accepted = {}
+        self.escalations = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, settings):
+        """
+        Build the policy from an agent's `cascade` settings.
+
+        Accepts a list of config names, or a dict with configs, min_length,
+        required_sections, error_markers and max_content_tokens.
+
+        Returns:
+            CascadePolicy: The policy, or None if no cheaper configs are set
+        """
+        if not settings:
+            return None
+        if isinstance(settings, (list, tuple, str)):
+            settings = {"configs": settings}
+        configs = settings.get("configs") or []
+        if isinstance(configs, str):
+            configs = [configs]
+        if not configs:
+            return None
+        return cls(
+            configs,
+            min_length=settings.get("min_length", 0),
+            required_sections=settings.get("required_sections"),
+            error_markers=settings.get("error_markers"),
+            max_content_tokens=settings.get("max_content_tokens")
+        )
+
+    def check(self, response):
+        """
+        Check a response from a cheaper config.
+
+        Returns:
+            list: Reasons to escalate, empty if the response is kept
+        """
+        reasons = []
+        if len(response.strip()) < self.min_length:
+            reasons.append(f"shorter than {self.min_length} characters")
+        lowered = response.lower()
+        for section in self.required_sections:
+            if section.lower() not in lowered:
+                reasons.append(f"missing '{section}'")
+        for marker in self.error_markers:
+            if marker.lower() in lowered:
+                reasons.append(f"contains '{marker}'")
+        return reasons
+
+    def candidates(self, content, final_config):
+        """The configs to try for some content, ending with the final one."""
+        if self.max_content_tokens is not None:
+            if get_tokenizer(None).count(content) > self.max_content_tokens:
+                return [final_config]
+        return [name for name in self.configs if name != final_config] + [final_config]
+
+    def _record(self, agent_id, config_name, attempts):
+        with self._lock:
+            self.accepted[config_name] = self.accepted.get(config_name, 0) + 1
+            self.escalations += len(attempts)
+        if attempts:
+            logger.info(f"Cascade for {agent_id}: escalated past {[a['config'] for a in attempts]}, "
+                        f"answered by '{config_name}'")
+        else:
+            logger.info(f"Cascade for {agent_id}: answered by '{config_name}'")
+
+    def run(self, agent_id, content, final_config, call):
+        """
+        Run the cascade for one stage.
+
+        Args:
+            agent_id (str): The agent, for logging
+            content (str): The thought content
+            final_config (str): The agent's own LLM config
+            call (function): Called as call(config_name), returns the response
+
+        Returns:
+            tuple: (response, decision) where decision holds the config that
+                answered and the escalated attempts with their reasons
+
+        Raises:
+            LLMError: If the final config failed
+        """
+        attempts = []
+        candidates = self.candidates(content, final_config)
+        for config_name in candidates[:-1]:
+            try:
+                response = call(config_name)
+            except LLMError as e:
+                reasons = [f"failed: {e}"]
+            else:
+                reasons = self.check(response)
+                if not reasons:
+                    self._record(agent_id, config_name, attempts)
+                    return response, {"answered_by": config_name, "escalations": attempts}
+            logger.info(f"Cascade for {agent_id}: escalating from '{config_name}' ({', '.join(reasons)})")
+            attempts.append({"config": config_name, "reasons": reasons})
+
+        response = call(final_config)
+        self._record(agent_id, final_config, attempts)
+        return response, {"answered_by": final_config, "escalations": attempts}
+
+    async def arun(self, agent_id, content, final_config, acall):
+        """Async version of run; `acall` is a coroutine function."""
+        attempts = []
+        candidates = self.candidates(content, final_config)
+        for config_name in candidates[:-1]:
+            try:
+                response = await acall(config_name)
+            except LLMError as e:
+                reasons = [f"failed: {e}"]
+            else:
+                reasons = self.check(response)
+                if not reasons:
+                    self._record(agent_id, config_name, attempts)
+                    return response, {"answered_by": config_name, "escalations": attempts}
+            logger.info(f"Cascade for {agent_id}: escalating from '{config_name}' ({', '.join(reasons)})")
+            attempts.append({"config": config_name, "reasons": reasons})
+
+        response = await acall(final_config)
+        self._record(agent_id, final_config, attempts)
+        return response, {"answered_by": final_config, "escalations": attempts}
+
+    def stats(self):
+        """Responses kept per config and the number of escalations."""
+        with self._lock:
+            return {"accepted": dict(self.accepted), "escalations": self.escalations}
@@ -0,0 +1,338 @@
+import re
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from .pipeline_plan import CompiledTemplate
+from .token_budget import get_tokenizer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REDUCE_TEMPLATE = (
+    "You are acting as the {agent_name} agent. A long document was split into "
+    "{chunk_count} parts and each part was processed with these instructions:\n"
+    "---\n{agent_instructions}\n---\n"
+    "Combine the following partial results, given in document order, into one "
+    "result that follows the instructions as if the whole document had been "
+    "processed at once. Merge repeated points.\n\n{partial_results}"
+)
+
+# Stands in for the thought content when the stage template is shown to the reduce prompt
+INSTRUCTIONS_CONTENT = "[the document]"
+
+HEADING = re.compile(r"^#{1,6}\s")
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n\s*")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+def split_blocks(content):
+    """
+    Split content into paragraphs, keeping each markdown heading with the
+    paragraph that follows it.
+
+    Returns:
+        list: The blocks, without their separating blank lines
+    """
+    blocks = []
+    for paragraph in PARAGRAPH_BREAK.split(content.strip()):
+        # A heading without a blank line before it still starts a new block
+        lines = []
+        for line in paragraph.split("\n"):
+            if HEADING.match(line) and lines:
+                blocks.append("\n".join(lines))
+                lines = []
+            lines.append(line)
+        blocks.append("\n".join(lines))
+
+    merged = []
+    for block in blocks:
+        if merged and all(HEADING.match(line) for line in merged[-1].split("\n")):
+            merged[-1] = f"{merged[-1]}\n\n{block}"
+        else:
+            merged.append(block)
+    return merged
+
+def split_oversized(block, max_tokens, tokenizer):
+    """Split one block that is over max_tokens by lines, then sentences, then tokens."""
+    for separator, pieces in (("\n", block.split("\n")), (" ", SENTENCE_END.split(block))):
+        if len(pieces) > 1:
+            return pack(pieces, max_tokens, tokenizer, separator)
+
+    parts = []
+    rest = block
+    while rest:
+        part = tokenizer.truncate(rest, max_tokens)
+        if not part:
+            break
+        parts.append(part)
+        rest = rest[len(part):]
+    return parts
+
+def pack(pieces, max_tokens, tokenizer, separator="\n\n"):
+    """
+    Pack pieces into chunks of at most max_tokens, keeping their order.
+
+    Pieces that are too large on their own are split further.
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    separator_tokens = tokenizer.count(separator)
+
+    for piece in pieces:
+        tokens = tokenizer.count(piece)
+        if tokens > max_tokens:
+            if current:
+                chunks.append(separator.join(current))
+                current, current_tokens = [], 0
+            chunks.extend(split_oversized(piece, max_tokens, tokenizer))
+            continue
+        if current and current_tokens + separator_tokens + tokens > max_tokens:
+            chunks.append(separator.join(current))
+            current, current_tokens = [], 0
+        current_tokens += tokens + (separator_tokens if current else 0)
+        current.append(piece)
+
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+def split_content(content, max_tokens, tokenizer):
+    """
+    Split content into chunks of at most max_tokens, breaking at headings
+    and paragraphs where possible.
+
+    Args:
+        content (str): The thought content
+        max_tokens (int): Maximum tokens per chunk
+        tokenizer (Tokenizer): Counts the tokens of a text
+
+    Returns:
+        list: The chunks, in document order
+    """
+    return pack(split_blocks(content), max_tokens, tokenizer)
+
+class DocumentChunker:
+    """
+    Runs stages over large documents with map-reduce.
+
+    Content over `threshold_tokens` is split into chunks of at most
+    `chunk_tokens`. Each stage then runs its own prompt over every chunk
+    in parallel (map), and the partial results are combined with the
+    reduce prompt until one result is left.
+
+    With a token budget, a stage splits the chunks further when they don't
+    fit its prompt next to the template and system prompt, and each reduce
+    prompt combines as many partial results as fit its budget, at most
+    `reduce_fan_in`.
+    """
+
+    def __init__(self, chunk_tokens=2000, threshold_tokens=None, max_parallel=4,
+                 reduce_fan_in=8, reduce_template=None, tokenizer="auto"):
+        """
+        Args:
+            chunk_tokens (int): Maximum tokens per chunk, or None to size
+                chunks by each stage's budget alone
+            threshold_tokens (int): Content over this many tokens is chunked;
+                defaults to chunk_tokens
+            max_parallel (int): Chunk prompts of one stage sent at the same time
+            reduce_fan_in (int): Maximum partial results combined by one reduce prompt
+            reduce_template (str): Reduce prompt with {agent_name}, {chunk_count},
+                {agent_instructions} and {partial_results} placeholders
+            tokenizer (str): "auto" or "estimate", see get_tokenizer
+        """
+        if not chunk_tokens and not threshold_tokens:
+            raise ValueError("Chunking needs chunk_tokens or threshold_tokens")
+        self.chunk_tokens = chunk_tokens
+        self.threshold_tokens = threshold_tokens or chunk_tokens
+        self.max_parallel = max(1, int(max_parallel))
+        self.reduce_fan_in = max(2, int(reduce_fan_in))
+        self.reduce_template = reduce_template or DEFAULT_REDUCE_TEMPLATE
+        self.tokenizer = get_tokenizer(None, tokenizer)
+
+    def split(self, content):
+        """
+        Split content that is over the threshold.
+
+        Returns:
+            list: The chunks, or None if the content is small enough to
+                send whole
+        """
+        if self.tokenizer.count(content) <= self.threshold_tokens:
+            return None
+        chunks = split_content(content, self.chunk_tokens or self.threshold_tokens, self.tokenizer)
+        return chunks if len(chunks) > 1 else None
+
+    def fit_chunks(self, chunks, max_tokens):
+        """
+        Split chunks further so that none is over max_tokens.
+
+        Returns:
+            list: The chunks, unchanged if they all fit
+        """
+        if max_tokens is None or max_tokens <= 0:
+            return chunks
+        if self.chunk_tokens:
+            max_tokens = min(max_tokens, self.chunk_tokens)
+        if all(self.tokenizer.count(chunk) <= max_tokens for chunk in chunks):
+            return chunks
+        return split_content("\n\n".join(chunks), max_tokens, self.tokenizer)
+
+    def reduce_prompt(self, stage, chunk_count):
+        """Compile the reduce prompt of a stage, with the partial results as its content."""
+        text = (self.reduce_template
+                .replace("{agent_name}", stage.agent_name)
+                .replace("{chunk_count}", str(chunk_count))
+                .replace("{agent_instructions}", self.instructions(stage))
+                .replace("{partial_results}", "{thought_content}"))
+        return CompiledTemplate(text)
+
+    def instructions(self, stage):
+        """
+        The stage's instructions as shown to the reduce prompt. Reduce calls
+        are sent without the stage's system prompt, so it is included here.
+        """
+        if stage.system_prompt:
+            return f"{stage.system_prompt}\n\n{stage.template.render(INSTRUCTIONS_CONTENT)}"
+        return stage.template.render(INSTRUCTIONS_CONTENT)
+
+    def format_partials(self, partials, first_part):
+        return "\n\n".join(
+            f"Part {first_part + index}:\n{partial}" for index, partial in enumerate(partials)
+        )
+
+    def run_stage(self, stage, chunks, generate, fit, budget=None):
+        """
+        Run a stage over the chunks of one document.
+
+        Args:
+            stage (PlannedStage): The stage to run
+            chunks (list): The document's chunks
+            generate (function): Called as generate(prompt, llm_config), returns
+                the response or raises LLMError
+            fit (function): Called as fit(template, content, llm_config), returns
+                (prompt, llm_config)
+            budget (function): Called as budget(template, llm_config), returns
+                the tokens left for the content of a prompt, or None if
+                prompts are not budgeted
+
+        Chunk prompts are sent with the stage's system prompt, passed to
+        fit, generate and budget as a `system_prompt` keyword when the stage
+        has one.
+
+        Returns:
+            tuple: (result, metrics)
+
+        Raises:
+            LLMError: If a map or reduce call failed
+        """
+        start = time.perf_counter()
+
+        def call(template, content, kwargs=None):
+            prompt, llm_config = fit(template, content, stage.llm_config, **(kwargs or {}))
+            return generate(prompt, llm_config, **(kwargs or {}))
+
+        chunks, template, reduce_tokens = self._plan(stage, chunks, budget)
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel, len(chunks))) as pool:
+            partials = list(pool.map(lambda chunk: call(stage.template, chunk, stage.llm_kwargs()), chunks))
+            map_seconds = time.perf_counter() - start
+
+            reduce_calls = 0
+            while len(partials) > 1:
+                groups = self._groups(partials, reduce_tokens)
+                partials = list(pool.map(lambda group: call(template, group), groups))
+                reduce_calls += len(groups)
+
+        return partials[0], self._metrics(chunks, reduce_calls, start, map_seconds)
+
+    async def arun_stage(self, stage, chunks, agenerate, fit, budget=None):
+        """Async version of run_stage; `agenerate` is a coroutine function."""
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.max_parallel)
+
+        async def call(template, content, kwargs=None):
+            prompt, llm_config = fit(template, content, stage.llm_config, **(kwargs or {}))
+            async with semaphore:
+                return await agenerate(prompt, llm_config, **(kwargs or {}))
+
+        chunks, template, reduce_tokens = self._plan(stage, chunks, budget)
+        partials = await asyncio.gather(*(call(stage.template, chunk, stage.llm_kwargs()) for chunk in chunks))
+        map_seconds = time.perf_counter() - start
+
+        reduce_calls = 0
+        while len(partials) > 1:
+            groups = self._groups(partials, reduce_tokens)
+            partials = await asyncio.gather(*(call(template, group) for group in groups))
+            reduce_calls += len(groups)
+
+        return partials[0], self._metrics(chunks, reduce_calls, start, map_seconds)
+
+    def _plan(self, stage, chunks, budget):
+        """
+        Fit the chunks to the stage's budget and compile its reduce prompt.
+
+        Returns:
+            tuple: (chunks, reduce template, tokens left for the partial
+                results of a reduce prompt or None)
+        """
+        if budget is not None:
+            chunks = self.fit_chunks(chunks, budget(stage.template, stage.llm_config, **stage.llm_kwargs()))
+        template = self.reduce_prompt(stage, len(chunks))
+        # Reduce prompts carry the system prompt in their instructions
+        reduce_tokens = budget(template, stage.llm_config) if budget is not None else None
+        return chunks, template, reduce_tokens
+
+    def _groups(self, partials, max_tokens=None):
+        """
+        Format the partial results into the contents of the next reduce
+        prompts, as many per prompt as fit max_tokens, at most reduce_fan_in.
+        """
+        bounds = []
+        first, tokens = 0, 0
+        for index, partial in enumerate(partials):
+            part_tokens = self.tokenizer.count(self.format_partials([partial], index + 1)) + 1
+            full = index - first == self.reduce_fan_in
+            if index > first and (full or (max_tokens is not None and tokens + part_tokens > max_tokens)):
+                bounds.append((first, index))
+                first, tokens = index, 0
+            tokens += part_tokens
+        bounds.append((first, len(partials)))
+
+        if len(bounds) == len(partials):
+            # Every partial result fills a prompt on its own; combine pairs
+            # anyway so the reduction ends, and fit truncates them
+            logger.warning(f"Partial results exceed the reduce prompt budget of {max_tokens} tokens, "
+                           f"combining them in pairs")
+            bounds = [(i, min(i + 2, len(partials))) for i in range(0, len(partials), 2)]
+        return [self.format_partials(partials[start:end], start + 1) for start, end in bounds]
+
+    def _metrics(self, chunks, reduce_calls, start, map_seconds):
+        return {
+            "chunks": len(chunks),
+            "reduce_calls": reduce_calls,
+            "map_seconds": round(map_seconds, 3),
+            "total_seconds": round(time.perf_counter() - start, 3)
+        }
+
+def build_chunker(settings, prompts=None):
+    """
+    Create the chunker from the `chunking` system settings.
+
+    Args:
+        settings (dict): Chunking settings (enabled, chunk_tokens, threshold_tokens,
+            max_parallel, reduce_fan_in, tokenizer)
+        prompts (dict): Prompt templates, for reduce_prompt_template
+
+    Returns:
+        DocumentChunker: The chunker, or None if chunking is disabled
+    """
+    if not settings or not settings.get("enabled", False):
+        return None
+    return DocumentChunker(
+        chunk_tokens=settings.get("chunk_tokens", 2000),
+        threshold_tokens=settings.get("threshold_tokens"),
+        max_parallel=settings.get("max_parallel", 4),
+        reduce_fan_in=settings.get("reduce_fan_in", 8),
+        reduce_template=(prompts or {}).get("reduce_prompt_template"),
+        tokenizer=settings.get("tokenizer", "auto")
+    )
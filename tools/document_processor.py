@@ -2,24 +2,17 @@
 import os
 import json
 import time
+import asyncio
 import logging
 from datetime import datetime
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import litellm
+from adapters import LLMError
+from .sessions import SESSION_CONTENT
 
-def process_with_agent(thought_object, agent, agent_name, agent_id, prompt_templates):
-    """Process a thought object with an agent."""
-    # Record the current stage in history
-    thought_object["processing_history"].append({
-        "stage": thought_object["processing_stage"],
-        "timestamp": datetime.now().isoformat()
-    })
-    
-    # Update the current processing stage
-    thought_object["processing_stage"] = agent_name.lower()
-    
-    # Get the agent's LLM config name with robust fallback logic
+def resolve_llm_config_name(agent, agent_name):
+    """Get the agent's LLM config name with robust fallback logic."""
     llm_config_name = None
     
     # Try different possible locations for the llm_config specification
@@ -37,57 +30,320 @@ def process_with_agent(thought_object, agent, agent_name, agent_id, prompt_templ
         llm_config_name = 'default'
         print(f"Using default LLM config for {agent_name} as no valid config found")
     
+    return llm_config_name
+
+def build_agent_prompt(thought_object, agent_id, prompt_templates):
+    """
+    Fill in the agent's prompt template with the thought content.
+    
+    Returns:
+        str: The prompt, or None if no template is defined for the agent
+    """
     # Print the keys to check for case sensitivity or other issues
     print(f"All available template keys: {list(prompt_templates.keys())}")
     print(f"Agent ID: {agent_id}, Present in templates: {agent_id in prompt_templates}")
     
     if agent_id in prompt_templates:
-        # Fill in the template with the thought content
         template = prompt_templates[agent_id]
         print(f"Template found for {agent_id}, length: {len(template)}")
+    elif agent_id.lower() in prompt_templates:
+        # Try with lowercase version of the agent_id
+        print(f"Found template using lowercase agent ID: {agent_id.lower()}")
+        template = prompt_templates[agent_id.lower()]
+    else:
+        print(f"No prompt template found for {agent_id} or {agent_id.lower()}, skipping LLM call")
+        return None
+    
+    if isinstance(template, dict):
+        # Split template; the legacy path sends both parts as one prompt
+        template = "\n\n".join(part for part in (template.get("system"), template.get("user")) if part)
+    
+    # Fill in the template with the thought content
+    if "{thought_content}" in template:
+        return template.replace("{thought_content}", thought_object["content"])
+    
+    print(f"WARNING: Template doesn't contain {{thought_content}} placeholder. Using direct replacement.")
+    return template.replace("{{content}}", thought_object["content"])
+
+def stage_content(thought_object, related_count):
+    """
+    Get the thought content for a stage prompt, followed by the most
+    similar processed thoughts when the stage asks for `related_count` of
+    them and the related thoughts index is enabled.
+    """
+    from . import llm_handler
+    if not related_count or llm_handler.related_thoughts is None:
+        return thought_object["content"]
+    return llm_handler.related_thoughts.with_related(thought_object, related_count)
+
+def run_in_session(sessions, prompt, llm_config, llm_kwargs):
+    """
+    Send a stage's instructions within the thought's session on its config.
+    
+    Returns:
+        str: The response, or None if there is no session or the request
+            failed, in which case the full prompt should be sent
+    """
+    session = sessions.get(llm_config)
+    if session is None:
+        return None
+    from .llm_handler import communicate_in_session
+    try:
+        return communicate_in_session(session, prompt, llm_config, **llm_kwargs)
+    except LLMError as e:
+        print(f"Session request failed ({e}), sending the full prompt")
+        return None
+
+def run_agent(thought_object, agent, agent_name, agent_id, prompt_templates, sessions=None):
+    """
+    Run an agent over a thought object and return its result without
+    modifying the thought object.
+    
+    Stages only read the thought content, so this can run for several
+    agents of the same thought at once.
+    
+    Args:
+        sessions (ThoughtSessions): The thought's sessions, so agents sharing
+            an LLM config send the thought content only once
+    
+    Returns:
+        str: The agent's result
+    """
+    llm_config_name = resolve_llm_config_name(agent, agent_name)
+    related_count = getattr(agent, "related_thoughts", 0)
+    if related_count:
+        # The session holds the bare content, so this prompt is sent whole
+        prompt = build_agent_prompt({**thought_object, "content": stage_content(thought_object, related_count)},
+                                    agent_id, prompt_templates)
+        sessions = None
+    else:
+        prompt = build_agent_prompt(thought_object, agent_id, prompt_templates)
+    if prompt is None:
+        # Fallback if no prompt template is defined
+        return f"Processed by {agent_name} (no LLM interaction)"
+    
+    if sessions is not None:
+        session_prompt = build_agent_prompt({**thought_object, "content": SESSION_CONTENT}, agent_id, prompt_templates)
+        response = run_in_session(sessions, session_prompt, llm_config_name, {})
+        if response is not None:
+            return response
+    
+    # Send the prompt to the LLM and get the response, passing the agent's LLM config name
+    print(f"Sending thought to LLM with {agent_name} agent (using {llm_config_name} LLM config)...")
+    from .llm_handler import communicate_with_llm
+    try:
+        return communicate_with_llm(prompt, llm_config_name)
+    except LLMError as e:
+        return record_stage_error(thought_object, agent_id, e)
+
+async def arun_agent(thought_object, agent, agent_name, agent_id, prompt_templates):
+    """Async version of run_agent that awaits the LLM on the event loop."""
+    llm_config_name = resolve_llm_config_name(agent, agent_name)
+    related_count = getattr(agent, "related_thoughts", 0)
+    if related_count:
+        content = await asyncio.to_thread(stage_content, thought_object, related_count)
+        prompt = build_agent_prompt({**thought_object, "content": content}, agent_id, prompt_templates)
+    else:
+        prompt = build_agent_prompt(thought_object, agent_id, prompt_templates)
+    if prompt is None:
+        return f"Processed by {agent_name} (no LLM interaction)"
+    
+    print(f"Sending thought to LLM with {agent_name} agent (using {llm_config_name} LLM config)...")
+    from .llm_handler import acommunicate_with_llm
+    try:
+        return await acommunicate_with_llm(prompt, llm_config_name)
+    except LLMError as e:
+        return record_stage_error(thought_object, agent_id, e)
+
+def split_thought(thought_object, chunker):
+    """
+    Split a large thought's content into chunks for map-reduce stages.
+    
+    The chunk count is recorded in the thought's `chunk_count`.
+    
+    Returns:
+        list: The chunks, or None if the content is sent whole
+    """
+    if chunker is None:
+        return None
+    chunks = chunker.split(thought_object["content"])
+    if chunks:
+        print(f"Split thought {thought_object.get('id')} into {len(chunks)} chunks")
+        thought_object["chunk_count"] = len(chunks)
+    return chunks
+
+def run_stage(thought_object, stage, stream=False, on_partial=None, chunks=None, chunker=None, sessions=None):
+    """
+    Run a compiled pipeline stage over a thought object and return its result.
+    
+    Args:
+        thought_object (dict): The thought object being processed
+        stage (PlannedStage): The stage from the compiled pipeline plan
+        stream (bool): Stream the response and record its latency in the
+            thought's `stage_metrics`
+        on_partial (function): Called as on_partial(agent_id, text_so_far)
+            while a streamed response arrives
+        chunks (list): Chunks from split_thought; the stage then runs over
+            each chunk and combines the results, without streaming
+        chunker (DocumentChunker): The chunker that produced the chunks
+        sessions (ThoughtSessions): The thought's sessions; a stage with a
+            session sends only its instructions, without streaming
         
-        # Check for correct placeholder
-        if "{thought_content}" in template:
-            prompt = template.replace("{thought_content}", thought_object["content"])
-        else:
-            print(f"WARNING: Template doesn't contain {{thought_content}} placeholder. Using direct replacement.")
-            prompt = template.replace("{{content}}", thought_object["content"])
+    Stages with a cascade try their cheaper LLM configs first and are not
+    streamed, since a response may be replaced by a stronger config's.
+    Stages with `related_thoughts` get the most similar processed thoughts
+    after the content (see stage_content), except when run over chunks.
         
-        # Send the prompt to the LLM and get the response, passing the agent's LLM config name
-        print(f"Sending thought to LLM with {agent_name} agent (using {llm_config_name} LLM config)...")
+    Returns:
+        str: The stage result
+    """
+    if stage.template is None:
+        return f"Processed by {stage.agent_name} (no LLM interaction)"
+    
+    from .llm_handler import fit_prompt, content_budget
+    if chunks:
         from .llm_handler import communicate_with_llm
-        llm_response = communicate_with_llm(prompt, llm_config_name)
-        
-        # Store the LLM response in the thought object
-        thought_object[f"{agent_name.lower()}_results"] = llm_response
-    else:
-        # Try with lowercase version of the agent_id
-        lowercase_id = agent_id.lower()
-        if lowercase_id in prompt_templates:
-            print(f"Found template using lowercase agent ID: {lowercase_id}")
-            template = prompt_templates[lowercase_id]
-            
-            # Fill in the template with the thought content
-            if "{thought_content}" in template:
-                prompt = template.replace("{thought_content}", thought_object["content"])
-            else:
-                prompt = template.replace("{{content}}", thought_object["content"])
-            
-            # Send the prompt to the LLM and get the response, passing the agent's LLM config name
-            print(f"Sending thought to LLM with {agent_name} agent (using {llm_config_name} LLM config)...")
-            from .llm_handler import communicate_with_llm
-            llm_response = communicate_with_llm(prompt, llm_config_name)
-            
-            # Store the LLM response in the thought object
-            thought_object[f"{agent_name.lower()}_results"] = llm_response
-        else:
-            # Fallback if no prompt template is defined
-            print(f"No prompt template found for {agent_id} or {lowercase_id}, skipping LLM call")
-            thought_object[f"{agent_name.lower()}_results"] = f"Processed by {agent_name} (no LLM interaction)"
+        print(f"Sending {len(chunks)} chunks to LLM with {stage.agent_name} agent (using {stage.llm_config} LLM config)...")
+        try:
+            response, metrics = chunker.run_stage(stage, chunks, communicate_with_llm, fit_prompt, content_budget)
+        except LLMError as e:
+            return record_stage_error(thought_object, stage.agent_id, e)
+        thought_object.setdefault("stage_metrics", {})[stage.agent_id] = metrics
+        return response
+    
+    content = stage_content(thought_object, stage.related_thoughts)
+    if stage.cascade is not None:
+        from .llm_handler import communicate_with_llm
+        def call(config_name):
+            prompt, llm_config = fit_prompt(stage.template, content, config_name, **stage.llm_kwargs())
+            print(f"Sending thought to LLM with {stage.agent_name} agent (using {llm_config} LLM config)...")
+            return communicate_with_llm(prompt, llm_config, **stage.llm_kwargs())
+        try:
+            response, decision = stage.cascade.run(stage.agent_id, thought_object["content"], stage.llm_config, call)
+        except LLMError as e:
+            return record_stage_error(thought_object, stage.agent_id, e)
+        thought_object.setdefault("stage_metrics", {})[stage.agent_id] = {"cascade": decision}
+        return response
+    
+    try:
+        prompt, llm_config = fit_prompt(stage.template, content, stage.llm_config, **stage.llm_kwargs())
+    except LLMError as e:
+        return record_stage_error(thought_object, stage.agent_id, e)
+    print(f"Sending thought to LLM with {stage.agent_name} agent (using {llm_config} LLM config)...")
+    
+    # Only untouched prompts can use the session, which holds the full content
+    if sessions is not None and llm_config == stage.llm_config and \
+            prompt == stage.template.render(thought_object["content"]):
+        response = run_in_session(sessions, stage.template.render(SESSION_CONTENT), llm_config, stage.llm_kwargs())
+        if response is not None:
+            return response
+    
+    if not stream:
+        from .llm_handler import communicate_with_llm
+        try:
+            return communicate_with_llm(prompt, llm_config, **stage.llm_kwargs())
+        except LLMError as e:
+            return record_stage_error(thought_object, stage.agent_id, e)
+    
+    from .llm_handler import stream_with_llm
+    on_text = None
+    if on_partial is not None:
+        on_text = lambda text: on_partial(stage.agent_id, text)
+    try:
+        response, metrics = stream_with_llm(prompt, llm_config, on_text=on_text, **stage.llm_kwargs())
+    except LLMError as e:
+        return record_stage_error(thought_object, stage.agent_id, e)
+    
+    # Each stage writes its own key, so parallel stages don't conflict
+    thought_object.setdefault("stage_metrics", {})[stage.agent_id] = metrics
+    return response
+
+async def arun_stage(thought_object, stage, chunks=None, chunker=None):
+    """Async version of run_stage."""
+    if stage.template is None:
+        return f"Processed by {stage.agent_name} (no LLM interaction)"
+    
+    from .llm_handler import fit_prompt, content_budget, acommunicate_with_llm
+    if chunks:
+        print(f"Sending {len(chunks)} chunks to LLM with {stage.agent_name} agent (using {stage.llm_config} LLM config)...")
+        try:
+            response, metrics = await chunker.arun_stage(stage, chunks, acommunicate_with_llm, fit_prompt, content_budget)
+        except LLMError as e:
+            return record_stage_error(thought_object, stage.agent_id, e)
+        thought_object.setdefault("stage_metrics", {})[stage.agent_id] = metrics
+        return response
+    
+    content = thought_object["content"]
+    if stage.related_thoughts:
+        content = await asyncio.to_thread(stage_content, thought_object, stage.related_thoughts)
+    if stage.cascade is not None:
+        async def acall(config_name):
+            prompt, llm_config = fit_prompt(stage.template, content, config_name, **stage.llm_kwargs())
+            print(f"Sending thought to LLM with {stage.agent_name} agent (using {llm_config} LLM config)...")
+            return await acommunicate_with_llm(prompt, llm_config, **stage.llm_kwargs())
+        try:
+            response, decision = await stage.cascade.arun(stage.agent_id, thought_object["content"], stage.llm_config, acall)
+        except LLMError as e:
+            return record_stage_error(thought_object, stage.agent_id, e)
+        thought_object.setdefault("stage_metrics", {})[stage.agent_id] = {"cascade": decision}
+        return response
+    
+    try:
+        prompt, llm_config = fit_prompt(stage.template, content, stage.llm_config, **stage.llm_kwargs())
+    except LLMError as e:
+        return record_stage_error(thought_object, stage.agent_id, e)
+    print(f"Sending thought to LLM with {stage.agent_name} agent (using {llm_config} LLM config)...")
+    try:
+        return await acommunicate_with_llm(prompt, llm_config, **stage.llm_kwargs())
+    except LLMError as e:
+        return record_stage_error(thought_object, stage.agent_id, e)
+
+def record_stage_error(thought_object, agent_id, error):
+    """
+    Record a failed stage in the thought's `stage_errors`, keeping the
+    error message out of the stage results.
+    
+    Returns:
+        None: The stage result to record for the failed stage
+    """
+    print(f"Stage {agent_id} failed: {error}")
+    # Each stage writes its own key, so parallel stages don't conflict
+    thought_object.setdefault("stage_errors", {})[agent_id] = str(error)
+    return None
+
+def record_stage_result(thought_object, agent_name, result):
+    """Record an agent's result in the thought object and advance its stage."""
+    # Record the current stage in history
+    thought_object["processing_history"].append({
+        "stage": thought_object["processing_stage"],
+        "timestamp": datetime.now().isoformat()
+    })
+    
+    # Update the current processing stage
+    thought_object["processing_stage"] = agent_name.lower()
+    
+    # Store the LLM response in the thought object
+    thought_object[f"{agent_name.lower()}_results"] = result
     
     print(f"Processed thought with {agent_name} agent")
     return thought_object
 
+def process_with_agent(thought_object, agent, agent_name, agent_id, prompt_templates, sessions=None):
+    """
+    Process a thought object with an agent.
+    
+    Pass the same ThoughtSessions to every agent of a thought to have
+    agents sharing an LLM config reuse the evaluated content; record its
+    savings with sessions.record(thought_object) afterwards.
+    """
+    result = run_agent(thought_object, agent, agent_name, agent_id, prompt_templates, sessions)
+    return record_stage_result(thought_object, agent_name, result)
+
+async def aprocess_with_agent(thought_object, agent, agent_name, agent_id, prompt_templates):
+    """Async version of process_with_agent."""
+    result = await arun_agent(thought_object, agent, agent_name, agent_id, prompt_templates)
+    return record_stage_result(thought_object, agent_name, result)
+
 def pass_to_next_agent(thought_object, next_agent, next_agent_name, next_agent_id, prompt_templates):
     """
     Pass a thought object to the next agent.
@@ -1,38 +1,162 @@
 import os
 import json
+import hashlib
 import time
 import logging
+import threading
 from datetime import datetime
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import litellm  # Changed from langchain_community.llms import Ollama
 
-# Add this class to file_watcher.py before the other functions
+from utils.ids import new_thought_id
+
+logger = logging.getLogger(__name__)
+
+# Suffixes of temporary files written by editors and sync tools
+TEMP_FILE_SUFFIXES = ("~", ".tmp", ".swp", ".part", ".crdownload")
+
+def is_ignored_file(file_path):
+    """Check whether a file in the capture folder should never be processed."""
+    file_name = os.path.basename(file_path)
+    return (file_name.startswith("meta_")
+            or file_name.startswith(".")
+            or file_name.endswith(TEMP_FILE_SUFFIXES))
+
+class EventCoalescer:
+    """
+    Collects file events and hands each completed file to the callback once.
+    
+    Bursts of events for the same file are debounced, and a file is only read
+    once its size and mtime stay the same between two polls (or it was closed
+    after writing), so half-written files are never processed.
+    """
+    
+    def __init__(self, callback, debounce_seconds=0.2, poll_interval=0.1):
+        """
+        Args:
+            callback (function): Function to call with each completed thought object
+            debounce_seconds (float): Quiet time after the last event before a file is checked
+            poll_interval (float): Seconds between checks of pending files
+        """
+        self.callback = callback
+        self.debounce_seconds = debounce_seconds
+        self.poll_interval = poll_interval
+        
+        self._pending = {}
+        self._emitted = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="capture-coalescer", daemon=True)
+        self._thread.start()
+    
+    def touch(self, file_path, closed=False):
+        """Note an event for a file; `closed` marks that the writer closed it."""
+        with self._lock:
+            entry = self._pending.setdefault(file_path, {"signature": None, "closed": False})
+            entry["last_event"] = time.monotonic()
+            entry["closed"] = entry["closed"] or closed
+    
+    def discard(self, file_path):
+        """Forget a file that was moved away or deleted."""
+        with self._lock:
+            self._pending.pop(file_path, None)
+            self._emitted.pop(file_path, None)
+    
+    def stop(self):
+        """Stop checking pending files."""
+        self._stopped.set()
+        self._thread.join()
+    
+    def _run(self):
+        while not self._stopped.wait(self.poll_interval):
+            for file_path in self._ready_files():
+                self._emit(file_path)
+    
+    def _ready_files(self):
+        """Return the pending files that are quiet and fully written."""
+        now = time.monotonic()
+        ready = []
+        
+        with self._lock:
+            for file_path, entry in list(self._pending.items()):
+                if now - entry["last_event"] < self.debounce_seconds:
+                    continue
+                
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    del self._pending[file_path]
+                    continue
+                
+                # Wait until the size and mtime stop changing
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if not entry["closed"] and entry["signature"] != signature:
+                    entry["signature"] = signature
+                    continue
+                
+                del self._pending[file_path]
+                if self._emitted.get(file_path) == signature:
+                    # Already handed over this exact version of the file
+                    continue
+                self._emitted[file_path] = signature
+                ready.append(file_path)
+        
+        return ready
+    
+    def _emit(self, file_path):
+        """Read a completed file and pass it to the callback."""
+        print(f"New file detected: {file_path}")
+        try:
+            content = read_file(file_path)
+            if content:
+                self.callback(content)
+        except Exception as e:
+            logger.error(f"Error handling captured file {file_path}: {e}")
 
 class CaptureHandler(FileSystemEventHandler):
-    def __init__(self, callback):
+    def __init__(self, callback, debounce_seconds=0.2, poll_interval=0.1):
         self.callback = callback
+        self.coalescer = EventCoalescer(callback, debounce_seconds, poll_interval)
+    
+    def _track(self, file_path, closed=False):
+        # Skip metadata and temporary files
+        if not is_ignored_file(file_path):
+            self.coalescer.touch(file_path, closed)
         
     def on_created(self, event):
-        # Skip directories and metadata files
-        if event.is_directory or os.path.basename(event.src_path).startswith("meta_") or os.path.basename(event.src_path).startswith("."):
-            return
-            
-        # Process the file
-        print(f"New file detected: {event.src_path}")
-        content = read_file(event.src_path)
-        if content:
-            self.callback(content)
+        if not event.is_directory:
+            self._track(event.src_path)
+    
+    def on_modified(self, event):
+        if not event.is_directory:
+            self._track(event.src_path)
+    
+    def on_closed(self, event):
+        if not event.is_directory:
+            self._track(event.src_path, closed=True)
+    
+    def on_moved(self, event):
+        # Editors often write a temp file and rename it into place
+        if not event.is_directory:
+            self.coalescer.discard(event.src_path)
+            self._track(event.dest_path)
+    
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.coalescer.discard(event.src_path)
 
 
 
-def process_existing_files(folder_path, callback):
+def process_existing_files(folder_path, callback, manifest=None):
     """
     Process existing files in the folder.
     
     Args:
         folder_path (str): Path to the folder to process
         callback (function): Function to call for each file
+        manifest (ProcessedManifest): Optional manifest of processed files;
+            files with an unchanged size and mtime are skipped
         
     Returns:
         int: Number of files processed
@@ -41,35 +165,47 @@ def process_existing_files(folder_path, callback):
         return 0
         
     count = 0
+    skipped = 0
     print(f"Checking for existing files in {folder_path}...")
     
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        
-        # Skip directories and metadata files
-        if os.path.isdir(file_path) or filename.startswith("meta_") or filename.startswith("."):
-            continue
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            # Skip directories, metadata and temporary files
+            if not entry.is_file() or is_ignored_file(entry.name):
+                continue
             
-        # Process the file
-        print(f"Found existing file: {file_path}")
-        content = read_file(file_path)
-        if content:
-            callback(content)
-            count += 1
+            # Skip files that were processed and haven't changed since
+            if manifest is not None:
+                stat = entry.stat()
+                if manifest.is_unchanged(entry.path, stat.st_size, stat.st_mtime_ns):
+                    skipped += 1
+                    continue
+                
+            # Process the file
+            print(f"Found existing file: {entry.path}")
+            content = read_file(entry.path)
+            if content:
+                callback(content)
+                count += 1
+    
+    if skipped:
+        print(f"Skipped {skipped} unchanged files already in the manifest")
             
     return count
 
 
 
-def watch_folder(folder_path, callback):
+def watch_folder(folder_path, callback, debounce_seconds=0.2, poll_interval=0.1):
     """
     Watch a folder for new files and call the callback function when a new file is detected.
     
     Args:
         folder_path (str): Path to the folder to watch
         callback (function): Function to call when a new file is detected
+        debounce_seconds (float): Quiet time after the last event before a file is read
+        poll_interval (float): Seconds between checks that pending files are fully written
     """
-    event_handler = CaptureHandler(callback)
+    event_handler = CaptureHandler(callback, debounce_seconds, poll_interval)
     observer = Observer()
     observer.schedule(event_handler, folder_path, recursive=False)
     observer.start()
@@ -94,12 +230,13 @@ def read_file(file_path):
         return None
     
     # Read the file content
+    stat = os.stat(file_path)
     with open(file_path, 'r', encoding='utf-8') as file:
         content = file.read()
     
     # Create a dictionary with the content and basic metadata
     timestamp = datetime.now().isoformat()
-    file_id = f"thought_{int(time.time())}"
+    file_id = new_thought_id()
     file_name = os.path.basename(file_path)
     
     thought_object = {
@@ -107,6 +244,9 @@ def read_file(file_path):
         "timestamp": timestamp,
         "original_filename": file_name,
         "original_path": file_path,
+        "original_size": stat.st_size,
+        "original_mtime_ns": stat.st_mtime_ns,
+        "content_hash": hashlib.sha256(content.encode('utf-8')).hexdigest(),
         "content": content,
         "processing_stage": "capture",
         "processing_history": []
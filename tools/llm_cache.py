@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class LLMResponseCache:
+    """
+    Two-level cache of LLM responses.
+
+    An in-memory LRU sits in front of a SQLite file, so identical requests
+    are answered without calling the LLM again, also after a restart.
+    """
+
+    def __init__(self, path=None, max_memory_entries=1024, max_disk_entries=100000, ttl_seconds=None):
+        """
+        Args:
+            path (str): SQLite file for the on-disk store, or None for memory only
+            max_memory_entries (int): Size of the in-memory LRU
+            max_disk_entries (int): Maximum number of responses kept on disk
+            ttl_seconds (float): Age after which entries expire, or None/0 to keep them
+        """
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds or None
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._inserts_since_eviction = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+
+        if path:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+            self._db.commit()
+
+    @staticmethod
+    def make_key(adapter, model, temperature, max_tokens, system_prompt, prompt):
+        """
+        Build the cache key for a request.
+
+        Returns:
+            str: Hex digest identifying the request
+        """
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        fields = json.dumps(
+            [adapter, model, temperature, max_tokens, system_prompt, prompt_hash],
+            sort_keys=True
+        )
+        return hashlib.sha256(fields.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Look up a cached response.
+
+        Returns:
+            str: The cached response, or None on a miss
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, created = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return response
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT response, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    response, created = row
+                    if not self._expired(created, now):
+                        self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, response, created)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return response
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+
+            self.misses += 1
+            return None
+
+    def set(self, key, response):
+        """Store a response in memory and on disk."""
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, response, now)
+
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, response, now, now)
+                )
+                self._db.commit()
+                self._inserts_since_eviction += 1
+                if self._inserts_since_eviction >= 100:
+                    self._evict_disk(now)
+
+    def stats(self):
+        """Hit and miss counters."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "memory_entries": len(self._memory)
+            }
+
+    def close(self):
+        """Close the on-disk store."""
+        with self._lock:
+            if self._db is not None:
+                self._evict_disk(time.time())
+                self._db.close()
+                self._db = None
+
+    def _expired(self, created, now):
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def _remember(self, key, response, created):
+        """Add an entry to the in-memory LRU, evicting the oldest if full."""
+        self._memory[key] = (response, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        """Drop expired entries and trim the store to max_disk_entries."""
+        self._inserts_since_eviction = 0
+        if self.ttl_seconds is not None:
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        if self.max_disk_entries:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_disk_entries,)
+            )
+        self._db.commit()
+
+def is_error_response(response):
+    """Check whether a response is an error message rather than a generation."""
+    return not isinstance(response, str) or response.startswith(("ERROR:", "Error generating response"))
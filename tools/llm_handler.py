@@ -1,28 +1,44 @@
 import os
 import json
+import time
 import yaml
 import logging
+import threading
 from datetime import datetime
-from adapters import create_adapter 
+from adapters import AdapterRegistry, LLMError
+from .llm_cache import LLMResponseCache, is_error_response
+from .resilience import CallPolicy
+from .token_budget import TokenBudget
+from .semantic_cache import SemanticCache
+from .related_thoughts import build_related_thoughts
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Global variables
-llm_adapter = None
+adapter_registry = None
+response_cache = None
+token_budget = None
+semantic_cache = None
+related_thoughts = None
+# (llm_config, max_chars) the semantic cache and related thoughts embed
+# thoughts with; vectors are shared between them when these match
+_embedding_settings = {}
+call_policies = {}
+_policy_lock = threading.Lock()
 LLM_CONFIGS = {}
 
 def initialize_llm_configs(config_path, adapter_type="ollama"):
     """
-    Initialize the global LLM configurations and adapter.
+    Initialize the global LLM configurations and adapter registry.
     This should be called at system startup.
     
     Args:
         config_path (str): Path to the YAML config file
-        adapter_type (str): Type of adapter to use ("litellm" or "ollama")
+        adapter_type (str): Adapter type for configs that don't set one ("litellm" or "ollama")
     """
-    global LLM_CONFIGS, llm_adapter
+    global LLM_CONFIGS, adapter_registry, call_policies
     
     logger.info(f"Initializing LLM configs from: {config_path}")
     
@@ -39,15 +55,9 @@ def initialize_llm_configs(config_path, adapter_type="ollama"):
         else:
             logger.info(f"Loaded {len(LLM_CONFIGS)} LLM configurations: {list(LLM_CONFIGS.keys())}")
         
-        # Create and initialize the adapter
-        from adapters import create_adapter
-        llm_adapter = create_adapter(adapter_type)
-        logger.info(f"Created {adapter_type} adapter")
-        
-        # Initialize with first config or default
-        default_config = LLM_CONFIGS.get('default', list(LLM_CONFIGS.values())[0] if LLM_CONFIGS else {})
-        llm_adapter.initialize(default_config)
-        logger.info(f"Initialized adapter with config: {default_config}")
+        # Create one initialized adapter per configuration
+        adapter_registry = AdapterRegistry(LLM_CONFIGS, default_adapter=adapter_type)
+        call_policies = {}
         
     except Exception as e:
         logger.error(f"Error initializing LLM configurations: {e}")
@@ -62,48 +72,601 @@ def initialize_llm_configs(config_path, adapter_type="ollama"):
         }}
         
         # Create a fallback adapter
-        from adapters import create_adapter
-        llm_adapter = create_adapter("ollama")
-        llm_adapter.initialize(LLM_CONFIGS['default'])
+        adapter_registry = AdapterRegistry(LLM_CONFIGS)
+        call_policies = {}
         logger.info("Using fallback configuration")
 
+def initialize_response_cache(settings):
+    """
+    Set up the LLM response cache from the `llm_cache` system settings.
+    
+    Args:
+        settings (dict): Cache settings (enabled, path, max_memory_entries,
+            max_disk_entries, ttl_seconds)
+        
+    Returns:
+        LLMResponseCache: The cache, or None if caching is disabled
+    """
+    global response_cache
+    
+    if response_cache is not None:
+        response_cache.close()
+        response_cache = None
+    
+    if not settings or not settings.get("enabled", False):
+        logger.info("LLM response cache disabled")
+        return None
+    
+    response_cache = LLMResponseCache(
+        path=settings.get("path"),
+        max_memory_entries=settings.get("max_memory_entries", 1024),
+        max_disk_entries=settings.get("max_disk_entries", 100000),
+        ttl_seconds=settings.get("ttl_seconds")
+    )
+    logger.info(f"LLM response cache enabled (store: {settings.get('path') or 'memory only'})")
+    return response_cache
+
+def initialize_token_budget(settings):
+    """
+    Set up the token budget from the `token_budget` system settings.
+    
+    Args:
+        settings (dict): Budget settings (enabled, strategy, reserve_tokens, tokenizer)
+        
+    Returns:
+        TokenBudget: The budget, or None if disabled
+    """
+    global token_budget
+    
+    if not settings or not settings.get("enabled", False) or adapter_registry is None:
+        token_budget = None
+        logger.info("Token budget disabled")
+        return None
+    
+    token_budget = TokenBudget(
+        adapter_registry.get_config,
+        adapter_registry.names,
+        strategy=settings.get("strategy", "truncate"),
+        reserve_tokens=settings.get("reserve_tokens", 0),
+        tokenizer=settings.get("tokenizer", "auto")
+    )
+    logger.info(f"Token budget enabled (strategy: {token_budget.strategy})")
+    return token_budget
+
+def initialize_semantic_cache(settings):
+    """
+    Set up the semantic cache from the `semantic_cache` system settings.
+    
+    Args:
+        settings (dict): Cache settings (enabled, llm_config, path, threshold,
+            rerun_stages, max_chars)
+        
+    Returns:
+        SemanticCache: The cache, or None if disabled
+    """
+    global semantic_cache
+    
+    if not settings or not settings.get("enabled", False) or adapter_registry is None:
+        semantic_cache = None
+        logger.info("Semantic cache disabled")
+        return None
+    
+    config_name = settings.get("llm_config", "embeddings")
+    _embedding_settings["semantic_cache"] = (config_name, settings.get("max_chars", 8000))
+    semantic_cache = SemanticCache(
+        lambda text: embed_texts([text], config_name)[0],
+        path=settings.get("path"),
+        threshold=settings.get("threshold", 0.95),
+        rerun_stages=settings.get("rerun_stages", ["capture"]),
+        max_chars=settings.get("max_chars", 8000)
+    )
+    logger.info(f"Semantic cache enabled (embeddings from '{config_name}', "
+                f"threshold {semantic_cache.threshold})")
+    return semantic_cache
+
+def initialize_related_thoughts(settings):
+    """
+    Set up the index of processed thoughts from the `related_thoughts` system settings.
+    
+    Args:
+        settings (dict): Index settings (enabled, llm_config, path, nlist,
+            nprobe, ivf_min_rows, max_chars, snippet_chars, min_score)
+        
+    Returns:
+        RelatedThoughts: The index, or None if disabled
+    """
+    global related_thoughts
+    
+    if adapter_registry is None:
+        settings = {}
+    config_name = (settings or {}).get("llm_config", "embeddings")
+    related_thoughts = build_related_thoughts(settings, lambda texts: embed_texts(texts, config_name))
+    if related_thoughts is not None:
+        _embedding_settings["related_thoughts"] = (config_name, related_thoughts.max_chars)
+    if related_thoughts is None:
+        logger.info("Related thoughts disabled")
+    else:
+        logger.info(f"Related thoughts enabled (embeddings from '{config_name}', "
+                    f"{len(related_thoughts.index)} thoughts indexed)")
+    return related_thoughts
+
+def share_embedding(thought_object, vector):
+    """
+    Give the related thoughts index the semantic cache's vector of a
+    thought, so the thought is embedded only once.
+    """
+    if vector is None or semantic_cache is None or related_thoughts is None:
+        return
+    if _embedding_settings.get("semantic_cache") == _embedding_settings.get("related_thoughts"):
+        related_thoughts.remember(thought_object, vector)
+
+def embed_texts(texts, config_name='default'):
+    """
+    Compute embedding vectors with an LLM configuration's model.
+    
+    Returns:
+        list: One vector per text
+        
+    Raises:
+        LLMError: If the adapter has no embedding support or the request failed
+    """
+    adapter, config, resolved = _resolve_adapter(config_name)
+    return get_call_policy(resolved).call(lambda: adapter.embed(texts))
+
+def fit_prompt(template, content, config_name='default', system_prompt=None):
+    """
+    Fill in a stage's prompt template, keeping the prompt within the
+    token budget of its LLM configuration.
+    
+    Args:
+        template (CompiledTemplate): The stage's prompt template
+        content (str): The thought content
+        config_name (str): Name of the LLM configuration of the stage
+        system_prompt (str): The stage's system prompt, which counts
+            against the budget too
+        
+    Returns:
+        tuple: (prompt, name of the LLM configuration to send it to)
+        
+    Raises:
+        PromptTooLargeError: If the prompt is over budget and may not be
+            truncated or routed elsewhere
+    """
+    if token_budget is None:
+        return template.render(content), config_name
+    try:
+        resolved = adapter_registry.resolve_name(config_name)
+    except KeyError:
+        return template.render(content), config_name
+    return token_budget.fit(template, content, resolved, system_prompt=system_prompt)
+
+def content_budget(template, config_name='default', system_prompt=None):
+    """
+    Get the tokens the content may take in a stage prompt without
+    exceeding the token budget of its LLM configuration.
+    
+    Returns:
+        int: The token count, or None if prompts are not budgeted
+    """
+    if token_budget is None or adapter_registry is None:
+        return None
+    try:
+        resolved = adapter_registry.resolve_name(config_name)
+    except KeyError:
+        return None
+    return token_budget.content_budget(template, resolved, system_prompt=system_prompt)
+
+def get_cache_key(config, prompt, system_prompt=None):
+    """
+    Get the response cache key for a request.
+    
+    Returns:
+        str: The key, or None if the request should not be cached
+    """
+    if response_cache is None or not config.get("cache", True):
+        return None
+    
+    return LLMResponseCache.make_key(
+        config.get("adapter"),
+        config.get("model"),
+        config.get("temperature"),
+        config.get("max_tokens"),
+        system_prompt,
+        prompt
+    )
+
+def get_adapter(config_name='default'):
+    """
+    Get the shared adapter for an LLM configuration.
+    
+    Returns:
+        tuple: (adapter, config) or (None, error message) if unavailable
+    """
+    if adapter_registry is None:
+        logger.error("LLM adapter not initialized")
+        return None, "ERROR: LLM adapter not initialized"
+    
+    try:
+        adapter = adapter_registry.get(config_name)
+        config = adapter_registry.get_config(config_name)
+    except KeyError:
+        logger.error(f"No configuration found for '{config_name}' and no default available")
+        return None, f"ERROR: No configuration found for '{config_name}'"
+    except LLMError as e:
+        return None, f"ERROR: {e}"
+    
+    logger.info(f"Using LLM config: {config_name} - Model: {config.get('model', 'unknown')}")
+    return adapter, config
+
+def get_model_key(config_name='default'):
+    """
+    Identify the model an LLM configuration loads on its server.
+    
+    Configs that differ only in parameters such as temperature share a
+    model key, so they can be scheduled together.
+    
+    Returns:
+        tuple: (adapter, base_url, model)
+    """
+    if adapter_registry is None:
+        return (None, None, config_name)
+    try:
+        config = adapter_registry.get_config(config_name)
+    except KeyError:
+        return (None, None, config_name)
+    base_url = config.get("base_url")
+    if isinstance(base_url, list):
+        base_url = tuple(base_url)
+    return (config.get("adapter"), base_url, config.get("model"))
+
+def warmup_models(config_names=None):
+    """
+    Load the models of the given LLM configurations before the first
+    thought arrives. Configurations sharing a model are warmed up once.
+    
+    Args:
+        config_names (list): Configuration names to warm up, or None for all
+        
+    Returns:
+        list: One dict per model with model, configs, seconds (None if
+            the adapter has nothing to warm up) and error (None on success)
+    """
+    if adapter_registry is None:
+        logger.error("LLM adapter not initialized")
+        return []
+    
+    models = {}
+    for name in config_names or adapter_registry.names():
+        try:
+            resolved = adapter_registry.resolve_name(name)
+        except KeyError:
+            logger.warning(f"Cannot warm up unknown LLM config '{name}'")
+            continue
+        models.setdefault(get_model_key(resolved), []).append(resolved)
+    
+    report = []
+    for (adapter_type, base_url, model), names in models.items():
+        entry = {"model": model, "configs": sorted(set(names)), "seconds": None, "error": None}
+        start = time.perf_counter()
+        try:
+            if adapter_registry.get(names[0]).warmup():
+                entry["seconds"] = round(time.perf_counter() - start, 2)
+                logger.info(f"Warmed up model {model} in {entry['seconds']}s")
+        except LLMError as e:
+            entry["error"] = str(e)
+            logger.error(f"Could not warm up model {model}: {e}")
+        report.append(entry)
+    
+    return report
+
+def get_call_policy(config_name='default'):
+    """
+    Get the timeout, retry, hedging and circuit breaker policy of an LLM
+    configuration, creating it on first use.
+    
+    Returns:
+        CallPolicy: The policy shared by every request to the configuration
+    """
+    name = adapter_registry.resolve_name(config_name)
+    with _policy_lock:
+        policy = call_policies.get(name)
+        if policy is None:
+            policy = CallPolicy.from_config(name, adapter_registry.get_config(name))
+            call_policies[name] = policy
+        return policy
+
+def _next_fallback(config, tried):
+    """Get the fallback config name to try next, or None if there is none left."""
+    fallback = config.get("fallback")
+    if not fallback:
+        return None
+    try:
+        resolved = adapter_registry.resolve_name(fallback)
+    except KeyError:
+        logger.error(f"Fallback LLM config '{fallback}' does not exist")
+        return None
+    return None if resolved in tried else fallback
+
+def _resolve_adapter(config_name):
+    """Get the adapter, config and resolved name of a configuration, raising LLMError if unavailable."""
+    adapter, config = get_adapter(config_name)
+    if adapter is None:
+        raise LLMError(config)
+    return adapter, config, adapter_registry.resolve_name(config_name)
+
+def generate_with_fallback(prompt, config_name='default', system_prompt=None):
+    """
+    Generate a response under the configuration's call policy, failing
+    over to its `fallback` configuration when the request fails or its
+    circuit breaker is open.
+    
+    Returns:
+        tuple: (response, name of the configuration that answered)
+        
+    Raises:
+        LLMError: If the configuration and all of its fallbacks failed
+    """
+    tried = set()
+    name = config_name
+    while True:
+        adapter, config, resolved = _resolve_adapter(name)
+        tried.add(resolved)
+        try:
+            response = get_call_policy(resolved).call(
+                lambda adapter=adapter: adapter.generate(prompt, system_prompt=system_prompt)
+            )
+            return response, resolved
+        except LLMError as e:
+            fallback = _next_fallback(config, tried)
+            if fallback is None:
+                raise
+            logger.warning(f"LLM config '{resolved}' failed ({e}), falling back to '{fallback}'")
+            name = fallback
+
+async def agenerate_with_fallback(prompt, config_name='default', system_prompt=None):
+    """Async version of generate_with_fallback."""
+    tried = set()
+    name = config_name
+    while True:
+        adapter, config, resolved = _resolve_adapter(name)
+        tried.add(resolved)
+        try:
+            response = await get_call_policy(resolved).acall(
+                lambda adapter=adapter: adapter.agenerate(prompt, system_prompt=system_prompt)
+            )
+            return response, resolved
+        except LLMError as e:
+            fallback = _next_fallback(config, tried)
+            if fallback is None:
+                raise
+            logger.warning(f"LLM config '{resolved}' failed ({e}), falling back to '{fallback}'")
+            name = fallback
+
+def _cache_response(cache_key, response, answered_by, config_name):
+    """Cache a response, unless a fallback configuration produced it."""
+    if cache_key is None or is_error_response(response):
+        return
+    if answered_by != adapter_registry.resolve_name(config_name):
+        return
+    response_cache.set(cache_key, response)
 
-def communicate_with_llm(prompt, config_name='default'):
+def communicate_with_llm(prompt, config_name='default', system_prompt=None):
     """
     Communicate with the LLM and get a response using the specified configuration.
     
     Args:
         prompt (str): The prompt to send to the LLM.
         config_name (str): Name of the LLM configuration to use
+        system_prompt (str): Static instructions sent ahead of the prompt
         
     Returns:
         str: The response from the LLM.
+        
+    Raises:
+        LLMError: If the request failed after retries and fallbacks
     """
-    global llm_adapter, LLM_CONFIGS
-    
     print("========= COMMUNICATE WITH LLM FUNCTION CALLED =========")
     
-    # Check if adapter is initialized
-    if llm_adapter is None:
-        logger.error("LLM adapter not initialized")
-        return "ERROR: LLM adapter not initialized"
+    adapter, config, _ = _resolve_adapter(config_name)
     
-    # Get the configuration for the specified model
-    config = LLM_CONFIGS.get(config_name, LLM_CONFIGS.get('default'))
-    if not config:
-        logger.error(f"No configuration found for '{config_name}' and no default available")
-        return f"ERROR: No configuration found for '{config_name}'"
+    cache_key = get_cache_key(config, prompt, system_prompt)
+    if cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Using cached response for LLM config: {config_name}")
+            return cached
     
-    logger.info(f"Using LLM config: {config_name} - Model: {config.get('model', 'unknown')}")
+    response, answered_by = generate_with_fallback(prompt, config_name, system_prompt)
+    print(f"Received response from LLM, length: {len(response)}")
+    _cache_response(cache_key, response, answered_by, config_name)
+    return response
+
+def communicate_in_session(session, prompt, config_name='default', system_prompt=None):
+    """
+    Send a prompt within a thought session, whose content the model has
+    already evaluated. Responses are not cached, as the prompt alone does
+    not identify them.
+    
+    Args:
+        session (LLMSession): The thought's session on the configuration
+        prompt (str): The prompt, without the thought content
+        config_name (str): Name of the LLM configuration of the session
+        system_prompt (str): Static instructions for the request
+        
+    Returns:
+        str: The response from the LLM.
+        
+    Raises:
+        LLMError: If the request failed after retries
+    """
+    response = get_call_policy(config_name).call(lambda: session.generate(prompt, system_prompt))
+    logger.info(f"Received session response from LLM config {config_name}, length: {len(response)}")
+    return response
+
+def stream_with_llm(prompt, config_name='default', on_text=None, system_prompt=None):
+    """
+    Stream a response from the LLM, recording latency and throughput.
+    
+    The stream runs under the configuration's call policy: its timeout,
+    first chunk and idle timeouts, and retries. If it still fails before
+    producing any text, the request goes to the configuration's fallback.
+    
+    Args:
+        prompt (str): The prompt to send to the LLM.
+        config_name (str): Name of the LLM configuration to use
+        on_text (function): Called with the response text so far after every chunk
+        system_prompt (str): Static instructions sent ahead of the prompt
+        
+    Returns:
+        tuple: (response, metrics) where metrics holds ttft_ms, duration_ms,
+            chunks and tokens_per_sec. Streamed chunks are counted as tokens.
+            
+    Raises:
+        LLMError: If the request failed after retries and fallbacks
+    """
+    adapter, config, resolved = _resolve_adapter(config_name)
+    
+    start = time.perf_counter()
+    
+    cache_key = get_cache_key(config, prompt, system_prompt)
+    if cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Using cached response for LLM config: {config_name}")
+            if on_text is not None:
+                on_text(cached)
+            elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+            return cached, {"ttft_ms": elapsed_ms, "duration_ms": elapsed_ms, "chunks": 0,
+                            "tokens_per_sec": None, "cached": True}
     
+    policy = get_call_policy(config_name)
+    parts = []
+    first_chunk_at = None
     try:
-        # Set the adapter configuration for this request
-        llm_adapter.set_config(config)
+        for chunk in policy.stream(lambda: adapter.generate_stream(prompt, system_prompt=system_prompt)):
+            if first_chunk_at is None:
+                first_chunk_at = time.perf_counter()
+            parts.append(chunk)
+            if on_text is not None:
+                on_text("".join(parts))
+    except LLMError as e:
+        fallback = _next_fallback(config, {resolved})
+        if parts or fallback is None:
+            # Text already handed out cannot be replaced
+            raise
+        logger.warning(f"Streaming from LLM config '{resolved}' failed ({e}), falling back to '{fallback}'")
+        response, answered_by = generate_with_fallback(prompt, fallback, system_prompt)
+        if on_text is not None:
+            on_text(response)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        _cache_response(cache_key, response, answered_by, config_name)
+        return response, {"ttft_ms": elapsed_ms, "duration_ms": elapsed_ms, "chunks": 1,
+                          "tokens_per_sec": None, "cached": False, "answered_by": answered_by}
+    
+    end = time.perf_counter()
+    response = "".join(parts)
+    
+    generation_seconds = end - first_chunk_at if first_chunk_at is not None else 0
+    metrics = {
+        "ttft_ms": round((first_chunk_at - start) * 1000, 1) if first_chunk_at is not None else None,
+        "duration_ms": round((end - start) * 1000, 1),
+        "chunks": len(parts),
+        "tokens_per_sec": round(len(parts) / generation_seconds, 1) if generation_seconds > 0 else None,
+        "cached": False
+    }
+    logger.info(f"Streamed response from LLM config {config_name}: {len(response)} chars, "
+                f"first token after {metrics['ttft_ms']} ms")
+    
+    _cache_response(cache_key, response, adapter_registry.resolve_name(config_name), config_name)
+    return response, metrics
+
+async def acommunicate_with_llm(prompt, config_name='default', system_prompt=None):
+    """
+    Async version of communicate_with_llm for use on an event loop.
+    
+    Args:
+        prompt (str): The prompt to send to the LLM.
+        config_name (str): Name of the LLM configuration to use
+        system_prompt (str): Static instructions sent ahead of the prompt
         
-        # Use the adapter to get a response
-        response = llm_adapter.generate(prompt)
-        print(f"Received response from LLM, length: {len(response)}")
-        return response
-    except Exception as e:
-        logger.error(f"Error communicating with LLM: {e}")
-        return f"ERROR: Failed to communicate with LLM: {str(e)}"
\ No newline at end of file
+    Returns:
+        str: The response from the LLM.
+        
+    Raises:
+        LLMError: If the request failed after retries and fallbacks
+    """
+    adapter, config, _ = _resolve_adapter(config_name)
+    
+    cache_key = get_cache_key(config, prompt, system_prompt)
+    if cache_key is not None:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Using cached response for LLM config: {config_name}")
+            return cached
+    
+    response, answered_by = await agenerate_with_fallback(prompt, config_name, system_prompt)
+    logger.info(f"Received response from LLM, length: {len(response)}")
+    _cache_response(cache_key, response, answered_by, config_name)
+    return response
+
+def communicate_with_llm_batch(prompts, config_name='default', system_prompt=None):
+    """
+    Send several prompts to the LLM in one batch call.
+    
+    Cached prompts are answered from the cache and identical prompts are
+    sent only once; the rest go to the adapter's generate_batch. Prompts
+    that fail in the batch are retried one by one with the configuration's
+    retries and fallback.
+    
+    Args:
+        prompts (list): The prompts to send to the LLM.
+        config_name (str): Name of the LLM configuration to use
+        system_prompt (str): Static instructions sent ahead of every prompt
+        
+    Returns:
+        list: The responses, in the same order as the prompts. A prompt
+            that could not be answered gets its LLMError instead.
+    """
+    try:
+        adapter, config, resolved = _resolve_adapter(config_name)
+    except LLMError as e:
+        return [e] * len(prompts)
+    
+    responses = {}
+    pending = []
+    pending_set = set()
+    for prompt in prompts:
+        if prompt in responses or prompt in pending_set:
+            continue
+        cache_key = get_cache_key(config, prompt, system_prompt)
+        cached = response_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            responses[prompt] = cached
+        else:
+            pending.append(prompt)
+            pending_set.add(prompt)
+    
+    if pending:
+        logger.info(f"Sending batch of {len(pending)} prompts to LLM config {config_name} "
+                    f"({len(prompts) - len(pending)} answered without a call)")
+        policy = get_call_policy(config_name)
+        try:
+            policy.check_breaker()
+            generated = adapter.generate_batch(pending, system_prompt=system_prompt)
+            policy.record_outcome(not all(isinstance(response, Exception) for response in generated))
+        except LLMError as e:
+            logger.error(f"Error sending batch to LLM config {config_name}: {e}")
+            generated = [e] * len(pending)
+        
+        for prompt, response in zip(pending, generated):
+            answered_by = resolved
+            if isinstance(response, Exception):
+                try:
+                    response, answered_by = generate_with_fallback(prompt, config_name, system_prompt)
+                except LLMError as e:
+                    responses[prompt] = e
+                    continue
+            responses[prompt] = response
+            _cache_response(get_cache_key(config, prompt, system_prompt), response, answered_by, config_name)
+    
+    return [responses[prompt] for prompt in prompts]
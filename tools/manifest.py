@@ -0,0 +1,176 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class ProcessedManifest:
+    """
+    Persistent record of the capture files that have been processed.
+
+    Each processed file is stored with its size, mtime, content hash and the
+    ID of the thought it produced. Records are appended to a JSON lines file,
+    so recording a file never rewrites the whole manifest.
+
+    A file with the same or nearly the same content as another is recorded
+    with that thought's ID as another of its sources, but only once that
+    thought is written; if it fails, the duplicate is dropped with it and
+    processed again on the next start.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path of the manifest file
+        """
+        self.path = path
+        self._files = {}
+        self._hashes = {}
+        self._claims = {}
+        self._outputs = set()
+        self._waiting = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Replay the manifest file, compacting it if it has grown stale."""
+        if not os.path.exists(self.path):
+            return
+
+        lines = 0
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                lines += 1
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a partial last line
+                    continue
+                self._files[entry["path"]] = entry
+                self._hashes[entry["content_hash"]] = entry["output_id"]
+                self._outputs.add(entry["output_id"])
+
+        if lines > 2 * len(self._files) + 100:
+            self._compact()
+        logger.info(f"Loaded manifest with {len(self._files)} processed files from {self.path}")
+
+    def _compact(self):
+        """Rewrite the manifest with only the latest entry per file."""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            for entry in self._files.values():
+                file.write(json.dumps(entry) + "\n")
+        os.replace(temp_path, self.path)
+
+    def __len__(self):
+        return len(self._files)
+
+    def is_unchanged(self, path, size, mtime_ns):
+        """Check whether a file was already processed with the same size and mtime."""
+        entry = self._files.get(os.path.abspath(path))
+        return entry is not None and entry["size"] == size and entry["mtime_ns"] == mtime_ns
+
+    def claim(self, content_hash, thought_id):
+        """
+        Claim a content hash for a thought about to be processed.
+
+        Returns:
+            str: ID of the processed or in-progress thought with the same
+                content, or None if the claim succeeded
+        """
+        with self._lock:
+            existing = self._hashes.get(content_hash) or self._claims.get(content_hash)
+            if existing is not None:
+                return existing
+            self._claims[content_hash] = thought_id
+            return None
+
+    def is_known(self, thought_id):
+        """Check whether a thought was written or is being processed."""
+        with self._lock:
+            return thought_id in self._outputs or thought_id in self._claims.values()
+
+    def release(self, content_hash):
+        """
+        Drop the claim on a content hash, e.g. when processing failed.
+
+        Duplicates waiting for the claiming thought are dropped too and
+        their own claims released.
+
+        Returns:
+            list: The dropped duplicate thought objects
+        """
+        with self._lock:
+            thought_id = self._claims.pop(content_hash, None)
+            dropped = self._waiting.pop(thought_id, []) if thought_id is not None else []
+            for duplicate in dropped:
+                if self._claims.get(duplicate.get("content_hash")) == duplicate["id"]:
+                    del self._claims[duplicate["content_hash"]]
+        return dropped
+
+    def record_duplicate(self, thought_object, output_id):
+        """
+        Record a thought's capture file as another source of an earlier thought.
+
+        If the earlier thought is still being processed, the record waits
+        until that thought is recorded.
+
+        Returns:
+            bool: True if recorded now, False if it waits or the earlier
+                thought is unknown
+        """
+        with self._lock:
+            if output_id not in self._outputs:
+                if output_id in self._claims.values():
+                    self._waiting.setdefault(output_id, []).append(thought_object)
+                return False
+        self.record_thought(thought_object, output_id=output_id)
+        return True
+
+    def sources(self, output_id):
+        """
+        Get the capture files recorded for a thought.
+
+        Returns:
+            list: Paths of the files, the thought's own and its duplicates
+        """
+        with self._lock:
+            return [path for path, entry in self._files.items() if entry["output_id"] == output_id]
+
+    def record(self, path, size, mtime_ns, content_hash, output_id):
+        """Record a processed file and append it to the manifest file."""
+        entry = {
+            "path": os.path.abspath(path),
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "content_hash": content_hash,
+            "output_id": output_id
+        }
+
+        with self._lock:
+            self._files[entry["path"]] = entry
+            self._hashes[content_hash] = output_id
+            self._claims.pop(content_hash, None)
+            self._outputs.add(output_id)
+            waiting = self._waiting.pop(output_id, [])
+
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps(entry) + "\n")
+
+        # Duplicates that waited for this thought to be written
+        for duplicate in waiting:
+            self.record_thought(duplicate, output_id=output_id)
+
+    def record_thought(self, thought_object, output_id=None):
+        """Record the capture file a thought object was read from."""
+        self.record(
+            thought_object["original_path"],
+            thought_object.get("original_size"),
+            thought_object.get("original_mtime_ns"),
+            thought_object["content_hash"],
+            output_id or thought_object["id"]
+        )
@@ -0,0 +1,336 @@
+import os
+import re
+import json
+import time
+import zlib
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+WORD = re.compile(r"\w+")
+
+class MinHasher:
+    """
+    MinHash signatures of word shingles.
+
+    The permutations come from a fixed seed, so signatures stay comparable
+    across restarts.
+    """
+
+    def __init__(self, num_perm=128, shingle_size=3, seed=1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text):
+        """Hash the text's overlapping word n-grams, ignoring case and punctuation."""
+        words = WORD.findall(text.lower())
+        k = self.shingle_size
+        if len(words) <= k:
+            grams = {" ".join(words)}
+        else:
+            grams = {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+        return np.fromiter((zlib.crc32(gram.encode("utf-8")) for gram in grams),
+                           dtype=np.uint64, count=len(grams))
+
+    def signature(self, text):
+        """
+        Compute the MinHash signature of a text.
+
+        Returns:
+            numpy.ndarray: num_perm uint32 values
+        """
+        hashes = self.shingles(text)
+        # Universal hashing; the multiplication wraps around like the
+        # reference implementations do
+        values = (np.outer(hashes, self._a) + self._b) % MERSENNE_PRIME & MAX_HASH
+        return values.min(axis=0).astype(np.uint32)
+
+def choose_bands(threshold, num_perm):
+    """
+    Choose the LSH bands and rows per band for a similarity threshold.
+
+    Pairs become candidates with 50% probability around (1/bands)^(1/rows).
+    That point is kept well below the threshold so true near-duplicates are
+    almost never missed, using as many rows as possible to keep the
+    candidates few.
+
+    Returns:
+        tuple: (bands, rows)
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold - 0.1:
+            best = (bands, rows)
+    return best
+
+class NearDuplicateIndex:
+    """
+    Detects captures that are near-duplicates of earlier ones.
+
+    Each capture's MinHash signature is split into LSH bands. Captures
+    sharing a band are candidates, and a candidate is a duplicate when the
+    signatures estimate a Jaccard similarity of at least `threshold`.
+
+    Band keys are kept in sorted NumPy arrays, one row per band, so a
+    lookup is a binary search per band even with millions of entries;
+    entries added since the last snapshot are kept in dicts. On disk,
+    signatures are appended to a raw uint32 file and thought IDs with
+    their source paths to a JSON lines file, and the sorted band arrays
+    are saved every `snapshot_every` entries.
+
+    Captures are never duplicates of earlier captures of the same file, so
+    an edited note is processed again.
+    """
+
+    def __init__(self, path=None, threshold=0.85, num_perm=128, shingle_size=3, snapshot_every=10000):
+        """
+        Args:
+            path (str): Folder for the index files, or None for memory only
+            threshold (float): Minimum estimated Jaccard similarity of duplicates
+            num_perm (int): MinHash permutations per signature
+            shingle_size (int): Words per shingle
+            snapshot_every (int): Entries added between saves of the band arrays
+        """
+        self.path = path
+        self.threshold = threshold
+        self.snapshot_every = snapshot_every
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands, self.rows = choose_bands(threshold, num_perm)
+        self._multipliers = np.random.RandomState(2).randint(
+            1, (1 << 63) - 1, size=self.rows, dtype=np.uint64) | np.uint64(1)
+
+        self._ids = []
+        self._paths = []
+        self._base_signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._new_signatures = []
+        self._sorted_keys = np.empty((self.bands, 0), dtype=np.uint64)
+        self._sorted_rows = np.empty((self.bands, 0), dtype=np.uint32)
+        self._recent = [{} for _ in range(self.bands)]
+        self._lock = threading.Lock()
+
+        self.duplicates = 0
+        self.lookups = 0
+        self.lookup_seconds = 0.0
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def band_keys(self, signatures):
+        """
+        Compute the key of every band of one or more signatures.
+
+        Returns:
+            numpy.ndarray: uint64 keys, shaped (bands,) or (bands, signatures)
+        """
+        signatures = np.asarray(signatures, dtype=np.uint64)
+        shaped = signatures.reshape(-1, self.bands, self.rows)
+        keys = (shaped * self._multipliers).sum(axis=2, dtype=np.uint64)
+        return keys.T if signatures.ndim == 2 else keys[0]
+
+    def _load(self):
+        meta = {"num_perm": self.hasher.num_perm, "shingle_size": self.hasher.shingle_size, "bands": self.bands}
+        meta_path = self._file("meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                stored = json.load(file)
+            if stored != meta:
+                raise ValueError(f"Near-duplicate index at {self.path} was built with {stored}, "
+                                 f"not {meta}; remove it or restore the settings")
+        else:
+            with open(meta_path, 'w', encoding='utf-8') as file:
+                json.dump(meta, file)
+
+        ids_path = self._file("entries.jsonl")
+        if os.path.exists(ids_path):
+            with open(ids_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                        self._ids.append(entry["id"])
+                    except (json.JSONDecodeError, KeyError):
+                        # A crash can leave a partial last line
+                        break
+                    self._paths.append(entry.get("original_path"))
+
+        signatures_path = self._file("signatures.u32")
+        row_bytes = self.hasher.num_perm * 4
+        stored_rows = os.path.getsize(signatures_path) // row_bytes if os.path.exists(signatures_path) else 0
+        count = min(stored_rows, len(self._ids))
+        if os.path.exists(signatures_path) and os.path.getsize(signatures_path) != count * row_bytes:
+            # Drop whatever a crash left beyond the last complete entry
+            with open(signatures_path, 'r+b') as file:
+                file.truncate(count * row_bytes)
+        if len(self._ids) != count:
+            self._ids = self._ids[:count]
+            self._paths = self._paths[:count]
+            with open(ids_path, 'w', encoding='utf-8') as file:
+                file.writelines(self._entry(thought_id, original_path) + "\n"
+                                for thought_id, original_path in zip(self._ids, self._paths))
+        self._map_signatures(count)
+
+        snapshot_rows = 0
+        snapshot_path = self._file("bands.npz")
+        if os.path.exists(snapshot_path):
+            snapshot = np.load(snapshot_path)
+            if snapshot["keys"].shape[1] <= count:
+                self._sorted_keys, self._sorted_rows = snapshot["keys"], snapshot["rows"]
+                snapshot_rows = self._sorted_keys.shape[1]
+
+        if snapshot_rows < count:
+            rows = np.arange(snapshot_rows, count, dtype=np.uint32)
+            self._merge(self.band_keys(self._base_signatures[snapshot_rows:count]), rows)
+            self._save_snapshot()
+        logger.info(f"Loaded near-duplicate index with {count} entries from {self.path}")
+
+    def _map_signatures(self, count):
+        """Map the stored signatures, which the OS pages in as candidates are checked."""
+        if count:
+            self._base_signatures = np.memmap(self._file("signatures.u32"), dtype=np.uint32, mode='r',
+                                              shape=(count, self.hasher.num_perm))
+
+    def _merge(self, keys, rows):
+        """Merge the band keys of new rows into the sorted arrays."""
+        rows = np.broadcast_to(rows, keys.shape)
+        keys = np.concatenate([self._sorted_keys, keys], axis=1)
+        rows = np.concatenate([self._sorted_rows, rows], axis=1)
+        order = np.argsort(keys, axis=1, kind="stable")
+        self._sorted_keys = np.take_along_axis(keys, order, axis=1)
+        self._sorted_rows = np.take_along_axis(rows, order, axis=1).astype(np.uint32)
+
+    def _save_snapshot(self):
+        if not self.path:
+            return
+        temp_path = self._file("bands.tmp.npz")
+        np.savez(temp_path, keys=self._sorted_keys, rows=self._sorted_rows)
+        os.replace(temp_path, self._file("bands.npz"))
+
+    @staticmethod
+    def _entry(thought_id, original_path):
+        entry = {"id": thought_id}
+        if original_path is not None:
+            entry["original_path"] = original_path
+        return json.dumps(entry)
+
+    def _signature_of(self, row):
+        base = len(self._base_signatures)
+        return self._base_signatures[row] if row < base else self._new_signatures[row - base]
+
+    def _candidates(self, keys):
+        candidates = set()
+        for band, key in enumerate(keys):
+            band_keys = self._sorted_keys[band]
+            start = np.searchsorted(band_keys, key, side="left")
+            end = np.searchsorted(band_keys, key, side="right")
+            candidates.update(self._sorted_rows[band][start:end].tolist())
+            candidates.update(self._recent[band].get(int(key), ()))
+        return candidates
+
+    def find(self, signature, is_known=None, original_path=None):
+        """
+        Find the most similar indexed capture.
+
+        Args:
+            signature (numpy.ndarray): MinHash signature of the new capture
+            is_known (function): Called with a thought ID; captures for which
+                it returns False, e.g. thoughts that failed and were never
+                written, are ignored
+            original_path (str): Path of the new capture's file; earlier
+                captures of the same file are ignored
+
+        Returns:
+            tuple: (thought ID, estimated similarity), or (None, None) if no
+                indexed capture reaches the threshold
+        """
+        best_row, best_similarity = None, None
+        for row in self._candidates(self.band_keys(signature)):
+            if original_path is not None and self._paths[row] == original_path:
+                continue
+            if is_known is not None and not is_known(self._ids[row]):
+                continue
+            similarity = float(np.mean(self._signature_of(row) == signature))
+            if similarity >= self.threshold and (best_similarity is None or similarity > best_similarity):
+                best_row, best_similarity = row, similarity
+        if best_row is None:
+            return None, None
+        return self._ids[best_row], best_similarity
+
+    def add(self, signature, thought_id, original_path=None):
+        """Index the signature of a capture that is not a duplicate."""
+        row = len(self._ids)
+        self._ids.append(thought_id)
+        self._paths.append(original_path)
+        self._new_signatures.append(signature)
+        for band, key in enumerate(self.band_keys(signature)):
+            self._recent[band].setdefault(int(key), []).append(row)
+
+        if self.path:
+            with open(self._file("signatures.u32"), 'ab') as file:
+                file.write(signature.tobytes())
+            with open(self._file("entries.jsonl"), 'a', encoding='utf-8') as file:
+                file.write(self._entry(thought_id, original_path) + "\n")
+
+        if len(self._new_signatures) >= self.snapshot_every:
+            base = len(self._base_signatures)
+            new = np.array(self._new_signatures, dtype=np.uint32)
+            self._merge(self.band_keys(new), np.arange(base, base + len(new), dtype=np.uint32))
+            if self.path:
+                self._map_signatures(base + len(new))
+            else:
+                self._base_signatures = np.concatenate([self._base_signatures, new])
+            self._new_signatures = []
+            self._recent = [{} for _ in range(self.bands)]
+            self._save_snapshot()
+
+    def check(self, thought_object, is_known=None):
+        """
+        Check a captured thought against the index, indexing it if it is new.
+
+        Args:
+            thought_object (dict): The captured thought
+            is_known (function): Filters matches, see find; matches with
+                the thought's original_path are ignored too
+
+        Returns:
+            tuple: (ID of the thought it duplicates, estimated similarity),
+                or (None, None) if it was indexed as a new thought
+        """
+        start = time.perf_counter()
+        signature = self.hasher.signature(thought_object["content"])
+        with self._lock:
+            original_path = thought_object.get("original_path")
+            duplicate_of, similarity = self.find(signature, is_known, original_path)
+            if duplicate_of is None:
+                self.add(signature, thought_object["id"], original_path)
+            else:
+                self.duplicates += 1
+            self.lookups += 1
+            self.lookup_seconds += time.perf_counter() - start
+        return duplicate_of, similarity
+
+    def stats(self):
+        """Index size, duplicates found and the average check time."""
+        with self._lock:
+            return {
+                "entries": len(self._ids),
+                "duplicates": self.duplicates,
+                "avg_check_ms": round(1000 * self.lookup_seconds / self.lookups, 3) if self.lookups else None
+            }
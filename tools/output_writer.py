@@ -1,35 +1,479 @@
 import os
 import json
 import time
+import hashlib
+import queue
 import logging
+import threading
 from datetime import datetime
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import litellm  # Changed from langchain_community.llms import Ollama
 
-def write_result(thought_object, output_folder):
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from utils.ids import ulid_datetime
+
+logger = logging.getLogger(__name__)
+
+# Index of every result written to an output folder, one JSON object per line
+INDEX_FILENAME = "index.jsonl"
+
+# Folder inside the output folder holding results of thoughts still in progress
+PARTIAL_FOLDER = ".partial"
+
+# Serialises appends to the output index files
+_index_lock = threading.Lock()
+
+# Directories known to exist, so writes can skip makedirs
+_known_dirs = set()
+
+def result_path(output_folder, thought_id, layout="flat", shard_chars=1):
+    """
+    Get the path of a thought's result file.
+    
+    The sharded layout stores results under YYYY/MM/DD/<hash prefix>/ using
+    the creation time encoded in the thought ID, so the path can be found
+    from the ID alone. IDs without a timestamp fall back to the flat layout.
+    
+    Args:
+        output_folder (str): The folder results are written to
+        thought_id (str): The thought ID
+        layout (str): "flat" or "sharded"
+        shard_chars (int): Number of hash characters in the shard directory
+        
+    Returns:
+        str: Path to the result file
+    """
+    output_filename = f"processed_{thought_id}.json"
+    
+    if layout == "sharded":
+        created = ulid_datetime(thought_id.rsplit("_", 1)[-1])
+        if created is not None:
+            parts = [output_folder, f"{created:%Y}", f"{created:%m}", f"{created:%d}"]
+            if shard_chars:
+                parts.append(hashlib.md5(thought_id.encode("utf-8")).hexdigest()[:shard_chars])
+            return os.path.join(*parts, output_filename)
+    
+    return os.path.join(output_folder, output_filename)
+
+def find_result(output_folder, thought_id, shard_chars=1):
+    """
+    Find the result file of a thought in either layout.
+    
+    Returns:
+        str: Path to the result file, or None if it doesn't exist
+    """
+    for layout in ("sharded", "flat"):
+        path = result_path(output_folder, thought_id, layout, shard_chars)
+        if os.path.exists(path):
+            return path
+    return None
+
+def find_result_files(folder):
+    """Yield the result files in an output folder, in either layout."""
+    for root, dirs, files in os.walk(folder):
+        # Results still being generated are not final
+        dirs[:] = [name for name in dirs if not name.startswith(".")]
+        for name in sorted(files):
+            if name.startswith("processed_") and name.endswith(".json"):
+                yield os.path.join(root, name)
+
+def load_index(output_folder):
+    """
+    Load the index of results written to an output folder.
+    
+    Returns:
+        dict: Mapping of thought ID to its index entry
+    """
+    index = {}
+    index_path = os.path.join(output_folder, INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return index
+    
+    with open(index_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            index[entry["id"]] = entry
+    return index
+
+def append_to_index(output_folder, written):
+    """
+    Append written results to the output folder's index.
+    
+    Args:
+        output_folder (str): The folder results are written to
+        written (list): (thought_object, output_path) tuples
+    """
+    lines = []
+    for thought_object, output_path in written:
+        lines.append(json.dumps({
+            "id": thought_object["id"],
+            "path": os.path.relpath(output_path, output_folder),
+            "timestamp": thought_object.get("timestamp"),
+            "original_filename": thought_object.get("original_filename")
+        }) + "\n")
+    
+    with _index_lock:
+        with open(os.path.join(output_folder, INDEX_FILENAME), 'a', encoding='utf-8') as file:
+            file.write("".join(lines))
+
+def serialize_thought(thought_object, compact=False):
+    """
+    Serialize a thought object to JSON bytes, using orjson when available.
+    
+    Args:
+        thought_object (dict): The thought object
+        compact (bool): Leave out indentation
+        
+    Returns:
+        bytes: UTF-8 encoded JSON
+    """
+    if orjson is not None:
+        return orjson.dumps(thought_object, option=0 if compact else orjson.OPT_INDENT_2)
+    return json.dumps(thought_object, indent=None if compact else 2).encode('utf-8')
+
+def ensure_folder(folder):
+    """Create a folder unless it is already known to exist."""
+    if folder not in _known_dirs:
+        os.makedirs(folder, exist_ok=True)
+        _known_dirs.add(folder)
+
+def fsync_folder(folder):
+    """Flush a directory entry to disk so a rename survives a crash."""
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def atomic_write(output_path, data, fsync=False):
+    """
+    Write data to a file via a temporary file and a rename, so readers and
+    crashes never see a partially written file.
+    
+    Args:
+        output_path (str): Destination path
+        data (bytes): File content
+        fsync (bool): Flush the file to disk before renaming it
+    """
+    temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+            if fsync:
+                file.flush()
+                os.fsync(file.fileno())
+        os.replace(temp_path, output_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def write_thought_file(output_path, thought_object, compact=False, fsync=False):
+    """Serialize and atomically write a thought object, creating its folder if needed."""
+    output_dir = os.path.dirname(output_path)
+    data = serialize_thought(thought_object, compact)
+    ensure_folder(output_dir)
+    try:
+        atomic_write(output_path, data, fsync=fsync)
+    except FileNotFoundError:
+        # The folder was removed since it was first created
+        _known_dirs.discard(output_dir)
+        ensure_folder(output_dir)
+        atomic_write(output_path, data, fsync=fsync)
+
+def write_result(thought_object, output_folder, layout="flat", shard_chars=1, compact=False, fsync="never",
+                 store=None):
     """
     Write the processed thought object to a file in the output folder.
     
     Args:
         thought_object (dict): The processed thought object
         output_folder (str): The folder to write the result to
+        layout (str): "flat" or "sharded" (see result_path)
+        shard_chars (int): Number of hash characters in the shard directory
+        compact (bool): Write JSON without indentation
+        fsync (str): "always" to flush the file and its directory to disk,
+            anything else to leave it to the OS
+        store (ResultStore): Store the thought in this database instead
+            of writing a file
         
     Returns:
-        str: Path to the output file
+        str: Path to the output file, or to the database
     """
-    # Create the output folder if it doesn't exist
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+    if store is not None:
+        store.write(thought_object)
+        print(f"Wrote result to: {store.path}")
+        return store.path
     
-    # Create a filename based on the thought ID
-    output_filename = f"processed_{thought_object['id']}.json"
-    output_path = os.path.join(output_folder, output_filename)
+    output_path = result_path(output_folder, thought_object['id'], layout, shard_chars)
     
-    # Write the thought object to a JSON file
-    with open(output_path, 'w', encoding='utf-8') as file:
-        json.dump(thought_object, file, indent=2)
+    # Write the thought object to a JSON file, creating the folder if needed
+    write_thought_file(output_path, thought_object, compact, fsync=fsync != "never")
+    if fsync != "never":
+        fsync_folder(os.path.dirname(output_path))
+    
+    append_to_index(output_folder, [(thought_object, output_path)])
     
     print(f"Wrote result to: {output_path}")
     return output_path
 
+class ResultWriter:
+    """
+    Background writer for processed thoughts.
+    
+    Pipeline workers hand finished thoughts to `submit` and carry on; a
+    writer thread takes them off the queue in batches and writes them
+    atomically, so workers never wait on disk I/O.
+    """
+    
+    def __init__(self, output_folder, layout="flat", shard_chars=1, compact=False,
+                 fsync="batch", batch_size=64, flush_interval=0.5, store=None):
+        """
+        Args:
+            output_folder (str): The folder to write results to
+            layout (str): "flat" or "sharded" (see result_path)
+            shard_chars (int): Number of hash characters in the shard directory
+            compact (bool): Write JSON without indentation
+            fsync (str): "always" flushes every file and its directory,
+                "batch" flushes files and each directory once per batch,
+                "never" leaves flushing to the OS
+            batch_size (int): Maximum number of thoughts written per batch
+            flush_interval (float): Seconds to wait for a batch to fill up
+            store (ResultStore): Store each batch in this database in one
+                transaction instead of writing files
+        """
+        self.output_folder = output_folder
+        self.layout = layout
+        self.shard_chars = shard_chars
+        self.compact = compact
+        self.fsync = fsync
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.store = store
+        
+        self.written_count = 0
+        self.failed_count = 0
+        
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._thread.start()
+    
+    def submit(self, thought_object, on_written=None, on_failed=None):
+        """
+        Queue a processed thought for writing.
+        
+        Args:
+            thought_object (dict): The processed thought object
+            on_written (function): Called with the output path once the file is written
+            on_failed (function): Called with the exception if the thought could not be written
+        """
+        if self._closed:
+            raise RuntimeError("Result writer is closed")
+        if not self._thread.is_alive():
+            raise RuntimeError("Result writer thread has stopped")
+        self._queue.put((thought_object, on_written, on_failed))
+    
+    def flush(self):
+        """Wait until every queued thought has been written."""
+        self._queue.join()
+    
+    def close(self):
+        """Write the remaining thoughts and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+    
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            
+            # Collect more thoughts for the batch while they keep coming
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            
+            # Positions in the batch whose callback has run
+            reported = set()
+            try:
+                self._write_batch(batch, reported)
+            except Exception as e:
+                # Keep the thread alive; everything not yet reported failed
+                logger.error(f"Error writing a batch of {len(batch)} results: {e}")
+                for index, (thought_object, _, on_failed) in enumerate(batch):
+                    if index not in reported:
+                        self.failed_count += 1
+                        self._report_failure(thought_object, on_failed, e)
+            finally:
+                for _ in range(len(batch) + (1 if stop else 0)):
+                    self._queue.task_done()
+            
+            if stop:
+                break
+    
+    def _write_batch(self, batch, reported):
+        """
+        Write a batch of thoughts, then update the index once.
+
+        Adds the position of each thought whose callback has run to
+        `reported`, so that the caller can fail the rest if this raises.
+        """
+        if self.store is not None:
+            self._store_batch(batch)
+            reported.update(range(len(batch)))
+            return
+        
+        written = []
+        callbacks = []
+        folders = set()
+        
+        for index, (thought_object, on_written, on_failed) in enumerate(batch):
+            try:
+                output_path = result_path(self.output_folder, thought_object['id'], self.layout, self.shard_chars)
+                output_dir = os.path.dirname(output_path)
+                write_thought_file(output_path, thought_object, self.compact, fsync=self.fsync != "never")
+                if self.fsync == "always":
+                    fsync_folder(output_dir)
+                folders.add(output_dir)
+                written.append((thought_object, output_path))
+                callbacks.append((index, on_written, output_path))
+            except Exception as e:
+                logger.error(f"Error writing result for {thought_object.get('id', 'unknown')}: {e}")
+                self.failed_count += 1
+                self._report_failure(thought_object, on_failed, e)
+                reported.add(index)
+        
+        if self.fsync == "batch":
+            for folder in folders:
+                fsync_folder(folder)
+        
+        if written:
+            append_to_index(self.output_folder, written)
+            self.written_count += len(written)
+            logger.info(f"Wrote {len(written)} results to {self.output_folder}")
+        
+        for index, on_written, output_path in callbacks:
+            reported.add(index)
+            if on_written is None:
+                continue
+            try:
+                on_written(output_path)
+            except Exception as e:
+                logger.error(f"Error in result callback for {output_path}: {e}")
+
+    def _store_batch(self, batch):
+        """Store a batch of thoughts in the database in one transaction."""
+        try:
+            self.store.write_many([thought_object for thought_object, _, _ in batch])
+        except Exception as e:
+            logger.error(f"Error storing {len(batch)} results in {self.store.path}: {e}")
+            self.failed_count += len(batch)
+            for thought_object, _, on_failed in batch:
+                self._report_failure(thought_object, on_failed, e)
+            return
+        self.written_count += len(batch)
+        logger.info(f"Stored {len(batch)} results in {self.store.path}")
+        
+        for thought_object, on_written, _ in batch:
+            if on_written is None:
+                continue
+            try:
+                on_written(self.store.path)
+            except Exception as e:
+                logger.error(f"Error in result callback for {thought_object.get('id', 'unknown')}: {e}")
+    
+    @staticmethod
+    def _report_failure(thought_object, on_failed, error):
+        if on_failed is None:
+            return
+        try:
+            on_failed(error)
+        except Exception as e:
+            logger.error(f"Error in failure callback for {thought_object.get('id', 'unknown')}: {e}")
+
+class PartialResultWriter:
+    """
+    Writes the stage results of thoughts that are still being generated, so
+    long generations can be followed before the final result is written.
+    
+    Each thought gets one file in the `.partial` folder of the output folder,
+    rewritten at most once per `interval` seconds and removed once the final
+    result is written.
+    """
+    
+    def __init__(self, output_folder, interval=2.0):
+        """
+        Args:
+            output_folder (str): The folder final results are written to
+            interval (float): Minimum seconds between rewrites of one thought's file
+        """
+        self.folder = os.path.join(output_folder, PARTIAL_FOLDER)
+        self.interval = interval
+        self._state = {}
+        self._lock = threading.Lock()
+    
+    def path_for(self, thought_id):
+        """Get the partial result file of a thought."""
+        return os.path.join(self.folder, f"processed_{thought_id}.partial.json")
+    
+    def update(self, thought_object, agent_id, text, force=False):
+        """
+        Record the text generated so far for a stage and rewrite the file if due.
+        
+        Args:
+            thought_object (dict): The thought being processed
+            agent_id (str): The stage generating the text
+            text (str): The response text so far
+            force (bool): Write now regardless of the interval
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._state.setdefault(thought_object["id"], {"stages": {}, "last_write": 0})
+            state["stages"][agent_id] = text
+            if not force and now - state["last_write"] < self.interval:
+                return
+            state["last_write"] = now
+            snapshot = {
+                "id": thought_object["id"],
+                "original_filename": thought_object.get("original_filename"),
+                "updated": datetime.now().isoformat(),
+                "partial_results": dict(state["stages"])
+            }
+        
+        try:
+            write_thought_file(self.path_for(thought_object["id"]), snapshot)
+        except Exception as e:
+            logger.error(f"Error writing partial result for {thought_object['id']}: {e}")
+    
+    def clear(self, thought_id):
+        """Forget a thought and remove its partial result file."""
+        with self._lock:
+            self._state.pop(thought_id, None)
+        try:
+            os.remove(self.path_for(thought_id))
+        except FileNotFoundError:
+            pass
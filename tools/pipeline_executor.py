@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import time
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Sentinel placed on the queue to tell a worker to exit
+_STOP = object()
+
+class PipelineExecutor:
+    """
+    Bounded worker pool that drains captured thoughts through the pipeline.
+
+    The file watcher only enqueues thought objects; worker threads pick them
+    up and run the processing callback, so one slow thought no longer blocks
+    detection of new files.
+    """
+
+    def __init__(self, process_fn, max_workers=4, max_in_flight=16):
+        """
+        Args:
+            process_fn (function): Function called with each thought object
+            max_workers (int): Number of worker threads processing thoughts
+            max_in_flight (int): Maximum number of queued plus running thoughts.
+                `submit` blocks once this limit is reached.
+        """
+        self.process_fn = process_fn
+        self.max_workers = max(1, int(max_workers))
+        self.max_in_flight = max(self.max_workers, int(max_in_flight))
+
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._workers = []
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._idle = threading.Condition(self._lock)
+        self._started = False
+        self._closed = False
+
+        self.processed_count = 0
+        self.failed_count = 0
+
+    def start(self):
+        """Start the worker threads."""
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+
+        for index in range(self.max_workers):
+            worker = threading.Thread(
+                target=self._worker_loop,
+                name=f"thought-worker-{index + 1}",
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+
+        logger.info(f"Started pipeline executor with {self.max_workers} workers "
+                    f"(max {self.max_in_flight} thoughts in flight)")
+        return self
+
+    def submit(self, thought_object, block=True, timeout=None):
+        """
+        Enqueue a thought object for processing.
+
+        Args:
+            thought_object (dict): The thought object to process
+            block (bool): Wait for a free slot when the executor is full
+            timeout (float): Maximum seconds to wait for a free slot
+
+        Returns:
+            bool: True if the thought was enqueued, False otherwise
+        """
+        if self._closed:
+            logger.warning("Pipeline executor is shut down, dropping thought")
+            return False
+
+        if not self._slots.acquire(blocking=block, timeout=timeout if block else None):
+            return False
+
+        with self._lock:
+            self._in_flight += 1
+        self._dispatch(thought_object)
+        return True
+
+    def _dispatch(self, thought_object):
+        """Hand an accepted thought object to the workers."""
+        self._queue.put(thought_object)
+
+    @property
+    def in_flight(self):
+        """Number of thoughts currently queued or being processed."""
+        with self._lock:
+            return self._in_flight
+
+    def join(self, timeout=None):
+        """
+        Wait until every submitted thought has been processed.
+
+        Returns:
+            bool: True if the executor drained, False on timeout
+        """
+        with self._idle:
+            return self._idle.wait_for(lambda: self._in_flight == 0, timeout=timeout)
+
+    def shutdown(self, wait=True):
+        """Stop accepting thoughts and stop the workers once the queue is drained."""
+        self._closed = True
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+    def _worker_loop(self):
+        """Take thoughts off the queue and process them until stopped."""
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            try:
+                self.process_fn(item)
+            except Exception as e:
+                self._finish(item, e)
+                continue
+            self._finish(item)
+
+    def _finish(self, thought_object, error=None):
+        """Record the outcome of a thought and free its slot."""
+        with self._lock:
+            if error is None:
+                self.processed_count += 1
+            else:
+                logger.error(f"Error processing thought {thought_object.get('id', 'unknown')}: {error}")
+                self.failed_count += 1
+        self._slots.release()
+        with self._idle:
+            self._in_flight -= 1
+            self._idle.notify_all()
+
+class BatchPipelineExecutor(PipelineExecutor):
+    """
+    Pipeline executor that hands queued thoughts to the processing callback
+    in batches.
+
+    Each worker takes up to `batch_size` thoughts off the queue, waiting at
+    most `batch_wait` seconds for a batch to fill, so a backlog is processed
+    in large batches while a single new thought is not held back for long.
+    """
+
+    def __init__(self, process_batch_fn, max_workers=1, max_in_flight=64, batch_size=32, batch_wait=0.5):
+        """
+        Args:
+            process_batch_fn (function): Function called with a list of thought objects
+            max_workers (int): Number of worker threads processing batches
+            max_in_flight (int): Maximum number of queued plus running thoughts,
+                raised to at least `batch_size`
+            batch_size (int): Maximum number of thoughts per batch
+            batch_wait (float): Seconds to wait for more thoughts before
+                running a partial batch
+        """
+        self.batch_size = max(1, int(batch_size))
+        self.batch_wait = batch_wait
+        super().__init__(process_batch_fn, max_workers=max_workers,
+                         max_in_flight=max(self.batch_size, int(max_in_flight)))
+
+    def _worker_loop(self):
+        """Take batches of thoughts off the queue and process them until stopped."""
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                self.process_fn(batch)
+            except Exception as e:
+                for thought_object in batch:
+                    self._finish(thought_object, e)
+                continue
+            for thought_object in batch:
+                self._finish(thought_object)
+
+class AffinityPipelineExecutor(PipelineExecutor):
+    """
+    Pipeline executor that runs queued thoughts through an AffinityScheduler.
+
+    One worker keeps every accepted thought in the scheduler and repeatedly
+    runs the next batch of stage work, adding newly queued thoughts between
+    steps. Finished thoughts are passed to the processing callback.
+    """
+
+    def __init__(self, scheduler, process_fn, fail_fn=None, max_in_flight=64):
+        """
+        Args:
+            scheduler (AffinityScheduler): Scheduler the thoughts are run by
+            process_fn (function): Function called with each finished thought object
+            fail_fn (function): Optional function called as fail_fn(thought_object, error)
+                for thoughts whose stages failed
+            max_in_flight (int): Maximum number of queued plus in-progress thoughts
+        """
+        super().__init__(process_fn, max_workers=1, max_in_flight=max_in_flight)
+        self.scheduler = scheduler
+        self.fail_fn = fail_fn
+
+    def _worker_loop(self):
+        """Feed queued thoughts to the scheduler and step it until stopped."""
+        stopping = False
+        while True:
+            if len(self.scheduler) == 0:
+                if stopping:
+                    break
+                # Nothing in progress, so wait for the next thought
+                item = self._queue.get()
+                if item is _STOP:
+                    break
+                self.scheduler.add(item)
+
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                else:
+                    self.scheduler.add(item)
+
+            try:
+                completed, failed = self.scheduler.step()
+            except Exception as e:
+                # The scheduler's state is unknown, so fail its thoughts rather than the worker
+                logger.error(f"Affinity scheduler step failed: {e}")
+                completed, failed = [], [(thought_object, e) for thought_object in self.scheduler.clear()]
+            for thought_object in completed:
+                try:
+                    self.process_fn(thought_object)
+                except Exception as e:
+                    self._fail(thought_object, e)
+                    continue
+                self._finish(thought_object)
+            for thought_object, error in failed:
+                self._fail(thought_object, error)
+
+    def _fail(self, thought_object, error):
+        """Report a failed thought to fail_fn and free its slot."""
+        if self.fail_fn is not None:
+            try:
+                self.fail_fn(thought_object, error)
+            except Exception as e:
+                logger.error(f"Error handling failed thought {thought_object.get('id', 'unknown')}: {e}")
+        self._finish(thought_object, error)
+
+class AsyncPipelineExecutor(PipelineExecutor):
+    """
+    Pipeline executor that runs every thought as a task on one event loop.
+
+    Thoughts spend nearly all of their time waiting on the LLM, so a single
+    loop thread can keep up to `max_in_flight` thoughts in progress without
+    one thread per request.
+    """
+
+    def __init__(self, aprocess_fn, max_in_flight=16):
+        """
+        Args:
+            aprocess_fn (function): Coroutine function called with each thought object
+            max_in_flight (int): Maximum number of thoughts in progress at once
+        """
+        super().__init__(aprocess_fn, max_workers=1, max_in_flight=max_in_flight)
+        self._loop = None
+
+    def start(self):
+        """Start the event loop thread."""
+        with self._lock:
+            if self._started:
+                return self
+            self._started = True
+
+        self._loop = asyncio.new_event_loop()
+        worker = threading.Thread(target=self._loop.run_forever, name="thought-event-loop", daemon=True)
+        worker.start()
+        self._workers.append(worker)
+
+        logger.info(f"Started async pipeline executor (max {self.max_in_flight} thoughts in flight)")
+        return self
+
+    def _dispatch(self, thought_object):
+        """Schedule the thought as a task on the event loop."""
+        asyncio.run_coroutine_threadsafe(self._run(thought_object), self._loop)
+
+    async def _run(self, thought_object):
+        """Process one thought on the event loop."""
+        try:
+            await self.process_fn(thought_object)
+        except Exception as e:
+            self._finish(thought_object, e)
+            return
+        self._finish(thought_object)
+
+    def shutdown(self, wait=True):
+        """Stop accepting thoughts and stop the event loop once they are done."""
+        self._closed = True
+        if self._loop is None:
+            return
+        if wait:
+            self.join()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+            self._loop.close()
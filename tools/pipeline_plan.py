@@ -0,0 +1,178 @@
+import logging
+
+from .stage_scheduler import build_stage_graph
+from .cascade import CascadePolicy
+
+logger = logging.getLogger(__name__)
+
+# Order in which the agents run when their dependencies allow it
+AGENT_PIPELINE = [
+    ("capture", "Capture"),
+    ("contextualize", "Contextualize"),
+    ("clarify", "Clarify"),
+    ("categorize", "Categorize"),
+    ("crystallize", "Crystallize"),
+    ("connect", "Connect")
+]
+
+class Agent:
+    """Agent definition resolved from agents.yaml."""
+
+    def __init__(self, agent_id, role="", goal="", backstory="", llm_config="default", related_thoughts=0):
+        self.agent_id = agent_id
+        self.role = role
+        self.goal = goal
+        self.backstory = backstory
+        self.llm_config = llm_config or "default"
+        self.related_thoughts = related_thoughts or 0
+
+class CompiledTemplate:
+    """
+    Prompt template split around its content placeholder, so filling it in
+    is a single join instead of a search and replace.
+    """
+
+    def __init__(self, template):
+        self.template = template
+        if "{thought_content}" in template:
+            self.parts = template.split("{thought_content}")
+        elif "{{content}}" in template:
+            self.parts = template.split("{{content}}")
+        else:
+            logger.warning("Template doesn't contain a {thought_content} placeholder")
+            self.parts = [template]
+
+    def render(self, content):
+        """Fill in the template with the thought content."""
+        return content.join(self.parts)
+
+def build_system_prompt(agent, instructions):
+    """
+    Build a stage's system prompt from its agent definition and the static
+    instructions of its prompt template.
+
+    The system prompt is the same for every thought, so backends that
+    cache prompt prefixes only process it once.
+    """
+    header = []
+    if agent.role:
+        header.append(f"You are the {agent.role}.")
+    if agent.goal:
+        header.append(f"Your goal: {agent.goal.rstrip('.')}.")
+    if agent.backstory:
+        header.append(agent.backstory)
+    return "\n\n".join(part for part in (" ".join(header), instructions) if part)
+
+class PlannedStage:
+    """One stage of the pipeline with everything resolved ahead of time."""
+
+    def __init__(self, agent_id, agent_name, agent, template, cascade=None,
+                 system_prompt=None, instructions=None):
+        self.agent_id = agent_id
+        self.agent_name = agent_name
+        self.agent = agent
+        self.llm_config = agent.llm_config
+        self.template = template
+        self.cascade = cascade
+        self.system_prompt = system_prompt
+        self.instructions = instructions
+        self.related_thoughts = getattr(agent, "related_thoughts", 0)
+        self.result_key = f"{agent_name.lower()}_results"
+
+    def llm_kwargs(self):
+        """Extra arguments for the LLM call; only set when the stage has a system prompt."""
+        return {"system_prompt": self.system_prompt} if self.system_prompt else {}
+
+class PipelinePlan:
+    """
+    The processing pipeline compiled from the merged configuration.
+
+    Built once at startup and shared by every worker; nothing in it changes
+    while thoughts are being processed.
+    """
+
+    def __init__(self, stages, dependencies, max_parallel=None, stream=False, chunker=None,
+                 thought_sessions=False):
+        self.stages = stages
+        self.dependencies = dependencies
+        self.max_parallel = max_parallel
+        self.stream = stream
+        self.chunker = chunker
+        self.thought_sessions = thought_sessions
+        self.stage_order = [(stage.agent_id, stage.agent_name) for stage in stages]
+        self._by_id = {stage.agent_id: stage for stage in stages}
+
+    def get(self, agent_id):
+        """Get the planned stage for an agent ID."""
+        return self._by_id[agent_id]
+
+    def session_configs(self, skip=()):
+        """LLM configs of the stages that can send their prompts in a thought session."""
+        return [stage.llm_config for stage in self.stages
+                if stage.template is not None and stage.cascade is None and not stage.related_thoughts
+                and stage.agent_id not in skip]
+
+def build_pipeline_plan(config):
+    """
+    Compile the pipeline plan from the merged configuration.
+
+    Args:
+        config (dict): Merged configuration from load_configs
+
+    Returns:
+        PipelinePlan: The compiled plan
+    """
+    agents_config = config.get("agents", {})
+    prompts = config.get("prompts", {})
+
+    stages = []
+    for agent_id, agent_name in AGENT_PIPELINE:
+        if agent_id not in agents_config:
+            continue
+
+        agent_config = agents_config.get(agent_id) or {}
+        agent = Agent(
+            agent_id,
+            role=agent_config.get("role", ""),
+            goal=agent_config.get("goal", ""),
+            backstory=agent_config.get("backstory", ""),
+            llm_config=agent_config.get("llm_config", "default"),
+            related_thoughts=agent_config.get("related_thoughts", 0)
+        )
+
+        template = prompts.get(f"{agent_id}_prompt_template")
+        system_prompt = instructions = None
+        if template is None:
+            logger.warning(f"No prompt template found for {agent_id}, stage will skip the LLM call")
+        elif isinstance(template, dict):
+            # Split template: static instructions go to the system prompt,
+            # the user prompt carries the thought content
+            instructions = template.get("system", "")
+            system_prompt = build_system_prompt(agent, instructions)
+            template = template.get("user", "{thought_content}")
+
+        stages.append(PlannedStage(
+            agent_id,
+            agent_name,
+            agent,
+            CompiledTemplate(template) if template is not None else None,
+            cascade=CascadePolicy.from_config(agent_config.get("cascade")),
+            system_prompt=system_prompt,
+            instructions=instructions
+        ))
+
+    from .chunking import build_chunker
+
+    dependencies = build_stage_graph(AGENT_PIPELINE, agents_config)
+    pipeline_settings = config.get("pipeline", {})
+    plan = PipelinePlan(
+        stages,
+        dependencies,
+        max_parallel=pipeline_settings.get("max_parallel_stages"),
+        stream=pipeline_settings.get("stream", False),
+        chunker=build_chunker(config.get("chunking", {}), prompts),
+        thought_sessions=pipeline_settings.get("thought_sessions", False)
+    )
+
+    logger.info(f"Compiled pipeline plan with stages: {[stage.agent_id for stage in stages]}")
+    return plan
@@ -0,0 +1,135 @@
+"""
+Query the processed thoughts stored in the SQLite results database.
+
+Usage:
+    python -m tools.query_cli search "tomato AND garden" [--agent connect] [--limit 20]
+    python -m tools.query_cli show <thought id>
+    python -m tools.query_cli recent [--limit 20]
+    python -m tools.query_cli stats
+    python -m tools.query_cli import [--folder 6-Connect]
+
+The database is found from config/system.yaml (output.database inside the
+connect folder) unless --db is given.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import yaml
+
+from .output_writer import find_result_files
+from .result_store import ResultStore
+
+# Thoughts stored per transaction when importing result files
+IMPORT_BATCH_SIZE = 500
+
+def load_system_config(path):
+    """Load the system config, or an empty one if it can't be read."""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return yaml.safe_load(file) or {}
+    except (OSError, yaml.YAMLError) as e:
+        print(f"Could not read {path}: {e}")
+        return {}
+
+def get_paths(system_config):
+    """Get the output folder and the database path from the system config."""
+    folders = system_config.get("folders", {})
+    output_folder = os.path.join(folders.get("base", ""), folders.get("connect", "6-Connect"))
+    database = (system_config.get("output") or {}).get("database", "thoughts.db")
+    return output_folder, os.path.join(output_folder, database)
+
+def import_folder(store, folder):
+    """
+    Store every result file of an output folder in the database.
+
+    Returns:
+        int: Thoughts imported
+    """
+    imported = 0
+    batch = []
+    for path in find_result_files(folder):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                batch.append(json.load(file))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        if len(batch) == IMPORT_BATCH_SIZE:
+            store.write_many(batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        store.write_many(batch)
+        imported += len(batch)
+    return imported
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m tools.query_cli", description="Query processed thoughts.")
+    parser.add_argument("--config", default="config/system.yaml", help="System config used to find the database")
+    parser.add_argument("--db", help="Database file, overriding the config")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="Full-text search over content and stage results")
+    search.add_argument("query", help="FTS5 query, e.g. 'tomato AND garden' or '\"exact phrase\"'")
+    search.add_argument("--agent", help="Only search this agent's results, or 'content'")
+    search.add_argument("--limit", type=int, default=20)
+
+    show = commands.add_parser("show", help="Print a stored thought as JSON")
+    show.add_argument("thought_id")
+
+    recent = commands.add_parser("recent", help="List the most recently processed thoughts")
+    recent.add_argument("--limit", type=int, default=20)
+
+    commands.add_parser("stats", help="Count the stored thoughts and stage results")
+
+    import_command = commands.add_parser("import", help="Store existing result files in the database")
+    import_command.add_argument("--folder", help="Output folder to import, by default the connect folder")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    output_folder, database = get_paths(load_system_config(args.config))
+    database = args.db or database
+
+    if args.command != "import" and not os.path.exists(database):
+        print(f"No results database at {database}; set output.backend to \"sqlite\" or run the import command")
+        return 1
+    store = ResultStore(database)
+
+    if args.command == "search":
+        start = time.perf_counter()
+        try:
+            matches = store.search(args.query, limit=args.limit, agent=args.agent)
+        except ValueError as e:
+            print(e)
+            return 1
+        elapsed = (time.perf_counter() - start) * 1000
+        for match in matches:
+            print(f"{match['id']}  {match['field']:<13} {match['original_filename'] or ''}")
+            print(f"    {match['snippet']}")
+        print(f"{len(matches)} matches in {elapsed:.1f} ms")
+    elif args.command == "show":
+        thought_object = store.get(args.thought_id)
+        if thought_object is None:
+            print(f"No thought {args.thought_id}")
+            return 1
+        print(json.dumps(thought_object, indent=2))
+    elif args.command == "recent":
+        for entry in store.recent(args.limit):
+            print(f"{entry['id']}  {entry['timestamp'] or '':<26} {entry['original_filename'] or ''}")
+    elif args.command == "stats":
+        stats = store.stats()
+        print(f"{stats['thoughts']} thoughts, {stats['stage_results']} stage results in {database}"
+              f"{'' if stats['full_text'] else ' (no full-text index)'}")
+    elif args.command == "import":
+        folder = args.folder or output_folder
+        start = time.perf_counter()
+        imported = import_folder(store, folder)
+        print(f"Imported {imported} thoughts from {folder} in {time.perf_counter() - start:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import os
+import json
+import logging
+import threading
+
+from adapters import LLMError
+from .output_writer import load_index, find_result_files
+from .vector_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+# Thoughts embedded per request when indexing processed thoughts
+INDEX_BATCH_SIZE = 32
+
+class RelatedThoughts:
+    """
+    Finds processed thoughts related to a new one, so the Connect stage can
+    link to thoughts that exist instead of inventing them.
+
+    Processed thoughts are embedded into a persistent VectorIndex. A stage
+    with `related_thoughts` set gets the most similar ones appended to the
+    thought content in its prompt, and the matches are recorded in the
+    thought's `related_thoughts`.
+    """
+
+    def __init__(self, embed, index, max_chars=8000, snippet_chars=300, min_score=0.3):
+        """
+        Args:
+            embed (function): Returns the embedding vectors of a list of
+                texts, raising LLMError on failure
+            index (VectorIndex): Index of the processed thoughts
+            max_chars (int): Content beyond this length is not embedded
+            snippet_chars (int): Characters of a related thought shown in prompts
+            min_score (float): Minimum cosine similarity of a related thought
+        """
+        self.embed = embed
+        self.index = index
+        self.max_chars = max_chars
+        self.snippet_chars = snippet_chars
+        self.min_score = min_score
+
+        # Vectors of thoughts being processed, kept for indexing them afterwards
+        self._vectors = {}
+        self._lock = threading.Lock()
+
+        self.lookups = 0
+        self.found = 0
+
+    def _entry(self, thought_object):
+        content = " ".join(thought_object.get("content", "").split())
+        return {
+            "id": thought_object["id"],
+            "original_filename": thought_object.get("original_filename"),
+            "snippet": content[:self.snippet_chars]
+        }
+
+    def _embed(self, thought_object):
+        with self._lock:
+            vector = self._vectors.get(thought_object["id"])
+        if vector is None:
+            vector = self.embed([thought_object["content"][:self.max_chars]])[0]
+            with self._lock:
+                self._vectors[thought_object["id"]] = vector
+        return vector
+
+    def remember(self, thought_object, vector):
+        """Keep a thought's vector, computed elsewhere, for find and add."""
+        with self._lock:
+            self._vectors[thought_object["id"]] = vector
+
+    def find(self, thought_object, k):
+        """
+        Find the processed thoughts most similar to a thought.
+
+        The matches are recorded in the thought's `related_thoughts`.
+
+        Returns:
+            list: (entry, similarity) tuples, most similar first; empty if
+                the thought could not be embedded
+        """
+        try:
+            vector = self._embed(thought_object)
+        except LLMError as e:
+            logger.warning(f"Could not embed thought, processing it without related thoughts: {e}")
+            return []
+
+        matches = [(entry, score) for entry, score in self.index.search(vector, k, exclude={thought_object["id"]})[0]
+                   if score >= self.min_score]
+        with self._lock:
+            self.lookups += 1
+            self.found += len(matches)
+        thought_object["related_thoughts"] = [{"id": entry["id"], "similarity": round(score, 4)}
+                                              for entry, score in matches]
+        return matches
+
+    def with_related(self, thought_object, k):
+        """
+        Get the thought content followed by its related thoughts.
+
+        Returns:
+            str: The content for the stage prompt
+        """
+        matches = self.find(thought_object, k)
+        if not matches:
+            return thought_object["content"]
+        lines = ["", "", "Related thoughts already in the archive (most similar first):"]
+        for number, (entry, score) in enumerate(matches, 1):
+            name = entry.get("original_filename") or entry["id"]
+            lines.append(f"{number}. [{entry['id']}] {name} (similarity {score:.2f}): {entry['snippet']}")
+        return thought_object["content"] + "\n".join(lines)
+
+    def add(self, thought_object):
+        """Index a processed thought, reusing its vector from find when there is one."""
+        if thought_object.get("stage_errors") or thought_object["id"] in self.index:
+            with self._lock:
+                self._vectors.pop(thought_object["id"], None)
+            return
+        try:
+            vector = self._embed(thought_object)
+        except LLMError as e:
+            logger.warning(f"Could not index thought {thought_object['id']}: {e}")
+            return
+        finally:
+            with self._lock:
+                self._vectors.pop(thought_object["id"], None)
+        try:
+            self.index.add([vector], [self._entry(thought_object)])
+        except ValueError as e:
+            # Vectors from a different embedding model
+            logger.warning(f"Could not index thought {thought_object['id']}: {e}")
+
+    def index_thoughts(self, thought_objects):
+        """
+        Index processed thoughts that are not indexed yet, embedding them in batches.
+
+        Returns:
+            int: Thoughts added to the index
+        """
+        added = 0
+        batch = []
+        for thought_object in thought_objects:
+            if thought_object["id"] in self.index or not thought_object.get("content") \
+                    or thought_object.get("stage_errors"):
+                continue
+            batch.append(thought_object)
+            if len(batch) == INDEX_BATCH_SIZE:
+                if not self._index_batch(batch):
+                    return added
+                added += len(batch)
+                batch = []
+        if batch and self._index_batch(batch):
+            added += len(batch)
+        if added:
+            logger.info(f"Indexed {added} processed thoughts")
+        return added
+
+    def _index_batch(self, thought_objects):
+        try:
+            vectors = self.embed([thought_object["content"][:self.max_chars] for thought_object in thought_objects])
+            self.index.add(vectors, [self._entry(thought_object) for thought_object in thought_objects])
+        except (LLMError, ValueError) as e:
+            logger.warning(f"Stopped indexing processed thoughts: {e}")
+            return False
+        return True
+
+    def index_folder(self, output_folder):
+        """
+        Index the processed thoughts in an output folder that are not indexed yet.
+
+        Thoughts are found through the folder's index, and result files
+        written before there was one by scanning the folder.
+
+        Returns:
+            int: Thoughts added to the index
+        """
+        def read(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    return json.load(file)
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Could not read {path} for the related thoughts index: {e}")
+                return None
+
+        def read_thoughts():
+            listed = load_index(output_folder)
+            for thought_id, entry in listed.items():
+                if thought_id not in self.index:
+                    thought_object = read(os.path.join(output_folder, entry["path"]))
+                    if thought_object is not None:
+                        yield thought_object
+            for path in find_result_files(output_folder):
+                thought_id = os.path.basename(path)[len("processed_"):-len(".json")]
+                if thought_id not in listed and thought_id not in self.index:
+                    thought_object = read(path)
+                    if thought_object is not None:
+                        yield thought_object
+
+        return self.index_thoughts(read_thoughts())
+
+    def stats(self):
+        """Index size and lookup counters."""
+        with self._lock:
+            return {"entries": len(self.index), "lookups": self.lookups, "found": self.found}
+
+def build_related_thoughts(settings, embed):
+    """
+    Build the related thoughts index from the `related_thoughts` system settings.
+
+    Returns:
+        RelatedThoughts: The index, or None if disabled
+    """
+    if not settings or not settings.get("enabled", False):
+        return None
+    index = VectorIndex(
+        path=settings.get("path"),
+        nlist=settings.get("nlist"),
+        nprobe=settings.get("nprobe", 8),
+        ivf_min_rows=settings.get("ivf_min_rows", 20000)
+    )
+    return RelatedThoughts(
+        embed,
+        index,
+        max_chars=settings.get("max_chars", 8000),
+        snippet_chars=settings.get("snippet_chars", 300),
+        min_score=settings.get("min_score", 0.3)
+    )
@@ -0,0 +1,472 @@
+import time
+import queue
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from adapters import LLMError, LLMTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Requests with a deadline or hedging run here, so the caller can stop
+# waiting for them; the client timeout bounds how long they keep running.
+# Deadlines start when a request leaves the pool's queue, so time spent
+# waiting for a thread is not counted against it.
+_call_pool = None
+_call_pool_lock = threading.Lock()
+
+def _get_call_pool():
+    global _call_pool
+    with _call_pool_lock:
+        if _call_pool is None:
+            _call_pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm-call")
+        return _call_pool
+
+# Mark the start and the end of a stream passed between threads
+_START_OF_STREAM = object()
+_END_OF_STREAM = object()
+
+def _mark_started(started):
+    """Record when the first of an attempt's requests began running."""
+    try:
+        started.set_result(time.monotonic())
+    except InvalidStateError:
+        # A hedged request began after the first one
+        pass
+
+class CircuitOpenError(LLMError):
+    """Raised instead of calling a backend whose circuit breaker is open."""
+
+class LatencyTracker:
+    """Rolling window of successful request latencies."""
+
+    def __init__(self, window=200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent, min_samples=20):
+        """
+        Get a latency percentile in seconds.
+
+        Returns:
+            float: The percentile, or None until min_samples requests completed
+        """
+        with self._lock:
+            if len(self._samples) < min_samples:
+                return None
+            samples = sorted(self._samples)
+        index = min(len(samples) - 1, int(len(samples) * percent / 100))
+        return samples[index]
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a backend that keeps failing.
+
+    After `failure_threshold` failed calls in a row the breaker opens and
+    calls are refused for `reset_seconds`. Then one trial call is let
+    through: if it succeeds the breaker closes, otherwise it opens again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_seconds=60.0, clock=time.monotonic):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Check whether a call may be made now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self._opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("Circuit breaker closed after a successful trial call")
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit breaker opened after {self._failures} failed calls")
+                self.state = self.OPEN
+                self._opened_at = self.clock()
+
+class CallPolicy:
+    """
+    Timeout, retry, hedging and circuit breaker settings of one LLM config.
+
+    Each attempt is bounded by `timeout`. Failed attempts are retried up
+    to `retries` times with exponential backoff and full jitter. With
+    hedging enabled, a second identical request is started when the first
+    has not answered within the p95 latency seen so far (or a fixed
+    `hedge_after_ms`), and whichever answers first is used. Streams get
+    the same deadline and retries, and must also produce their first
+    chunk within `first_chunk_timeout` and each further chunk within
+    `idle_timeout`; they are not hedged.
+    """
+
+    def __init__(self, name, timeout=None, retries=0, backoff=1.0, backoff_max=30.0,
+                 hedge=False, hedge_after_ms=None, hedge_percentile=95, breaker=None,
+                 first_chunk_timeout=None, idle_timeout=None):
+        """
+        Args:
+            name (str): The LLM config name, for logging
+            timeout (float): Seconds to wait for one attempt, or None to wait indefinitely
+            retries (int): Additional attempts after a failed one
+            backoff (float): Base delay in seconds before the first retry
+            backoff_max (float): Maximum delay between retries
+            hedge (bool): Start a second request when the first is slow
+            hedge_after_ms (float): Fixed hedging delay instead of the observed percentile
+            hedge_percentile (float): Latency percentile after which to hedge
+            breaker (CircuitBreaker): Breaker guarding the backend, or None
+            first_chunk_timeout (float): Seconds a stream may take to send its
+                first chunk, or None for just the timeout
+            idle_timeout (float): Seconds a stream may pause between chunks,
+                or None for just the timeout
+        """
+        self.name = name
+        self.timeout = timeout
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.hedge = hedge
+        self.hedge_after_ms = hedge_after_ms
+        self.hedge_percentile = hedge_percentile
+        self.breaker = breaker
+        self.first_chunk_timeout = first_chunk_timeout
+        self.idle_timeout = idle_timeout
+        self.latency = LatencyTracker()
+
+        self.retry_count = 0
+        self.hedge_count = 0
+        self.timeout_count = 0
+
+    @classmethod
+    def from_config(cls, name, config):
+        """
+        Build the policy from an llm_configs entry.
+
+        Reads timeout, retries, retry_backoff, retry_backoff_max,
+        hedge, hedge_after_ms, hedge_percentile, first_chunk_timeout,
+        idle_timeout and circuit_breaker (failure_threshold, reset_seconds).
+        """
+        breaker = None
+        breaker_settings = config.get("circuit_breaker")
+        if breaker_settings:
+            if not isinstance(breaker_settings, dict):
+                breaker_settings = {}
+            breaker = CircuitBreaker(
+                failure_threshold=breaker_settings.get("failure_threshold", 5),
+                reset_seconds=breaker_settings.get("reset_seconds", 60.0)
+            )
+
+        return cls(
+            name,
+            timeout=config.get("timeout"),
+            retries=config.get("retries", 0),
+            backoff=config.get("retry_backoff", 1.0),
+            backoff_max=config.get("retry_backoff_max", 30.0),
+            hedge=config.get("hedge", False),
+            hedge_after_ms=config.get("hedge_after_ms"),
+            hedge_percentile=config.get("hedge_percentile", 95),
+            breaker=breaker,
+            first_chunk_timeout=config.get("first_chunk_timeout"),
+            idle_timeout=config.get("idle_timeout")
+        )
+
+    def backoff_delay(self, attempt):
+        """Delay before retry number `attempt` (0-based), with full jitter."""
+        return random.uniform(0, min(self.backoff_max, self.backoff * (2 ** attempt)))
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None if no hedge should be sent."""
+        if not self.hedge:
+            return None
+        if self.hedge_after_ms is not None:
+            return self.hedge_after_ms / 1000
+        return self.latency.percentile(self.hedge_percentile)
+
+    def check_breaker(self):
+        """Raise CircuitOpenError if the breaker refuses calls."""
+        if self.breaker is not None and not self.breaker.allow():
+            raise CircuitOpenError(f"Circuit breaker for LLM config '{self.name}' is open")
+
+    def record_outcome(self, success):
+        """Report the outcome of a call made outside `call`, e.g. a stream."""
+        if self.breaker is not None:
+            if success:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def call(self, fn):
+        """
+        Call `fn` under this policy.
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+            LLMError: If every attempt failed
+        """
+        self.check_breaker()
+
+        for attempt in range(self.retries + 1):
+            try:
+                result = self._attempt(fn)
+            except LLMError as e:
+                if attempt == self.retries:
+                    self.record_outcome(False)
+                    raise
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"Request to LLM config '{self.name}' failed ({e}), "
+                               f"retrying in {delay:.2f}s")
+                self.retry_count += 1
+                time.sleep(delay)
+                continue
+            self.record_outcome(True)
+            return result
+
+    def _attempt(self, fn):
+        """Run one attempt, with its deadline and hedged request."""
+        start = time.monotonic()
+        hedge_delay = self.hedge_delay()
+        if self.timeout is None and hedge_delay is None:
+            result = fn()
+            self.latency.record(time.monotonic() - start)
+            return result
+
+        pool = _get_call_pool()
+        started = Future()
+
+        def run():
+            _mark_started(started)
+            return fn()
+
+        running = {pool.submit(run)}
+        deadline = hedge_at = None
+        timed = False
+        error = None
+
+        while running:
+            if not timed and started.done():
+                timed = True
+                start = started.result()
+                deadline = None if self.timeout is None else start + self.timeout
+                hedge_at = None if hedge_delay is None else start + hedge_delay
+            if timed:
+                wake = [moment for moment in (deadline, hedge_at) if moment is not None]
+                timeout = max(0, min(wake) - time.monotonic()) if wake else None
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                # Still queued; wait for it to begin before timing it
+                done, _ = wait(running | {started}, return_when=FIRST_COMPLETED)
+                done.discard(started)
+            running -= done
+
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                self.latency.record(time.monotonic() - start)
+                return result
+
+            now = time.monotonic()
+            if hedge_at is not None and now >= hedge_at:
+                hedge_at = None
+                if running:
+                    logger.info(f"Hedging slow request to LLM config '{self.name}'")
+                    self.hedge_count += 1
+                    running.add(pool.submit(run))
+            if deadline is not None and now >= deadline and running:
+                self.timeout_count += 1
+                raise LLMTimeoutError(f"LLM config '{self.name}' did not answer within {self.timeout}s")
+
+        raise error
+
+    def stream(self, fn):
+        """
+        Yield the chunks of the stream returned by `fn` under this policy.
+
+        An attempt that fails before its first chunk is retried like a
+        call. Once a chunk was yielded, a failure is raised as it is, since
+        the text already handed out cannot be replaced.
+
+        Raises:
+            CircuitOpenError: If the breaker is open
+            LLMError: If every attempt failed, or the stream broke off
+        """
+        self.check_breaker()
+
+        for attempt in range(self.retries + 1):
+            started = False
+            try:
+                for chunk in self._stream_attempt(fn):
+                    started = True
+                    yield chunk
+            except LLMError as e:
+                if started or attempt == self.retries:
+                    self.record_outcome(False)
+                    raise
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"Stream from LLM config '{self.name}' failed ({e}), "
+                               f"retrying in {delay:.2f}s")
+                self.retry_count += 1
+                time.sleep(delay)
+                continue
+            self.record_outcome(True)
+            return
+
+    def _stream_attempt(self, fn):
+        """Run one streamed attempt, with its deadline, first chunk and idle timeouts."""
+        first_chunk_timeout = self.first_chunk_timeout or self.timeout
+        idle_timeout = self.idle_timeout or self.timeout
+        if first_chunk_timeout is None and idle_timeout is None:
+            yield from fn()
+            return
+
+        # The stream is read on a pool thread, so waiting for a chunk can time out
+        chunks = queue.Queue()
+        abandoned = threading.Event()
+
+        def read():
+            chunks.put((_START_OF_STREAM, None))
+            try:
+                for chunk in fn():
+                    if abandoned.is_set():
+                        return
+                    chunks.put((chunk, None))
+                chunks.put((_END_OF_STREAM, None))
+            except Exception as e:
+                chunks.put((None, e))
+
+        _get_call_pool().submit(read)
+        first = True
+        try:
+            # Time the attempt from when it begins running, not while it is queued
+            chunks.get()
+            start = time.monotonic()
+            deadline = None if self.timeout is None else start + self.timeout
+            while True:
+                wait_for = first_chunk_timeout if first else idle_timeout
+                if deadline is not None:
+                    remaining = max(0, deadline - time.monotonic())
+                    wait_for = remaining if wait_for is None else min(wait_for, remaining)
+                try:
+                    chunk, error = chunks.get(timeout=wait_for)
+                except queue.Empty:
+                    self.timeout_count += 1
+                    if deadline is not None and time.monotonic() >= deadline:
+                        raise LLMTimeoutError(f"LLM config '{self.name}' did not finish streaming "
+                                              f"within {self.timeout}s")
+                    waited = "its first chunk" if first else "a chunk"
+                    raise LLMTimeoutError(f"LLM config '{self.name}' sent no {waited} within {wait_for}s")
+                if error is not None:
+                    raise error
+                if chunk is _END_OF_STREAM:
+                    self.latency.record(time.monotonic() - start)
+                    return
+                first = False
+                yield chunk
+        finally:
+            abandoned.set()
+
+    async def acall(self, afn):
+        """Async version of call; `afn` is a coroutine function."""
+        self.check_breaker()
+
+        for attempt in range(self.retries + 1):
+            try:
+                result = await self._aattempt(afn)
+            except LLMError as e:
+                if attempt == self.retries:
+                    self.record_outcome(False)
+                    raise
+                delay = self.backoff_delay(attempt)
+                logger.warning(f"Request to LLM config '{self.name}' failed ({e}), "
+                               f"retrying in {delay:.2f}s")
+                self.retry_count += 1
+                await asyncio.sleep(delay)
+                continue
+            self.record_outcome(True)
+            return result
+
+    async def _aattempt(self, afn):
+        """Async version of _attempt; slower requests are cancelled."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        hedge_delay = self.hedge_delay()
+        running = {asyncio.ensure_future(afn())}
+        deadline = None if self.timeout is None else start + self.timeout
+        hedge_at = None if hedge_delay is None else start + hedge_delay
+        error = None
+
+        try:
+            while running:
+                wake = [moment for moment in (deadline, hedge_at) if moment is not None]
+                timeout = max(0, min(wake) - loop.time()) if wake else None
+                done, running = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    self.latency.record(loop.time() - start)
+                    return result
+
+                now = loop.time()
+                if hedge_at is not None and now >= hedge_at:
+                    hedge_at = None
+                    if running:
+                        logger.info(f"Hedging slow request to LLM config '{self.name}'")
+                        self.hedge_count += 1
+                        running.add(asyncio.ensure_future(afn()))
+                if deadline is not None and now >= deadline and running:
+                    self.timeout_count += 1
+                    raise LLMTimeoutError(f"LLM config '{self.name}' did not answer within {self.timeout}s")
+        finally:
+            for task in running:
+                task.cancel()
+
+        raise error
+
+    def stats(self):
+        """Retry, hedge and timeout counters."""
+        p95 = self.latency.percentile(95)
+        return {
+            "retries": self.retry_count,
+            "hedges": self.hedge_count,
+            "timeouts": self.timeout_count,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "breaker": self.breaker.state if self.breaker is not None else None
+        }
@@ -0,0 +1,279 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS thoughts (
+    pk INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    timestamp TEXT,
+    original_filename TEXT,
+    original_path TEXT,
+    content_hash TEXT,
+    processing_stage TEXT,
+    content TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS thoughts_timestamp ON thoughts (timestamp);
+CREATE INDEX IF NOT EXISTS thoughts_content_hash ON thoughts (content_hash);
+
+CREATE TABLE IF NOT EXISTS stage_results (
+    pk INTEGER PRIMARY KEY,
+    thought_id TEXT NOT NULL,
+    agent TEXT NOT NULL,
+    result TEXT,
+    UNIQUE (thought_id, agent)
+);
+
+CREATE TABLE IF NOT EXISTS history (
+    thought_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    stage TEXT,
+    timestamp TEXT,
+    PRIMARY KEY (thought_id, seq)
+);
+"""
+
+# External content FTS5 tables, kept in sync with their tables by triggers.
+# The explicit pk columns keep rowids stable across VACUUM.
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS thoughts_fts USING fts5(
+    content, content='thoughts', content_rowid='pk'
+);
+CREATE TRIGGER IF NOT EXISTS thoughts_fts_insert AFTER INSERT ON thoughts BEGIN
+    INSERT INTO thoughts_fts (rowid, content) VALUES (new.pk, new.content);
+END;
+CREATE TRIGGER IF NOT EXISTS thoughts_fts_delete AFTER DELETE ON thoughts BEGIN
+    INSERT INTO thoughts_fts (thoughts_fts, rowid, content) VALUES ('delete', old.pk, old.content);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS stage_results_fts USING fts5(
+    result, agent UNINDEXED, content='stage_results', content_rowid='pk'
+);
+CREATE TRIGGER IF NOT EXISTS stage_results_fts_insert AFTER INSERT ON stage_results BEGIN
+    INSERT INTO stage_results_fts (rowid, result, agent) VALUES (new.pk, new.result, new.agent);
+END;
+CREATE TRIGGER IF NOT EXISTS stage_results_fts_delete AFTER DELETE ON stage_results BEGIN
+    INSERT INTO stage_results_fts (stage_results_fts, rowid, result, agent)
+        VALUES ('delete', old.pk, old.result, old.agent);
+END;
+"""
+
+RESULTS_SUFFIX = "_results"
+
+class ResultStore:
+    """
+    SQLite database of processed thoughts, an alternative to one JSON file
+    per thought.
+
+    Each thought is a row in `thoughts`, holding the searchable fields and
+    the full thought object as JSON; its stage results and processing
+    history are rows in `stage_results` and `history`. FTS5 indexes over
+    the content and the stage results make full-text search a single
+    query. The database runs in WAL mode, so the query CLI can read while
+    the pipeline writes, and write_many stores a batch in one transaction.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The database file
+        """
+        self.path = path
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        try:
+            connection.executescript(FTS_SCHEMA)
+            self.full_text = True
+        except sqlite3.OperationalError as e:
+            # SQLite built without FTS5; search falls back to LIKE
+            logger.warning(f"Full-text search unavailable in {path}: {e}")
+            self.full_text = False
+
+    def _connection(self):
+        """The calling thread's connection; SQLite connections are not shared between threads."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def close(self):
+        """Close the calling thread's connection."""
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+    def write(self, thought_object):
+        """Store a processed thought, replacing an earlier version."""
+        self.write_many([thought_object])
+
+    def write_many(self, thought_objects):
+        """Store several processed thoughts in one transaction."""
+        connection = self._connection()
+        with self._write_lock, connection:
+            for thought_object in thought_objects:
+                thought_id = thought_object["id"]
+                # Deleting fires the FTS triggers, which a REPLACE would not
+                connection.execute("DELETE FROM thoughts WHERE id = ?", (thought_id,))
+                connection.execute("DELETE FROM stage_results WHERE thought_id = ?", (thought_id,))
+                connection.execute("DELETE FROM history WHERE thought_id = ?", (thought_id,))
+                connection.execute(
+                    "INSERT INTO thoughts (id, timestamp, original_filename, original_path, content_hash, "
+                    "processing_stage, content, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thought_id, thought_object.get("timestamp"), thought_object.get("original_filename"),
+                     thought_object.get("original_path"), thought_object.get("content_hash"),
+                     thought_object.get("processing_stage"), thought_object.get("content"),
+                     json.dumps(thought_object))
+                )
+                connection.executemany(
+                    "INSERT INTO stage_results (thought_id, agent, result) VALUES (?, ?, ?)",
+                    [(thought_id, key[:-len(RESULTS_SUFFIX)], value if isinstance(value, str) else json.dumps(value))
+                     for key, value in thought_object.items()
+                     if key.endswith(RESULTS_SUFFIX) and value is not None]
+                )
+                connection.executemany(
+                    "INSERT INTO history (thought_id, seq, stage, timestamp) VALUES (?, ?, ?, ?)",
+                    [(thought_id, seq, entry.get("stage"), entry.get("timestamp"))
+                     for seq, entry in enumerate(thought_object.get("processing_history", []))]
+                )
+
+    def get(self, thought_id):
+        """
+        Load a processed thought.
+
+        Returns:
+            dict: The thought object, or None if it isn't stored
+        """
+        row = self._connection().execute("SELECT data FROM thoughts WHERE id = ?", (thought_id,)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def __contains__(self, thought_id):
+        return self._connection().execute("SELECT 1 FROM thoughts WHERE id = ?", (thought_id,)).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM thoughts").fetchone()[0]
+
+    def iter_thoughts(self, batch_size=500):
+        """Yield every stored thought object, oldest first."""
+        cursor = self._connection().execute("SELECT data FROM thoughts ORDER BY pk")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row["data"])
+
+    def recent(self, limit=20):
+        """
+        List the most recently processed thoughts.
+
+        Returns:
+            list: Dicts with id, timestamp, original_filename and processing_stage
+        """
+        rows = self._connection().execute(
+            "SELECT id, timestamp, original_filename, processing_stage FROM thoughts "
+            "ORDER BY timestamp DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def search(self, query, limit=20, agent=None):
+        """
+        Full-text search over thought content and stage results.
+
+        Args:
+            query (str): FTS5 query, e.g. `tomato AND garden` or `"exact phrase"`
+            limit (int): Maximum number of matches
+            agent (str): Only search this agent's stage results, or
+                "content" for only the thought content
+
+        Returns:
+            list: Dicts with id, original_filename, timestamp, field (the
+                matching agent or "content") and a snippet, best match first
+
+        Raises:
+            ValueError: If the query is not valid FTS5 syntax
+        """
+        if not self.full_text:
+            return self._search_like(query, limit, agent)
+
+        # Each index ranks and limits its own matches before any join
+        parts, params = [], []
+        if agent in (None, "content"):
+            parts.append(
+                "SELECT t.id, t.original_filename, t.timestamp, 'content' AS field, f.snippet, f.rank "
+                "FROM (SELECT rowid, rank, snippet(thoughts_fts, 0, '[', ']', '...', 12) AS snippet "
+                "FROM thoughts_fts WHERE thoughts_fts MATCH ? ORDER BY rank LIMIT ?) f "
+                "JOIN thoughts t ON t.pk = f.rowid"
+            )
+            params += [query, limit]
+        if agent != "content":
+            parts.append(
+                "SELECT t.id, t.original_filename, t.timestamp, s.agent AS field, f.snippet, f.rank "
+                "FROM (SELECT rowid, rank, snippet(stage_results_fts, 0, '[', ']', '...', 12) AS snippet "
+                "FROM stage_results_fts WHERE stage_results_fts MATCH ?"
+                + (" AND agent = ?" if agent else "") + " ORDER BY rank LIMIT ?) f "
+                "JOIN stage_results s ON s.pk = f.rowid JOIN thoughts t ON t.id = s.thought_id"
+            )
+            params += [query, agent, limit] if agent else [query, limit]
+
+        sql = "SELECT * FROM (" + " UNION ALL ".join(parts) + ") ORDER BY rank LIMIT ?"
+        try:
+            rows = self._connection().execute(sql, params + [limit]).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid search query '{query}': {e}") from e
+        return [{key: row[key] for key in ("id", "original_filename", "timestamp", "field", "snippet")}
+                for row in rows]
+
+    def _search_like(self, query, limit, agent):
+        pattern = f"%{query}%"
+        connection = self._connection()
+        rows = []
+        if agent in (None, "content"):
+            rows += connection.execute(
+                "SELECT id, original_filename, timestamp, 'content' AS field, substr(content, 1, 80) AS snippet "
+                "FROM thoughts WHERE content LIKE ? LIMIT ?", (pattern, limit)
+            ).fetchall()
+        if agent != "content":
+            rows += connection.execute(
+                "SELECT t.id, t.original_filename, t.timestamp, s.agent AS field, substr(s.result, 1, 80) AS snippet "
+                "FROM stage_results s JOIN thoughts t ON t.id = s.thought_id "
+                "WHERE s.result LIKE ?" + (" AND s.agent = ?" if agent else "") + " LIMIT ?",
+                (pattern, agent, limit) if agent else (pattern, limit)
+            ).fetchall()
+        return [dict(row) for row in rows[:limit]]
+
+    def stats(self):
+        """Row counts of the stored thoughts and stage results."""
+        connection = self._connection()
+        return {
+            "thoughts": connection.execute("SELECT COUNT(*) FROM thoughts").fetchone()[0],
+            "stage_results": connection.execute("SELECT COUNT(*) FROM stage_results").fetchone()[0],
+            "full_text": self.full_text
+        }
+
+# Stores shared by every writer of the same database
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_result_store(path):
+    """Get the shared store of a database file, opening it on first use."""
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ResultStore(path)
+        return _stores[path]
@@ -0,0 +1,216 @@
+import os
+import json
+import logging
+import threading
+
+import numpy as np
+
+from adapters import LLMError
+
+logger = logging.getLogger(__name__)
+
+class SimilarityIndex:
+    """
+    Embedding vectors kept unit length in one NumPy matrix, so the cosine
+    similarity to every entry is a single matrix-vector product.
+    """
+
+    def __init__(self, capacity=1024):
+        self._matrix = None
+        self._capacity = capacity
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def normalize(vector):
+        """Convert a vector to float32 with unit length."""
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def add(self, vector):
+        """
+        Add a normalized vector.
+
+        Returns:
+            int: The row of the vector
+        """
+        if self._matrix is None:
+            self._matrix = np.empty((self._capacity, len(vector)), dtype=np.float32)
+        elif len(vector) != self._matrix.shape[1]:
+            raise ValueError(f"Vector has {len(vector)} dimensions, the index has {self._matrix.shape[1]}")
+        if self._size == len(self._matrix):
+            # Grow by doubling so adding stays cheap on average
+            grown = np.empty((2 * len(self._matrix), self._matrix.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+        self._matrix[self._size] = vector
+        self._size += 1
+        return self._size - 1
+
+    def most_similar(self, vector):
+        """
+        Find the entry most similar to a normalized vector.
+
+        Returns:
+            tuple: (row, cosine similarity), or (None, None) if the index is
+                empty or the vector has different dimensions
+        """
+        if not self._size or len(vector) != self._matrix.shape[1]:
+            return None, None
+        scores = self._matrix[:self._size] @ vector
+        row = int(np.argmax(scores))
+        return row, float(scores[row])
+
+class SemanticCache:
+    """
+    Reuses the stage results of processed thoughts for new thoughts that
+    say nearly the same thing.
+
+    Each new thought is embedded before its stages run. When its cosine
+    similarity to a processed thought reaches `threshold`, the stored
+    results of that thought are reused, and only the `rerun_stages` call
+    the LLM. Processed thoughts are appended to a JSON lines file with
+    their vector, so the index survives a restart.
+    """
+
+    def __init__(self, embed, path=None, threshold=0.95, rerun_stages=None, max_chars=8000):
+        """
+        Args:
+            embed (function): Returns the embedding vector of a text, raising
+                LLMError on failure
+            path (str): JSON lines file of processed thoughts, or None for memory only
+            threshold (float): Minimum cosine similarity to reuse results
+            rerun_stages (list): Agent IDs that always run for the new thought
+            max_chars (int): Content beyond this length is not embedded
+        """
+        self.embed = embed
+        self.path = path
+        self.threshold = threshold
+        self.rerun_stages = set(rerun_stages or [])
+        self.max_chars = max_chars
+
+        self.index = SimilarityIndex()
+        self._entries = []
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_calls = 0
+
+        if path:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash can leave a partial last line
+                    continue
+                self._add_entry(entry["id"], self.index.normalize(entry["vector"]), entry["results"])
+        logger.info(f"Loaded {len(self._entries)} processed thoughts into the semantic cache")
+
+    def _add_entry(self, thought_id, vector, results):
+        try:
+            self.index.add(vector)
+        except ValueError as e:
+            # Entries from a different embedding model
+            logger.warning(f"Skipping semantic cache entry {thought_id}: {e}")
+            return False
+        self._entries.append({"id": thought_id, "results": results})
+        return True
+
+    def embed_content(self, content):
+        """
+        Embed thought content.
+
+        Returns:
+            numpy.ndarray: The normalized vector, or None if embedding failed
+        """
+        try:
+            return self.index.normalize(self.embed(content[:self.max_chars]))
+        except LLMError as e:
+            logger.warning(f"Could not embed thought, processing it without the semantic cache: {e}")
+            return None
+
+    def reuse(self, thought_object, plan):
+        """
+        Look up the most similar processed thought.
+
+        On a match, the thought's `semantic_match` records the processed
+        thought and the reused stages.
+
+        Args:
+            thought_object (dict): The new thought
+            plan (PipelinePlan): The compiled pipeline plan
+
+        Returns:
+            tuple: (vector, reused) where reused maps agent IDs to the stage
+                results to use instead of calling the LLM
+        """
+        vector = self.embed_content(thought_object["content"])
+        if vector is None:
+            return None, {}
+
+        with self._lock:
+            row, similarity = self.index.most_similar(vector)
+            if row is None or similarity < self.threshold:
+                self.misses += 1
+                return vector, {}
+            entry = self._entries[row]
+
+            reused = {}
+            for stage in plan.stages:
+                if stage.agent_id in self.rerun_stages or stage.agent_id not in entry["results"]:
+                    continue
+                reused[stage.agent_id] = entry["results"][stage.agent_id]
+            saved = sum(1 for stage in plan.stages if stage.agent_id in reused and stage.template is not None)
+            self.hits += 1
+            self.saved_calls += saved
+
+        logger.info(f"Thought {thought_object.get('id')} is {similarity:.3f} similar to {entry['id']}, "
+                    f"reusing {len(reused)} stage results")
+        thought_object["semantic_match"] = {
+            "id": entry["id"],
+            "similarity": round(similarity, 4),
+            "reused_stages": list(reused)
+        }
+        return vector, reused
+
+    def add(self, thought_object, vector, plan):
+        """
+        Add a processed thought to the index.
+
+        Thoughts with failed stages or reused results are left out, so
+        only complete, original results are reused.
+        """
+        if vector is None or thought_object.get("stage_errors") or "semantic_match" in thought_object:
+            return
+        results = {stage.agent_id: thought_object.get(stage.result_key) for stage in plan.stages}
+
+        with self._lock:
+            if not self._add_entry(thought_object["id"], vector, results):
+                return
+            if self.path:
+                entry = {"id": thought_object["id"], "vector": vector.tolist(), "results": results}
+                with open(self.path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(entry) + "\n")
+
+    def stats(self):
+        """Lookup counters and the number of LLM calls saved."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "saved_calls": self.saved_calls
+            }
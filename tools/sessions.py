@@ -0,0 +1,84 @@
+import logging
+import threading
+
+from adapters import LLMError
+
+logger = logging.getLogger(__name__)
+
+# Stands in for the thought content in prompts sent within a session
+SESSION_CONTENT = "[the thought above]"
+
+class ThoughtSessions:
+    """
+    Sessions of one thought, one per LLM config used by several stages.
+
+    The first stage on a config opens the session, evaluating the thought
+    content once; later stages send only their instructions. A config used
+    by a single stage, an adapter without session support or a session
+    that failed to open gets None, and the stage sends its full prompt.
+    """
+
+    def __init__(self, content, config_names):
+        """
+        Args:
+            content (str): The thought content
+            config_names (list): The LLM config of every stage
+        """
+        self.content = content
+        counts = {}
+        for name in config_names:
+            name = self._resolve(name)
+            counts[name] = counts.get(name, 0) + 1
+        self._shared = {name for name, count in counts.items() if count > 1}
+        self._sessions = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _resolve(self, config_name):
+        from . import llm_handler
+        try:
+            return llm_handler.adapter_registry.resolve_name(config_name)
+        except (AttributeError, KeyError):
+            return config_name
+
+    def get(self, config_name):
+        """
+        Get the session of a config, opening it on first use.
+
+        Returns:
+            LLMSession: The session, or None if the stage should send its
+                full prompt
+        """
+        from .llm_handler import get_adapter
+
+        name = self._resolve(config_name)
+        if name not in self._shared:
+            return None
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+
+        # Parallel stages on the same config wait for one priming request
+        with lock:
+            if name not in self._sessions:
+                session = None
+                adapter, _ = get_adapter(name)
+                if adapter is not None:
+                    try:
+                        session = adapter.open_session(self.content)
+                    except LLMError as e:
+                        logger.warning(f"Could not open a session on LLM config '{name}': {e}")
+                self._sessions[name] = session
+            return self._sessions[name]
+
+    def record(self, thought_object):
+        """
+        Record the prompt evaluation savings in the thought's `session_metrics`.
+
+        Returns:
+            int: Prompt tokens not evaluated again thanks to the sessions
+        """
+        metrics = {name: session.stats() for name, session in self._sessions.items() if session is not None}
+        if not metrics:
+            return 0
+        thought_object["session_metrics"] = metrics
+        return sum(entry.get("saved_tokens", 0) for entry in metrics.values())
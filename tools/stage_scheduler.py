@@ -0,0 +1,177 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .document_processor import record_stage_result
+
+logger = logging.getLogger(__name__)
+
+def build_stage_graph(agent_pipeline, agents_config):
+    """
+    Build the stage dependency graph from the agent configuration.
+
+    An agent lists the stages it needs in `depends_on`. Agents without a
+    `depends_on` entry depend on the previous stage in the pipeline, which
+    keeps the original one-after-another behaviour.
+
+    Args:
+        agent_pipeline (list): Ordered (agent_id, agent_name) tuples
+        agents_config (dict): The `agents` section of the configuration
+
+    Returns:
+        dict: Mapping of agent_id to the list of agent_ids it depends on
+    """
+    stage_ids = [agent_id for agent_id, _ in agent_pipeline if agent_id in agents_config]
+    dependencies = {}
+    previous = None
+
+    for agent_id in stage_ids:
+        agent_config = agents_config.get(agent_id) or {}
+        if "depends_on" in agent_config:
+            depends_on = agent_config.get("depends_on") or []
+            if isinstance(depends_on, str):
+                depends_on = [depends_on]
+        else:
+            depends_on = [previous] if previous else []
+
+        for dependency in depends_on:
+            if dependency == agent_id:
+                raise ValueError(f"Agent '{agent_id}' cannot depend on itself")
+            if dependency not in stage_ids:
+                raise ValueError(f"Agent '{agent_id}' depends on unknown stage '{dependency}'")
+
+        dependencies[agent_id] = list(depends_on)
+        previous = agent_id
+
+    _check_for_cycles(dependencies)
+    return dependencies
+
+def _check_for_cycles(dependencies):
+    """Raise ValueError if the dependency graph contains a cycle."""
+    visiting, visited = set(), set()
+
+    def visit(agent_id, path):
+        if agent_id in visited:
+            return
+        if agent_id in visiting:
+            cycle = " -> ".join(path + [agent_id])
+            raise ValueError(f"Stage dependency cycle detected: {cycle}")
+        visiting.add(agent_id)
+        for dependency in dependencies.get(agent_id, []):
+            visit(dependency, path + [agent_id])
+        visiting.discard(agent_id)
+        visited.add(agent_id)
+
+    for agent_id in dependencies:
+        visit(agent_id, [])
+
+def run_stage_graph(thought_object, stages, dependencies, run_stage, max_parallel=None):
+    """
+    Run the stages of one thought, starting every stage whose dependencies
+    are complete at the same time.
+
+    Results are merged into the thought object in pipeline order, so the
+    processing history looks the same as a sequential run.
+
+    Args:
+        thought_object (dict): The thought object being processed
+        stages (list): Ordered (agent_id, agent_name) tuples to run
+        dependencies (dict): Mapping from build_stage_graph
+        run_stage (function): Called as run_stage(agent_id, agent_name), returns the result
+        max_parallel (int): Maximum number of stages running at once
+
+    Returns:
+        dict: The processed thought object
+    """
+    if not stages:
+        return thought_object
+
+    names = dict(stages)
+    order = [agent_id for agent_id, _ in stages]
+    pending = {agent_id: set(dependencies.get(agent_id, [])) & set(order) for agent_id in order}
+    completed = {}
+    merged = [0]
+
+    with ThreadPoolExecutor(max_workers=max_parallel or len(stages)) as pool:
+        running = {}
+
+        while pending or running:
+            # Start every stage whose dependencies have finished
+            for agent_id in _pop_ready_stages(order, pending, completed):
+                print(f"Processing with {names[agent_id]} agent...")
+                running[pool.submit(run_stage, agent_id, names[agent_id])] = agent_id
+
+            if not running:
+                raise ValueError(f"Stages can never run: {sorted(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                completed[running.pop(future)] = future.result()
+
+            _merge_completed(thought_object, order, names, completed, merged)
+
+    return thought_object
+
+async def arun_stage_graph(thought_object, stages, dependencies, arun_stage, max_parallel=None):
+    """
+    Async version of run_stage_graph.
+
+    Args:
+        thought_object (dict): The thought object being processed
+        stages (list): Ordered (agent_id, agent_name) tuples to run
+        dependencies (dict): Mapping from build_stage_graph
+        arun_stage (function): Coroutine function called as arun_stage(agent_id, agent_name)
+        max_parallel (int): Maximum number of stages running at once
+
+    Returns:
+        dict: The processed thought object
+    """
+    if not stages:
+        return thought_object
+
+    names = dict(stages)
+    order = [agent_id for agent_id, _ in stages]
+    pending = {agent_id: set(dependencies.get(agent_id, [])) & set(order) for agent_id in order}
+    completed = {}
+    merged = [0]
+    limit = asyncio.Semaphore(max_parallel or len(stages))
+
+    async def limited(agent_id):
+        async with limit:
+            return await arun_stage(agent_id, names[agent_id])
+
+    running = {}
+    try:
+        while pending or running:
+            for agent_id in _pop_ready_stages(order, pending, completed):
+                print(f"Processing with {names[agent_id]} agent...")
+                running[asyncio.ensure_future(limited(agent_id))] = agent_id
+
+            if not running:
+                raise ValueError(f"Stages can never run: {sorted(pending)}")
+
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                completed[running.pop(task)] = task.result()
+
+            _merge_completed(thought_object, order, names, completed, merged)
+    finally:
+        for task in running:
+            task.cancel()
+
+    return thought_object
+
+def _pop_ready_stages(order, pending, completed):
+    """Remove and return the pending stages whose dependencies are complete."""
+    ready = [agent_id for agent_id in order
+             if agent_id in pending and not (pending[agent_id] - completed.keys())]
+    for agent_id in ready:
+        del pending[agent_id]
+    return ready
+
+def _merge_completed(thought_object, order, names, completed, merged):
+    """Merge finished results into the thought object in pipeline order."""
+    while merged[0] < len(order) and order[merged[0]] in completed:
+        agent_id = order[merged[0]]
+        record_stage_result(thought_object, names[agent_id], completed[agent_id])
+        merged[0] += 1
@@ -0,0 +1,235 @@
+import math
+import logging
+import threading
+
+from adapters import LLMError
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# Rough characters per token for English text when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+TRUNCATION_NOTICE = "\n\n[Content truncated to fit the model's context window]"
+
+STRATEGIES = ("reject", "truncate", "route")
+
+class PromptTooLargeError(LLMError):
+    """Raised when a prompt does not fit the token budget of its LLM config."""
+
+class Tokenizer:
+    """Counts and truncates tokens with tiktoken, or estimates them from the text length."""
+
+    def __init__(self, encoding=None):
+        self.encoding = encoding
+
+    def count(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def truncate(self, text, max_tokens):
+        """Cut text down to at most max_tokens tokens."""
+        if max_tokens <= 0:
+            return ""
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+        return text[:max_tokens * CHARS_PER_TOKEN]
+
+_tokenizers = {}
+_tokenizers_lock = threading.Lock()
+
+def get_tokenizer(model, method="auto"):
+    """
+    Get the tokenizer for a model, created once per model.
+
+    tiktoken's encodings are exact for OpenAI models and a close estimate
+    for others. Without tiktoken, or when its encoding files cannot be
+    loaded, the token count is estimated from the text length.
+
+    Args:
+        model (str): The model name
+        method (str): "auto" to use tiktoken when possible, "estimate" to
+            always estimate from the text length
+    """
+    key = (model, method)
+    with _tokenizers_lock:
+        tokenizer = _tokenizers.get(key)
+        if tokenizer is not None:
+            return tokenizer
+
+    encoding = None
+    if method != "estimate" and tiktoken is not None:
+        try:
+            try:
+                encoding = tiktoken.encoding_for_model(model or "")
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            logger.warning(f"Could not load a tiktoken encoding for {model}, estimating tokens instead: {e}")
+
+    tokenizer = Tokenizer(encoding)
+    with _tokenizers_lock:
+        return _tokenizers.setdefault(key, tokenizer)
+
+class TokenBudget:
+    """
+    Keeps prompts within the context window of their LLM config.
+
+    A prompt may use `context_window - max_tokens - reserve_tokens` tokens.
+    Prompts over budget are handled by the config's `overflow` strategy,
+    or the default one:
+
+    - reject: fail the stage without calling the LLM
+    - truncate: shorten the thought content until the prompt fits
+    - route: send the prompt to the config with the smallest context
+      window that fits it, truncating when none does. Targets are the
+      config's `overflow_configs`, or else the configs of the same adapter,
+      so prompts never leave for e.g. a paid API unless a config opts in
+    """
+
+    def __init__(self, get_config, config_names, strategy="truncate", reserve_tokens=0, tokenizer="auto"):
+        """
+        Args:
+            get_config (function): Returns the llm_configs entry for a config name
+            config_names (function): Returns the names of all configs
+            strategy (str): Default overflow strategy
+            reserve_tokens (int): Tokens kept free for tokenizer differences
+            tokenizer (str): "auto" or "estimate", see get_tokenizer
+        """
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown token budget strategy '{strategy}', expected one of {STRATEGIES}")
+        self.get_config = get_config
+        self.config_names = config_names
+        self.strategy = strategy
+        self.reserve_tokens = reserve_tokens
+        self.tokenizer = tokenizer
+
+        self.truncated_count = 0
+        self.routed_count = 0
+        self.rejected_count = 0
+
+    def budget_for(self, config_name):
+        """
+        Get the prompt token budget of a config.
+
+        Returns:
+            int: The budget, or None if the config has no context_window
+        """
+        config = self.get_config(config_name)
+        context_window = config.get("context_window")
+        if not context_window:
+            return None
+        return context_window - config.get("max_tokens", 0) - self.reserve_tokens
+
+    def content_budget(self, template, config_name, system_prompt=None):
+        """
+        Get the tokens left for the content in a prompt of a config, after
+        the template and the system prompt.
+
+        Returns:
+            int: Tokens per copy of the content, or None if the config has
+                no context_window
+        """
+        budget = self.budget_for(config_name)
+        if budget is None:
+            return None
+        overhead = self.count(template.render(""), config_name)
+        if system_prompt:
+            overhead += self.count(system_prompt, config_name)
+        # The content is repeated once per placeholder in the template
+        placeholders = max(1, len(template.parts) - 1)
+        return max(0, (budget - overhead) // placeholders)
+
+    def count(self, text, config_name):
+        """Count the tokens of a text for a config's model."""
+        return get_tokenizer(self.get_config(config_name).get("model"), self.tokenizer).count(text)
+
+    def fit(self, template, content, config_name, system_prompt=None):
+        """
+        Fill in a template, keeping the prompt within the token budget.
+
+        Args:
+            template (CompiledTemplate): The stage's prompt template
+            content (str): The thought content
+            config_name (str): The stage's LLM config
+            system_prompt (str): System prompt sent with the prompt, whose
+                tokens are taken from the budget
+
+        Returns:
+            tuple: (prompt, name of the config to send it to)
+
+        Raises:
+            PromptTooLargeError: If the prompt is over budget and the
+                strategy is reject
+        """
+        prompt = template.render(content)
+        budget = self.budget_for(config_name)
+        if budget is None:
+            return prompt, config_name
+
+        system_tokens = self.count(system_prompt, config_name) if system_prompt else 0
+        budget -= system_tokens
+        tokens = self.count(prompt, config_name)
+        if tokens <= budget:
+            return prompt, config_name
+
+        config = self.get_config(config_name)
+        strategy = config.get("overflow", self.strategy)
+
+        if strategy == "route":
+            target = self._find_larger_config(prompt, config_name, config, system_tokens)
+            if target is not None:
+                logger.info(f"Prompt of {tokens} tokens exceeds the {budget} token budget of "
+                            f"'{config_name}', routing to '{target}'")
+                self.routed_count += 1
+                return prompt, target
+            strategy = "truncate"
+
+        if strategy == "truncate":
+            logger.warning(f"Prompt of {tokens} tokens exceeds the {budget} token budget of "
+                           f"'{config_name}', truncating the thought content")
+            self.truncated_count += 1
+            return self._truncate(template, content, budget, config_name), config_name
+
+        self.rejected_count += 1
+        raise PromptTooLargeError(
+            f"Prompt of {tokens} tokens exceeds the {budget} token budget of '{config_name}'"
+        )
+
+    def _find_larger_config(self, prompt, config_name, config, system_tokens=0):
+        """Find the config with the smallest budget that still fits the prompt."""
+        explicit = config.get("overflow_configs")
+        best, best_budget = None, None
+        for name in explicit or self.config_names():
+            if name == config_name:
+                continue
+            try:
+                if not explicit and self.get_config(name).get("adapter") != config.get("adapter"):
+                    continue
+                budget = self.budget_for(name)
+            except KeyError:
+                continue
+            if budget is None or (best_budget is not None and budget >= best_budget):
+                continue
+            if self.count(prompt, name) + system_tokens <= budget:
+                best, best_budget = name, budget
+        return best
+
+    def _truncate(self, template, content, budget, config_name):
+        """Shorten the content so the filled template fits the budget."""
+        tokenizer = get_tokenizer(self.get_config(config_name).get("model"), self.tokenizer)
+        overhead = tokenizer.count(template.render("")) + tokenizer.count(TRUNCATION_NOTICE)
+        # The content is repeated once per placeholder in the template
+        placeholders = max(1, len(template.parts) - 1)
+        content_budget = (budget - overhead) // placeholders
+        if content_budget <= 0:
+            raise PromptTooLargeError(
+                f"The prompt template alone exceeds the {budget} token budget of '{config_name}'"
+            )
+        return template.render(tokenizer.truncate(content, content_budget) + TRUNCATION_NOTICE)
@@ -0,0 +1,350 @@
+import os
+import json
+import logging
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Rows scored per matrix product in exhaustive searches, bounding memory use
+SEARCH_BLOCK_ROWS = 65536
+
+def normalize(vectors):
+    """Convert vectors to float32 rows of unit length."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+def top_k(scores, k):
+    """
+    Indices of the k highest scores, highest first.
+
+    Returns:
+        numpy.ndarray: Up to k indices into scores
+    """
+    if len(scores) > k:
+        candidates = np.argpartition(scores, -k)[-k:]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+def kmeans(vectors, clusters, iterations=10, seed=0):
+    """
+    Spherical k-means over unit vectors.
+
+    Returns:
+        numpy.ndarray: (clusters, dimensions) unit centroids
+    """
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = ~sums.any(axis=1)
+        # Restart empty clusters from random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+class VectorIndex:
+    """
+    Cosine similarity search over unit-length float32 vectors.
+
+    Vectors are appended to a raw float32 file, which is memory-mapped for
+    searching, and their entries to a JSON lines file. Small indexes are
+    searched exhaustively in blocks of matrix products. Once an index
+    reaches `ivf_min_rows` it is partitioned IVF-style: k-means centroids
+    split the rows into `nlist` lists and a search only scores the rows of
+    the `nprobe` lists nearest to the query. The partitioning is trained
+    on a background thread, again whenever the index doubled since, and
+    saved with the index; rebuild trains it right away.
+    """
+
+    def __init__(self, path=None, nlist=None, nprobe=8, ivf_min_rows=20000):
+        """
+        Args:
+            path (str): Folder for the index files, or None for memory only
+            nlist (int): IVF lists, or None for sqrt(rows)
+            nprobe (int): Lists searched per query
+            ivf_min_rows (int): Rows before the index is partitioned, or 0
+                to always search exhaustively
+        """
+        self.path = path
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+
+        self.dimensions = None
+        self._entries = []
+        self._rows_by_id = {}
+        self._matrix = None
+        self._mapped_rows = 0
+        self._lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._rebuild_thread = None
+
+        self._centroids = None
+        self._trained_rows = 0
+        self._list_order = None
+        self._list_offsets = None
+        self._assigned_rows = 0
+        self._pending_lists = {}
+
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, entry_id):
+        return entry_id in self._rows_by_id
+
+    def _load(self):
+        meta_path = self._file("meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as file:
+                self.dimensions = json.load(file)["dimensions"]
+
+        entries_path = self._file("entries.jsonl")
+        if os.path.exists(entries_path):
+            with open(entries_path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        self._entries.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # A crash can leave a partial last line
+                        break
+
+        vectors_path = self._file("vectors.f32")
+        row_bytes = 4 * (self.dimensions or 0)
+        stored_rows = os.path.getsize(vectors_path) // row_bytes if row_bytes and os.path.exists(vectors_path) else 0
+        count = min(stored_rows, len(self._entries))
+        if os.path.exists(vectors_path) and os.path.getsize(vectors_path) != count * row_bytes:
+            # Drop whatever a crash left beyond the last complete entry
+            with open(vectors_path, 'r+b') as file:
+                file.truncate(count * row_bytes)
+        if len(self._entries) != count:
+            self._entries = self._entries[:count]
+            with open(entries_path, 'w', encoding='utf-8') as file:
+                file.writelines(json.dumps(entry) + "\n" for entry in self._entries)
+        self._rows_by_id = {entry["id"]: row for row, entry in enumerate(self._entries)}
+
+        ivf_path = self._file("ivf.npz")
+        if count and os.path.exists(ivf_path):
+            saved = np.load(ivf_path)
+            if saved["assignments"].shape[0] <= count and saved["centroids"].shape[1] == self.dimensions:
+                self._centroids = saved["centroids"]
+                self._trained_rows = int(saved["trained_rows"])
+                assignments = saved["assignments"]
+                if len(assignments) < count:
+                    # Rows appended since the lists were last saved
+                    assignments = np.concatenate([
+                        assignments, self._nearest_lists(self._vectors(), self._centroids, len(assignments), count)
+                    ])
+                    self._save_lists(assignments)
+                self._build_lists(assignments)
+        self._update_partitioning()
+        logger.info(f"Loaded vector index with {count} entries from {self.path}")
+
+    def _vectors(self):
+        """The matrix of all rows, mapped again after rows were appended."""
+        if self.path and self._mapped_rows != len(self._entries):
+            self._matrix = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode='r',
+                                     shape=(len(self._entries), self.dimensions))
+            self._mapped_rows = len(self._entries)
+        return self._matrix[:len(self._entries)]
+
+    def add(self, vectors, entries):
+        """
+        Append vectors with their entries.
+
+        Args:
+            vectors (list): Vectors, normalized to unit length here
+            entries (list): One dict per vector, each with a unique "id";
+                entries already in the index are skipped
+
+        Raises:
+            ValueError: If the vectors have different dimensions than the index
+        """
+        vectors = normalize(vectors)
+        with self._lock:
+            keep = [i for i, entry in enumerate(entries) if entry["id"] not in self._rows_by_id]
+            if not keep:
+                return
+            vectors = vectors[keep]
+            entries = [entries[i] for i in keep]
+            if self.dimensions is None:
+                self.dimensions = vectors.shape[1]
+                if self.path:
+                    with open(self._file("meta.json"), 'w', encoding='utf-8') as file:
+                        json.dump({"dimensions": self.dimensions}, file)
+            elif vectors.shape[1] != self.dimensions:
+                raise ValueError(f"Vectors have {vectors.shape[1]} dimensions, the index has {self.dimensions}")
+
+            first_row = len(self._entries)
+            if self.path:
+                with open(self._file("vectors.f32"), 'ab') as file:
+                    file.write(vectors.tobytes())
+                with open(self._file("entries.jsonl"), 'a', encoding='utf-8') as file:
+                    file.writelines(json.dumps(entry) + "\n" for entry in entries)
+            else:
+                self._append_in_memory(vectors)
+            for offset, entry in enumerate(entries):
+                self._entries.append(entry)
+                self._rows_by_id[entry["id"]] = first_row + offset
+
+            if self._centroids is not None:
+                for offset, cluster in enumerate(np.argmax(vectors @ self._centroids.T, axis=1)):
+                    self._pending_lists.setdefault(int(cluster), []).append(first_row + offset)
+            self._update_partitioning()
+
+    def _append_in_memory(self, vectors):
+        size = len(self._entries)
+        if self._matrix is None:
+            self._matrix = np.empty((max(1024, len(vectors)), self.dimensions), dtype=np.float32)
+        if size + len(vectors) > len(self._matrix):
+            # Grow by doubling so appending stays cheap on average
+            grown = np.empty((max(2 * len(self._matrix), size + len(vectors)), self.dimensions), dtype=np.float32)
+            grown[:size] = self._matrix[:size]
+            self._matrix = grown
+        self._matrix[size:size + len(vectors)] = vectors
+
+    @property
+    def partitioned(self):
+        """Whether searches use the IVF lists."""
+        return self._centroids is not None
+
+    def _needs_partitioning(self):
+        count = len(self._entries)
+        if not self.ivf_min_rows or count < self.ivf_min_rows:
+            return False
+        return self._centroids is None or count >= 2 * self._trained_rows
+
+    def _update_partitioning(self):
+        """Start training the IVF lists in the background once the index is large enough, or doubled."""
+        if not self._needs_partitioning():
+            return
+        if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+            return
+        self._rebuild_thread = threading.Thread(target=self._rebuild_if_needed, name="vector-index-rebuild",
+                                                daemon=True)
+        self._rebuild_thread.start()
+
+    def _rebuild_if_needed(self):
+        with self._lock:
+            needed = self._needs_partitioning()
+        if needed:
+            self.rebuild()
+
+    def rebuild(self):
+        """
+        Train the IVF partitioning on the current rows and save it.
+
+        k-means runs without holding the index lock, so adds and searches
+        go on meanwhile, exhaustively or with the previous lists; rows added
+        during training are assigned to the new lists afterwards.
+        """
+        with self._rebuild_lock:
+            with self._lock:
+                count = len(self._entries)
+                if not count or (self._centroids is not None and self._trained_rows == count):
+                    return
+                # Rows below count are never rewritten, so this view stays valid
+                vectors = self._vectors()
+
+            nlist = min(self.nlist or int(np.sqrt(count)), count)
+            sample_size = min(count, 32 * nlist)
+            sample = np.random.RandomState(0).choice(count, sample_size, replace=False)
+            logger.info(f"Partitioning vector index of {count} entries into {nlist} lists")
+            centroids = kmeans(np.asarray(vectors[np.sort(sample)]), nlist)
+            assignments = self._nearest_lists(vectors, centroids, 0, count)
+
+            with self._lock:
+                added = self._nearest_lists(self._vectors(), centroids, count, len(self._entries))
+                assignments = np.concatenate([assignments, added])
+                self._centroids = centroids
+                self._trained_rows = count
+                self._build_lists(assignments)
+                self._save_lists(assignments)
+
+    @staticmethod
+    def _nearest_lists(vectors, centroids, start, stop):
+        """The nearest list of each row from start to stop."""
+        assignments = [np.empty(0, dtype=np.int32)]
+        for block in range(start, stop, SEARCH_BLOCK_ROWS):
+            block_vectors = np.asarray(vectors[block:min(block + SEARCH_BLOCK_ROWS, stop)])
+            assignments.append(np.argmax(block_vectors @ centroids.T, axis=1).astype(np.int32))
+        return np.concatenate(assignments)
+
+    def _save_lists(self, assignments):
+        if self.path:
+            temp_path = self._file("ivf.tmp.npz")
+            np.savez(temp_path, centroids=self._centroids, assignments=assignments,
+                     trained_rows=self._trained_rows)
+            os.replace(temp_path, self._file("ivf.npz"))
+
+    def _build_lists(self, assignments):
+        self._list_order = np.argsort(assignments, kind="stable")
+        self._list_offsets = np.searchsorted(assignments[self._list_order], np.arange(len(self._centroids) + 1))
+        self._assigned_rows = len(assignments)
+        self._pending_lists = {}
+
+    def _candidate_rows(self, query):
+        probes = top_k(self._centroids @ query, self.nprobe)
+        rows = [self._list_order[self._list_offsets[c]:self._list_offsets[c + 1]] for c in probes]
+        rows += [np.asarray(self._pending_lists[c], dtype=np.int64) for c in probes if c in self._pending_lists]
+        return np.sort(np.concatenate(rows))
+
+    def search(self, vectors, k=5, exclude=()):
+        """
+        Find the most similar entries of one or more query vectors.
+
+        Args:
+            vectors (list): Query vectors
+            k (int): Results per query
+            exclude (set): Entry IDs to leave out, e.g. the query's own
+
+        Returns:
+            list: Per query, a list of (entry, cosine similarity) tuples,
+                most similar first
+        """
+        queries = normalize(vectors)
+        wanted = k + len(exclude)
+        with self._lock:
+            if not self._entries or queries.shape[1] != self.dimensions:
+                return [[] for _ in queries]
+            matrix = self._vectors()
+
+            if self._centroids is None:
+                # Exhaustive search, keeping the best rows of every block
+                best_rows = [np.empty(0, dtype=np.int64) for _ in queries]
+                best_scores = [np.empty(0, dtype=np.float32) for _ in queries]
+                for block in range(0, len(matrix), SEARCH_BLOCK_ROWS):
+                    scores = np.asarray(matrix[block:block + SEARCH_BLOCK_ROWS]) @ queries.T
+                    for q in range(len(queries)):
+                        rows = np.concatenate([best_rows[q], block + np.arange(len(scores))])
+                        merged = np.concatenate([best_scores[q], scores[:, q]])
+                        keep = top_k(merged, wanted)
+                        best_rows[q], best_scores[q] = rows[keep], merged[keep]
+                found = list(zip(best_rows, best_scores))
+            else:
+                found = []
+                for query in queries:
+                    rows = self._candidate_rows(query)
+                    scores = matrix[rows] @ query
+                    keep = top_k(scores, wanted)
+                    found.append((rows[keep], scores[keep]))
+
+            results = []
+            for rows, scores in found:
+                hits = [(self._entries[row], float(score)) for row, score in zip(rows, scores)
+                        if self._entries[row]["id"] not in exclude]
+                results.append(hits[:k])
+            return results
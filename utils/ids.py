@@ -0,0 +1,66 @@
+# utils/ids.py
+import os
+import time
+import threading
+from datetime import datetime, timezone
+
+# Crockford base32 alphabet used by ULIDs
+ENCODING = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_DECODING = {char: index for index, char in enumerate(ENCODING)}
+
+_lock = threading.Lock()
+_last_millis = 0
+_last_random = 0
+
+def _encode(value: int, length: int) -> str:
+    chars = []
+    for _ in range(length):
+        value, remainder = divmod(value, 32)
+        chars.append(ENCODING[remainder])
+    return "".join(reversed(chars))
+
+def new_ulid() -> str:
+    """
+    Generate a monotonic ULID: 48 bits of milliseconds followed by 80 random bits.
+
+    IDs created in the same millisecond increment the random part, so they
+    are unique and sort in creation order.
+    """
+    global _last_millis, _last_random
+
+    with _lock:
+        millis = int(time.time() * 1000)
+        if millis <= _last_millis:
+            millis = _last_millis
+            _last_random += 1
+            if _last_random >= 1 << 80:
+                # Random part overflowed; move on to the next millisecond
+                millis += 1
+                _last_random = int.from_bytes(os.urandom(10), "big") >> 1
+        else:
+            # Leave headroom so increments within one millisecond cannot overflow
+            _last_random = int.from_bytes(os.urandom(10), "big") >> 1
+        _last_millis = millis
+
+        return _encode(millis, 10) + _encode(_last_random, 16)
+
+def new_thought_id() -> str:
+    """Generate a unique, sortable thought ID."""
+    return f"thought_{new_ulid()}"
+
+def ulid_datetime(ulid: str):
+    """
+    Get the creation time encoded in a ULID.
+
+    Returns:
+        datetime: UTC creation time, or None if the value is not a ULID
+    """
+    if len(ulid) != 26:
+        return None
+    try:
+        millis = 0
+        for char in ulid[:10]:
+            millis = millis * 32 + _DECODING[char]
+    except KeyError:
+        return None
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)